@@ -0,0 +1,282 @@
+"""
+A local stand-in for the datacube behind the WPS: synthetic COGs on local disk for each product
+of the process catalog, indexed into an in-memory datacube index.
+"""
+import copy
+import itertools
+import os
+import uuid
+
+import numpy as np
+import pandas
+import rasterio
+from affine import Affine
+from datacube import Datacube
+from datacube.api.core import select_datasets_inside_polygon
+from datacube.api.query import Query
+from datacube.config import LocalConfig
+from datacube.index.hl import Doc2Dataset
+from datacube.model import Range
+from datacube.utils.geometry import CRS, Geometry
+
+CRS_3577 = CRS("EPSG:3577")
+RESOLUTION = 30
+
+# upper left corner of the synthetic scenes, on the coast near Brisbane (in EPSG:3577)
+ORIGIN = (2040000.0, -3130000.0)
+
+# distinct scenes of synthetic data per product, which the dated datasets cycle through
+SCENES = 4
+
+# the fmask values of Landsat ARD: nodata, clear, cloud, cloud shadow, snow and water
+FMASK = [0, 1, 2, 3, 4, 5]
+
+WOFS_FLAGS = {
+    "nodata": {"bits": 0, "values": {"0": False, "1": True}},
+    "noncontiguous": {"bits": 1, "values": {"0": False, "1": True}},
+    "low_solar_angle": {"bits": 2, "values": {"0": False, "1": True}},
+    "terrain_shadow": {"bits": 3, "values": {"0": False, "1": True}},
+    "high_slope": {"bits": 4, "values": {"0": False, "1": True}},
+    "cloud_shadow": {"bits": 5, "values": {"0": False, "1": True}},
+    "cloud": {"bits": 6, "values": {"0": False, "1": True}},
+    "water_observed": {"bits": 7, "values": {"0": False, "1": True}},
+    "dry": {"bits": [7, 6, 5, 4, 3, 1, 0], "values": {"0": True}},
+    "wet": {"bits": [7, 6, 5, 4, 3, 1, 0], "values": {"128": True}},
+}
+
+ARD_BANDS = ["blue", "green", "red", "nir", "swir1", "swir2"]
+
+
+def _measurement(name, dtype, nodata, **extra):
+    return {"name": name, "dtype": dtype, "nodata": nodata, "units": "1", **extra}
+
+
+ARD_MEASUREMENTS = ([_measurement(name, "int16", -999) for name in ARD_BANDS] +
+                    [_measurement("fmask", "uint8", 0), _measurement("nbart_contiguity", "uint8", 255)])
+
+# the products of datacube-wps-config.yaml, with (a subset of) their measurements
+PRODUCTS = {
+    "ga_ls_wo_3": [_measurement("water", "uint8", 1, flags_definition=WOFS_FLAGS)],
+    "ga_ls_fc_3": [_measurement(name, "uint8", 255) for name in ["bs", "pv", "npv", "ue"]],
+    "ls_s2_fc_c3": [_measurement(name, "uint8", 255) for name in ["bs", "pv", "npv", "ue"]],
+    "ga_ls_mangrove_cover_cyear_3": [_measurement("canopy_cover_class", "uint8", 255)],
+    **{product: ARD_MEASUREMENTS for product in ["ga_ls8c_ard_3", "ga_ls7e_ard_3", "ga_ls5t_ard_3"]},
+}
+
+ANNUAL_PRODUCTS = {"ga_ls_mangrove_cover_cyear_3"}
+
+# the operational periods of the Landsat sensors, as in the `time_windows` of the catalog
+SENSOR_PERIODS = {
+    "ga_ls5t_ard_3": [(None, "1999-12-31"), ("2003-01-01", "2011-12-31")],
+    "ga_ls7e_ard_3": [(None, "2003-05-31"), ("2010-01-01", "2013-05-31")],
+    "ga_ls8c_ard_3": [("2013-01-01", None)],
+}
+
+
+def _in_periods(time, periods):
+    return any((start is None or time >= pandas.Timestamp(start)) and
+               (end is None or time <= pandas.Timestamp(end)) for start, end in periods)
+
+
+def scene_transform():
+    return Affine(RESOLUTION, 0, ORIGIN[0], 0, -RESOLUTION, ORIGIN[1])
+
+
+def scene_centre(size):
+    """The centre of the synthetic scenes of `size` pixels square, in EPSG:3577"""
+    return ORIGIN[0] + size * RESOLUTION / 2, ORIGIN[1] - size * RESOLUTION / 2
+
+
+def square(side, size):
+    """A polygon (in EPSG:4326, like a request) of `side` metres square, rotated and centred in the scenes"""
+    x, y = scene_centre(size)
+    half = side / 2
+    # a diamond rather than an axis aligned square, so that masking has partially covered chunks
+    ring = [(x, y + half), (x + half, y), (x, y - half), (x - half, y), (x, y + half)]
+    return Geometry({"type": "Polygon", "coordinates": [ring]}, crs=CRS_3577).to_crs("EPSG:4326")
+
+
+def point(size):
+    x, y = scene_centre(size)
+    return Geometry({"type": "Point", "coordinates": (x, y)}, crs=CRS_3577).to_crs("EPSG:4326")
+
+
+def _field(rng, shape, low, high):
+    """A smooth random field between `low` and `high`, which compresses like real imagery"""
+    coarse = rng.uniform(low, high, size=(shape[0] // 32 + 2, shape[1] // 32 + 2))
+    field = np.kron(coarse, np.ones((32, 32)))[:shape[0], :shape[1]]
+    return field + rng.normal(0, (high - low) / 50, size=shape)
+
+
+def _choice(rng, shape, values, weights):
+    coarse = rng.choice(values, p=np.array(weights) / np.sum(weights), size=(shape[0] // 16 + 1, shape[1] // 16 + 1))
+    return np.kron(coarse, np.ones((16, 16), dtype=coarse.dtype))[:shape[0], :shape[1]]
+
+
+def synthetic_band(product, band, shape, scene, seed):
+    """
+    Synthetic data for `band` of `product`, with a realistic share of nodata and masked pixels.
+    Odd scenes are cloudy, so that drills drop some of the time slices (e.g. in the prefilter of WIT).
+    """
+    # pylint: disable=too-many-return-statements
+    rng = np.random.default_rng(seed)
+    cloudy = scene % 2 == 1
+    if band == "water":
+        # dry, wet, cloud, cloud shadow and nodata
+        weights = [50, 10, 25, 12, 3] if cloudy else [78, 20, 1, 1, 0]
+        return _choice(rng, shape, [0, 128, 64, 32, 1], weights).astype("uint8")
+    if band in ("bs", "pv", "npv", "ue"):
+        data = np.clip(_field(rng, shape, 0, 100), 0, 100).astype("uint8")
+        data[_choice(rng, shape, [False, True], [99, 1])] = 255
+        return data
+    if band == "canopy_cover_class":
+        return _choice(rng, shape, [255, 1, 2, 3], [60, 15, 15, 10]).astype("uint8")
+    if band == "fmask":
+        weights = [3, 45, 30, 15, 1, 6] if cloudy else [0, 90, 1, 1, 0, 8]
+        return _choice(rng, shape, FMASK, weights).astype("uint8")
+    if band == "nbart_contiguity":
+        return _choice(rng, shape, [1, 0], [99, 1]).astype("uint8")
+    if band in ARD_BANDS:
+        return np.clip(_field(rng, shape, 100, 4000), 0, 10000).astype("int16")
+    raise ValueError(f"no synthetic data for {band} of {product}")
+
+
+def write_cog(path, data, nodata, size):
+    profile = {"driver": "COG", "width": size, "height": size, "count": 1, "dtype": str(data.dtype),
+               "crs": str(CRS_3577), "transform": scene_transform(), "nodata": nodata,
+               "compress": "deflate", "blocksize": 512}
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(data, 1)
+
+
+def write_scenes(data_dir, size, scenes=SCENES):
+    """The COGs of `scenes` synthetic scenes of `size` pixels square per product, written unless they exist"""
+    paths = {}
+    for product, measurements in PRODUCTS.items():
+        for scene in range(scenes):
+            directory = os.path.join(data_dir, f"{size}", product, f"scene{scene}")
+            os.makedirs(directory, exist_ok=True)
+            for index, measurement in enumerate(measurements):
+                path = os.path.join(directory, f"{measurement['name']}.tif")
+                if not os.path.exists(path):
+                    data = synthetic_band(product, measurement["name"], (size, size), scene, scene * 1000 + index)
+                    write_cog(path, data, measurement["nodata"], size)
+                paths[(product, scene, measurement["name"])] = path
+    return paths
+
+
+def product_doc(name, measurements, metadata_type="eo3"):
+    return {"name": name, "description": f"synthetic {name}", "metadata_type": metadata_type,
+            "metadata": {"product": {"name": name}}, "measurements": copy.deepcopy(measurements),
+            "load": {"crs": "EPSG:3577", "resolution": {"x": RESOLUTION, "y": -RESOLUTION},
+                     "align": {"x": 0, "y": 0}}}
+
+
+def dataset_doc(product, time, paths, scene, size):
+    return {
+        "$schema": "https://schemas.opendatacube.org/dataset",
+        "id": str(uuid.uuid5(uuid.NAMESPACE_URL, f"{product}/{size}/{time.isoformat()}")),
+        "product": {"name": product},
+        "crs": "epsg:3577",
+        "grids": {"default": {"shape": [size, size], "transform": list(scene_transform())[:6] + [0, 0, 1]}},
+        "properties": {"datetime": time.isoformat() + "Z", "odc:file_format": "GeoTIFF",
+                       "gqa:abs_iterative_mean_xy": 0.3},
+        "measurements": {measurement["name"]: {"path": "file://" + paths[(product, scene, measurement["name"])]}
+                         for measurement in PRODUCTS[product]},
+        "lineage": {},
+    }
+
+
+def ard_metadata_type(eo3):
+    """eo3 with the geometric quality search field that the catalog queries Landsat ARD by"""
+    doc = copy.deepcopy(eo3.definition)
+    doc["name"] = "eo3_landsat_ard"
+    doc["dataset"]["search_fields"]["gqa_iterative_mean_xy"] = {
+        "description": "Geometric accuracy (iterative mean xy)",
+        "type": "double",
+        "offset": ["properties", "gqa:abs_iterative_mean_xy"],
+    }
+    return doc
+
+
+def observation_times(start, end, days=16):
+    """The times of the (synthetic) observations between `start` and `end`, every `days` days"""
+    return list(pandas.date_range(start, end, freq=f"{days}D"))
+
+
+def _matches(value, search):
+    """Whether the `value` of a search field of a dataset matches a search term, as in the postgres index"""
+    if value is None:
+        return False
+    if not isinstance(search, Range):
+        search = Range(search, search)
+    if not isinstance(value, Range):
+        value = Range(value, value)
+    return ((search.begin is None or value.end is None or value.end >= search.begin) and
+            (search.end is None or value.begin is None or value.begin <= search.end))
+
+
+class LocalDatacube(Datacube):
+    """
+    A `Datacube` on the in-memory index, which does not search by ranges (of time, space or e.g.
+    geometric quality) or by range fields: the index only selects the datasets of the product,
+    and the search terms are matched here
+    """
+
+    def find_datasets_lazy(self, limit=None, ensure_location=False, dataset_predicate=None, **kwargs):
+        query = Query(self.index, **kwargs)
+        if not query.product:
+            raise ValueError("must specify a product")
+
+        terms = {name: value for name, value in query.search_terms.items() if name != "product"}
+
+        def matches(dataset):
+            fields = dataset.metadata_type.dataset_fields
+            return (all(_matches(fields[name].extract(dataset.metadata_doc), search)
+                        for name, search in terms.items()) and
+                    (not ensure_location or dataset.uris) and
+                    (dataset_predicate is None or dataset_predicate(dataset)))
+
+        datasets = (dataset for dataset in self.index.datasets.search(product=query.product) if matches(dataset))
+        if query.geopolygon is not None:
+            datasets = select_datasets_inside_polygon(datasets, query.geopolygon)
+        return itertools.islice(datasets, limit)
+
+
+def local_datacube(data_dir, size=1024, start="2019-01-01", end="2020-12-31", config_path=None):
+    """
+    A `Datacube` with an in-memory index of synthetic datasets of `size` pixels square for every product
+    of the process catalog, one every 16 days (at the start of each year for annual products) between `start` and `end`
+    """
+    # pylint: disable=too-many-locals
+    if config_path is None:
+        config_path = os.path.join(data_dir, "datacube.conf")
+        os.makedirs(data_dir, exist_ok=True)
+        with open(config_path, "w", encoding="utf-8") as f:
+            f.write("[localcube]\nindex_driver: memory\n")
+
+    dc = LocalDatacube(config=LocalConfig.find(paths=[config_path], env="localcube"), app="datacube-wps-benchmark")
+    eo3 = dc.index.metadata_types.get_by_name("eo3")
+    dc.index.metadata_types.add(dc.index.metadata_types.from_doc(ard_metadata_type(eo3)))
+
+    for name, measurements in PRODUCTS.items():
+        metadata_type = "eo3_landsat_ard" if name in SENSOR_PERIODS else "eo3"
+        dc.index.products.add_document(product_doc(name, measurements, metadata_type))
+
+    paths = write_scenes(data_dir, size)
+    resolver = Doc2Dataset(dc.index)
+    times = observation_times(start, end)
+    years = pandas.date_range(start, end, freq="YS")
+
+    for name in PRODUCTS:
+        product_times = years if name in ANNUAL_PRODUCTS else times
+        for index, time in enumerate(product_times):
+            if name in SENSOR_PERIODS and not _in_periods(time, SENSOR_PERIODS[name]):
+                continue
+            doc = dataset_doc(name, time.to_pydatetime(), paths, index % SCENES, size)
+            dataset, error = resolver(doc, "file://" + os.path.join(data_dir, f"{size}", name, f"{doc['id']}.yaml"))
+            if error is not None:
+                raise ValueError(f"could not index {doc['id']} of {name}: {error}")
+            dc.index.datasets.add(dataset, with_lineage=False)
+
+    return dc
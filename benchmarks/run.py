@@ -0,0 +1,329 @@
+"""
+End-to-end benchmarks of the processes of the catalog, on synthetic data indexed into a local datacube
+(see `benchmarks.localcube`), so that the performance of commits can be compared without the live index.
+
+    python -m benchmarks.run --output before.json
+    python -m benchmarks.run --output after.json
+    python -m benchmarks.run --compare before.json after.json
+
+Each case is a process, a polygon size and a time range. A request is timed from its `query_handler`:
+the index query, loading, masking and reducing the data and building the chart, but not rendering
+the outputs or uploading them to S3.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from timeit import default_timer
+
+import numpy as np
+import psutil
+
+from .localcube import local_datacube, point, square
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# sides (in metres) of the polygons of each size, which fit within a scene of the default size
+POLYGON_SIDES = {"small": 3000, "medium": 12000, "large": 24000}
+
+TIME_RANGES = {"3 months": ("2019-01-01", "2019-03-31"), "1 year": ("2019-01-01", "2019-12-31")}
+
+PROCESSES = ["WOfSDrill", "FractionalCoverDrill", "LSFractionalCoverDrill", "Mangrove Cover Drill", "WIT"]
+
+# a relative slowdown of the median latency of a case beyond which `--compare` reports a regression
+REGRESSION_THRESHOLD = 0.1
+
+MB = 1024**2
+
+
+class PeakRSS:
+    """Samples the resident memory of this process and its children (e.g. dask workers) on a thread"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self):
+        rss = self._process.memory_info().rss
+        for child in self._process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        self.peak = max(self.peak, rss)
+        return rss
+
+    def reset(self):
+        self.peak = 0
+        return self.sample()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _request_bytes(identifier):
+    # pylint: disable=import-outside-toplevel
+    from prometheus_client import REGISTRY
+    return REGISTRY.get_sample_value("wps_request_bytes_sum", {"process": identifier}) or 0.0
+
+
+def latency_summary(latencies):
+    latencies = np.asarray(latencies)
+    return {"p50": float(np.percentile(latencies, 50)),
+            "p90": float(np.percentile(latencies, 90)),
+            "p99": float(np.percentile(latencies, 99)),
+            "mean": float(latencies.mean()),
+            "min": float(latencies.min()),
+            "max": float(latencies.max())}
+
+
+# the data is local, but the S3 access of GDAL is configured (from the environment) for each request
+AWS_ENVIRONMENT = {"AWS_ACCESS_KEY_ID": "benchmark", "AWS_SECRET_ACCESS_KEY": "benchmark",
+                   "AWS_DEFAULT_REGION": "ap-southeast-2"}
+
+
+@contextlib.contextmanager
+def configured(datacube, catalog_filename, client):
+    """
+    The processes of the catalog, on `datacube` and the dask `client`, with the result and query caches off
+    (so that each request runs the whole pipeline) and traces recorded but not printed
+    """
+    # pylint: disable=import-outside-toplevel,protected-access
+    from datacube_wps import cache, pool, tracing
+    from datacube_wps.impl import read_process_catalog
+
+    saved = {"pool": list(pool._DATACUBE_POOL), "results": list(cache._RESULT_CACHE),
+             "queries": list(cache._QUERY_CACHE), "exporters": tracing.TRACER.exporters,
+             "environment": {key: os.environ.get(key) for key in AWS_ENVIRONMENT}}
+    for key, value in AWS_ENVIRONMENT.items():
+        os.environ.setdefault(key, value)
+    pool._DATACUBE_POOL[:] = [pool.DatacubePool(factory=lambda: datacube)]
+    cache._RESULT_CACHE[:] = [None]
+    cache._QUERY_CACHE[:] = [None]
+    tracing.TRACER.exporters = []
+
+    try:
+        processes = {}
+        for process in read_process_catalog(catalog_filename):
+            # the processes are constructed outside of a dask worker, so use the benchmark cluster
+            process.dask_client = client
+            processes[process.identifier] = process
+        yield processes
+    finally:
+        pool._DATACUBE_POOL[:] = saved["pool"]
+        cache._RESULT_CACHE[:] = saved["results"]
+        cache._QUERY_CACHE[:] = saved["queries"]
+        tracing.TRACER.exporters = saved["exporters"]
+        for key, value in saved["environment"].items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def cases(processes, polygon_sizes, time_ranges, size):
+    """The (process, geometry name, feature, time range name, time) of each benchmark case"""
+    for identifier, process in processes.items():
+        if process.about.get("geometry_type") == "point":
+            geometries = [("point", point(size))]
+        else:
+            geometries = [(name, square(POLYGON_SIDES[name], size)) for name in polygon_sizes]
+        for geometry_name, feature in geometries:
+            for range_name in time_ranges:
+                yield identifier, geometry_name, feature, range_name, TIME_RANGES[range_name]
+
+
+def run_case(process, feature, time, repeats, warmup, concurrency, rss):
+    """Latencies, throughput and peak RSS of `repeats` requests, after `warmup` untimed ones"""
+    def request(_=None):
+        start = default_timer()
+        result = process.query_handler(time, feature, parameters={})
+        return default_timer() - start, len(result["data"])
+
+    # the drills print as they go
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(warmup):
+            request()
+
+        rss_before = rss.reset()
+        request_bytes = _request_bytes(process.identifier)
+        start = default_timer()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(request, range(repeats)))
+        elapsed = default_timer() - start
+        request_bytes = _request_bytes(process.identifier) - request_bytes
+
+    return {
+        "latency_seconds": latency_summary([latency for latency, _ in results]),
+        "throughput": {"requests_per_second": repeats / elapsed,
+                       "mb_per_second": request_bytes / MB / elapsed},
+        "peak_rss_mb": rss.peak / MB,
+        # what the earlier cases (and the index) left resident
+        "rss_before_mb": rss_before / MB,
+        "input_mb_per_request": request_bytes / MB / repeats,
+        "rows": results[-1][1],
+    }
+
+
+def _git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def run(args):
+    # pylint: disable=import-outside-toplevel
+    from dask.distributed import Client, LocalCluster
+
+    datacube = local_datacube(args.data_dir, size=args.scene_size)
+
+    cluster = LocalCluster(n_workers=args.dask_workers, threads_per_worker=args.dask_threads,
+                           processes=args.dask_processes, dashboard_address=None)
+    client = Client(cluster)
+    commit, dirty = _git_commit()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "platform": {"python": platform.python_version(), "machine": platform.machine(),
+                     "system": platform.system(), "cpus": os.cpu_count(),
+                     "memory_mb": psutil.virtual_memory().total / MB},
+        "settings": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+        "cases": [],
+    }
+
+    try:
+        with configured(datacube, args.catalog, client) as processes, PeakRSS() as rss:
+            unknown = set(args.process) - set(processes)
+            if unknown:
+                raise ValueError(f"no such processes in the catalog: {sorted(unknown)}")
+            processes = {identifier: processes[identifier] for identifier in args.process}
+
+            for identifier, geometry, feature, time_range, time in cases(processes, args.polygon_size,
+                                                                         args.time_range, args.scene_size):
+                result = run_case(processes[identifier], feature, time, args.repeats, args.warmup,
+                                  args.concurrency, rss)
+                report["cases"].append({"process": identifier, "geometry": geometry, "time_range": time_range,
+                                        **result})
+                print(f"{identifier:>24} {geometry:>6} {time_range:>8}: "
+                      f"p50 {result['latency_seconds']['p50']:.3f}s, "
+                      f"{result['throughput']['requests_per_second']:.2f} req/s, "
+                      f"{result['throughput']['mb_per_second']:.1f} MB/s, "
+                      f"peak RSS {result['peak_rss_mb']:.0f} MB", file=sys.stderr)
+    finally:
+        client.close()
+        cluster.close()
+
+    return report
+
+
+def _case_key(case):
+    return case["process"], case["geometry"], case["time_range"]
+
+
+def compare(before, after, threshold=REGRESSION_THRESHOLD):
+    """
+    The relative change of the median latency, throughput and peak RSS of the cases of both reports,
+    and whether the median latency of any of them regressed by more than `threshold`
+    """
+    cases_before = {_case_key(case): case for case in before["cases"]}
+    changes = []
+    for case in after["cases"]:
+        old = cases_before.get(_case_key(case))
+        if old is None:
+            continue
+        changes.append({
+            "case": _case_key(case),
+            "p50": case["latency_seconds"]["p50"] / old["latency_seconds"]["p50"] - 1,
+            "throughput": case["throughput"]["requests_per_second"] / old["throughput"]["requests_per_second"] - 1,
+            "peak_rss": case["peak_rss_mb"] / old["peak_rss_mb"] - 1,
+        })
+    return changes, any(change["p50"] > threshold for change in changes)
+
+
+def print_comparison(before, after, threshold):
+    changes, regressed = compare(before, after, threshold)
+    print(f"{(before['commit'] or '?')[:10]} -> {(after['commit'] or '?')[:10]}")
+    for change in changes:
+        flag = "  REGRESSION" if change["p50"] > threshold else ""
+        print(f"{' / '.join(change['case']):>50}: p50 {change['p50']:+.1%}, "
+              f"throughput {change['throughput']:+.1%}, peak RSS {change['peak_rss']:+.1%}{flag}")
+    return regressed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end benchmarks of datacube-wps on a local datacube")
+    parser.add_argument("--output", help="JSON file to write the results to (defaults to stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="compare two result files instead, failing if a case regressed")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="relative slowdown of the median latency that is a regression")
+    parser.add_argument("--data-dir", default=os.path.join(ROOT, "benchmarks", "data"),
+                        help="where the synthetic COGs are written (and reused from)")
+    parser.add_argument("--scene-size", type=int, default=1024, help="pixels square of the synthetic scenes")
+    parser.add_argument("--process", action="append", choices=PROCESSES,
+                        help="a process to benchmark (defaults to all of them)")
+    parser.add_argument("--polygon-size", action="append", choices=list(POLYGON_SIDES),
+                        help="a polygon size (defaults to all of them)")
+    parser.add_argument("--time-range", action="append", choices=list(TIME_RANGES),
+                        help="a time range (defaults to all of them)")
+    parser.add_argument("--repeats", type=int, default=5, help="timed requests per case")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed requests per case before those")
+    parser.add_argument("--concurrency", type=int, default=1, help="requests of a case run at once")
+    parser.add_argument("--dask-workers", type=int, default=1)
+    parser.add_argument("--dask-threads", type=int, default=os.cpu_count())
+    parser.add_argument("--dask-processes", action="store_true",
+                        help="run the dask workers in processes of their own, rather than threads of this one")
+    parser.add_argument("--catalog", default=os.path.join(ROOT, "datacube-wps-config.yaml"))
+
+    args = parser.parse_args(argv)
+    args.process = args.process or PROCESSES
+    args.polygon_size = args.polygon_size or list(POLYGON_SIDES)
+    args.time_range = args.time_range or list(TIME_RANGES)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.compare:
+        reports = []
+        for filename in args.compare:
+            with open(filename, encoding="utf-8") as f:
+                reports.append(json.load(f))
+        return 1 if print_comparison(*reports, args.threshold) else 0
+
+    report = run(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
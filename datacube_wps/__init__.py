@@ -5,7 +5,14 @@ import os
 
 from .impl import create_app
 
-app = create_app()
+
+def __getattr__(name):
+    # the WSGI app (and its process catalog) is created on first use, e.g. by gunicorn,
+    # rather than whenever a submodule such as `datacube_wps.cluster` is imported
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
@@ -17,6 +24,7 @@ if __name__ == "__main__":
                                                    "otherwise bind to 127.0.0.1 (localhost). "
                                                    "This maybe necessary in systems that only run Flask"))
     args = parser.parse_args()
+    app = create_app()
 
     if args.all_addresses:
         bind_host = '0.0.0.0'
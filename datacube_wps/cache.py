@@ -0,0 +1,326 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from time import time as now
+
+import pandas
+import pywps.configuration as config
+from datacube.utils import import_function
+from shapely import wkt
+
+DEFAULT_MEMORY_BYTES = 256 * 1024**2
+DEFAULT_DISK_BYTES = 4 * 1024**3
+DEFAULT_TTL = 6 * 3600
+DEFAULT_QUERY_TTL = 300
+DEFAULT_QUERY_ENTRIES = 256
+
+
+def _config_int(section, option, default):
+    value = config.get_config_value(section, option)
+    if value in ("", None):
+        return default
+    return int(value)
+
+
+def _canonical_json(value):
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def geometry_hash(feature, precision=9):
+    """Hash of a geometry that is independent of its input CRS and of floating point noise"""
+    geom = feature.to_crs("EPSG:4326").geom
+    return hashlib.sha256(wkt.dumps(geom, rounding_precision=precision).encode()).hexdigest()
+
+
+def cache_key(about, time, feature, parameters):
+    """Key of a drill request: process identifier/version, geometry, time range and parameters"""
+    if time is not None and not isinstance(time, str):
+        time = [str(t) for t in time]
+
+    key = {
+        "identifier": about.get("identifier"),
+        "version": about.get("version"),
+        "geometry": geometry_hash(feature),
+        "time": time,
+        "parameters": parameters or {},
+    }
+    return hashlib.sha256(_canonical_json(key).encode()).hexdigest()
+
+
+def _df_nbytes(df):
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+class ResultCache:
+    """
+    Two tier (memory, then disk) cache of drill results.
+
+    Both tiers hold the `pandas.DataFrame` returned by `process_data` and, if `outputs` is set,
+    the rendered outputs of a request. The memory tier is an LRU bounded by `memory_bytes`,
+    the disk tier is a directory of Parquet/JSON files bounded by `disk_bytes`.
+    Entries older than `ttl` seconds are treated as missing in both tiers.
+    """
+
+    def __init__(self, memory_bytes=DEFAULT_MEMORY_BYTES, path=None, disk_bytes=DEFAULT_DISK_BYTES,
+                 ttl=DEFAULT_TTL, outputs=False):
+        self.memory_bytes = memory_bytes
+        self.path = path
+        self.disk_bytes = disk_bytes
+        self.ttl = ttl
+        self.outputs = outputs
+
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+
+        if self.path:
+            os.makedirs(self.path, exist_ok=True)
+
+    def stats(self):
+        return {"memory_hits": self.hits["memory"], "disk_hits": self.hits["disk"], "misses": self.misses,
+                "memory_entries": len(self._memory), "memory_bytes": self._memory_used}
+
+    def get(self, key):
+        df = self._lookup(key, ".parquet")
+        if df is None:
+            return None
+        # callers are free to modify what they are given
+        return df.copy()
+
+    def put(self, key, df):
+        self._store(key, ".parquet", df.copy(), _df_nbytes(df))
+
+    def get_outputs(self, key):
+        return self._lookup(key, ".json")
+
+    def put_outputs(self, key, outputs):
+        self._store(key, ".json", outputs, len(_canonical_json(outputs)))
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_used = 0
+
+    # memory tier
+
+    def _lookup(self, key, suffix):
+        value = self._memory_get(key + suffix)
+        if value is not None:
+            self.hits["memory"] += 1
+            return value
+
+        value = self._disk_get(key + suffix)
+        if value is not None:
+            self.hits["disk"] += 1
+            nbytes = _df_nbytes(value) if suffix == ".parquet" else len(_canonical_json(value))
+            self._memory_put(key + suffix, value, nbytes)
+            return value
+
+        self.misses += 1
+        return None
+
+    def _store(self, key, suffix, value, nbytes):
+        self._memory_put(key + suffix, value, nbytes)
+        self._disk_put(key + suffix, value)
+
+    def _memory_get(self, name):
+        with self._lock:
+            entry = self._memory.get(name)
+            if entry is None:
+                return None
+
+            value, nbytes, stored = entry
+            if now() - stored > self.ttl:
+                del self._memory[name]
+                self._memory_used -= nbytes
+                return None
+
+            self._memory.move_to_end(name)
+            return value
+
+    def _memory_put(self, name, value, nbytes):
+        if nbytes > self.memory_bytes:
+            return
+
+        with self._lock:
+            if name in self._memory:
+                self._memory_used -= self._memory.pop(name)[1]
+
+            self._memory[name] = (value, nbytes, now())
+            self._memory_used += nbytes
+
+            while self._memory_used > self.memory_bytes:
+                _, (_, evicted, _) = self._memory.popitem(last=False)
+                self._memory_used -= evicted
+
+    # disk tier
+
+    def _disk_get(self, name):
+        if not self.path:
+            return None
+
+        filename = os.path.join(self.path, name)
+        try:
+            if now() - os.path.getmtime(filename) > self.ttl:
+                os.remove(filename)
+                return None
+
+            if name.endswith(".parquet"):
+                return pandas.read_parquet(filename)
+            with open(filename, encoding="utf-8") as fl:
+                return json.load(fl)
+        except (OSError, ValueError):
+            # missing, evicted by another worker, or half written
+            return None
+
+    def _disk_put(self, name, value):
+        if not self.path:
+            return
+
+        filename = os.path.join(self.path, name)
+        partial = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if name.endswith(".parquet"):
+                value.to_parquet(partial, compression="snappy")
+            else:
+                with open(partial, "w", encoding="utf-8") as fl:
+                    json.dump(value, fl)
+            os.replace(partial, filename)
+        except (OSError, ValueError, TypeError) as e:
+            print("could not write cache entry", name, e)
+            if os.path.exists(partial):
+                os.remove(partial)
+            return
+
+        self._disk_evict()
+
+    def _disk_evict(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith((".parquet", ".json")):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        expired = now() - self.ttl
+
+        for mtime, size, filename in entries:
+            if mtime >= expired and total <= self.disk_bytes:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
+
+
+class QueryCache:
+    """
+    Per worker memo of `VirtualProduct.query` results.
+
+    Index searches for the same product tree, geometry and time are answered from memory
+    for `ttl` seconds, so that newly indexed datasets still show up after that.
+    """
+
+    def __init__(self, ttl=DEFAULT_QUERY_TTL, max_entries=DEFAULT_QUERY_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def query(self, product, dc, **search_terms):
+        key = query_key(product, search_terms.get("time"), search_terms.get("geopolygon"))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now() - entry[1] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        self.misses += 1
+        bag = product.query(dc, **search_terms)
+
+        with self._lock:
+            self._entries[key] = (bag, now())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return bag
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def query_key(product, time, feature):
+    """Key of an index query: the product tree, geometry and time"""
+    if time is not None and not isinstance(time, str):
+        time = [str(t) for t in time]
+
+    key = {
+        "product": repr(product),
+        "geometry": geometry_hash(feature) if feature is not None else None,
+        "time": time,
+    }
+    return hashlib.sha256(_canonical_json(key).encode()).hexdigest()
+
+
+_RESULT_CACHE = []
+_QUERY_CACHE = []
+
+
+def result_cache():
+    """The `ResultCache` of this worker as configured in the `[cache]` section of pywps.cfg, or `None`"""
+    if not _RESULT_CACHE:
+        _RESULT_CACHE.append(_create_result_cache())
+    return _RESULT_CACHE[0]
+
+
+def _create_result_cache():
+    if config.get_config_value("cache", "enabled", True) is False:
+        return None
+
+    path = config.get_config_value("cache", "path")
+    if path == "":
+        workdir = config.get_config_value("server", "workdir")
+        path = os.path.join(workdir, "datacube-wps-cache") if workdir else None
+
+    cache_class = import_function(config.get_config_value("cache", "class") or "datacube_wps.cache.ResultCache")
+    return cache_class(memory_bytes=_config_int("cache", "memory_bytes", DEFAULT_MEMORY_BYTES),
+                       path=path or None,
+                       disk_bytes=_config_int("cache", "disk_bytes", DEFAULT_DISK_BYTES),
+                       ttl=_config_int("cache", "ttl", DEFAULT_TTL),
+                       outputs=config.get_config_value("cache", "outputs", False) is True)
+
+
+def query_cache():
+    """The `QueryCache` of this worker as configured in the `[cache]` section of pywps.cfg, or `None`"""
+    if not _QUERY_CACHE:
+        _QUERY_CACHE.append(_create_query_cache())
+    return _QUERY_CACHE[0]
+
+
+def _create_query_cache():
+    if config.get_config_value("cache", "query_enabled", True) is False:
+        return None
+
+    return QueryCache(ttl=_config_int("cache", "query_ttl", DEFAULT_QUERY_TTL),
+                      max_entries=_config_int("cache", "query_entries", DEFAULT_QUERY_ENTRIES))
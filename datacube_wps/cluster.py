@@ -0,0 +1,172 @@
+import os
+import subprocess
+import sys
+from time import time as now
+
+from dask.distributed import Adaptive, Client, LocalCluster
+from dask.utils import parse_bytes
+
+from .metrics import DASK_SCALE_EVENTS, DASK_WORKERS
+from .startup_utils import get_pod_memory, get_pod_vcpus
+
+DASK_MODES = ("worker", "shared")
+DEFAULT_SCHEDULER_PORT = 8786
+DEFAULT_CONNECT_TIMEOUT = 30
+DEFAULT_TARGET_DURATION = "5s"
+DEFAULT_IDLE_TIMEOUT = 60
+
+# priority steps of a process, in seconds of waiting
+PRIORITY_STEP = 60
+
+
+def dask_mode():
+    """
+    `worker` (the default) for a `LocalCluster` per gunicorn worker,
+    `shared` for all gunicorn workers to use one dask scheduler
+    """
+    mode = os.getenv("DATACUBE_WPS_DASK_MODE", "worker")
+    if mode not in DASK_MODES:
+        raise ValueError(f"DATACUBE_WPS_DASK_MODE must be one of {DASK_MODES}, not {mode}")
+    return mode
+
+
+def num_dask_workers(default=4):
+    """Number of dask workers"""
+    return int(os.getenv("DATACUBE_WPS_NUM_WORKERS", str(default)))
+
+
+def adaptive_scaling():
+    """Whether the dask cluster of a gunicorn worker scales with the load, `DATACUBE_WPS_DASK_ADAPTIVE`"""
+    return os.getenv("DATACUBE_WPS_DASK_ADAPTIVE", "false").lower() in ("true", "yes", "1")
+
+
+def adaptive_limits():
+    """`(minimum, maximum)` number of dask workers of an adaptive cluster"""
+    minimum = int(os.getenv("DATACUBE_WPS_DASK_MIN_WORKERS", "1"))
+    maximum = int(os.getenv("DATACUBE_WPS_DASK_MAX_WORKERS", str(num_dask_workers())))
+    if not 0 <= minimum <= maximum:
+        raise ValueError(f"dask workers must satisfy 0 <= minimum <= maximum, not {minimum} and {maximum}")
+    return minimum, maximum
+
+
+def worker_memory_limit():
+    """
+    Memory limit of a dask worker, in bytes: `DATACUBE_WPS_DASK_WORKER_MEMORY` if set,
+    otherwise the pod memory per vCPU, since each worker has a single thread
+    """
+    memory = os.getenv("DATACUBE_WPS_DASK_WORKER_MEMORY")
+    if memory:
+        return parse_bytes(memory)
+    return parse_bytes(get_pod_memory()) // get_pod_vcpus()
+
+
+def scheduler_address():
+    """Address of the shared scheduler: a sidecar if configured, otherwise the one started by the gunicorn master"""
+    port = int(os.getenv("DATACUBE_WPS_DASK_SCHEDULER_PORT", str(DEFAULT_SCHEDULER_PORT)))
+    return os.getenv("DATACUBE_WPS_DASK_SCHEDULER") or f"tcp://127.0.0.1:{port}"
+
+
+class SharedCluster:
+    """
+    A dask scheduler and its workers, in processes of their own, for the gunicorn workers to share.
+    Started by the gunicorn master when no external scheduler is configured.
+    """
+
+    def __init__(self, address=None, n_workers=None):
+        self.address = address or scheduler_address()
+        self.n_workers = n_workers or num_dask_workers(default=get_pod_vcpus())
+        self.processes = []
+
+    def start(self):
+        port = self.address.rsplit(":", 1)[1]
+        self.processes.append(subprocess.Popen([sys.executable, "-m", "distributed.cli.dask_scheduler",
+                                                "--host", "127.0.0.1", "--port", port, "--no-dashboard"]))
+        self.processes.append(subprocess.Popen([sys.executable, "-m", "distributed.cli.dask_worker", self.address,
+                                                "--nworkers", str(self.n_workers), "--nthreads", "1",
+                                                "--memory-limit", str(worker_memory_limit()),
+                                                "--no-dashboard"]))
+        print("started shared dask cluster at", self.address, "with", self.n_workers, "workers")
+        return self
+
+    def close(self):
+        # workers first, so that they do not try to reconnect
+        for process in reversed(self.processes):
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.processes = []
+
+
+def start_shared_cluster():
+    """The `SharedCluster` to start in the gunicorn master, or `None` if not needed"""
+    if dask_mode() != "shared" or os.getenv("DATACUBE_WPS_DASK_SCHEDULER"):
+        return None
+    return SharedCluster().start()
+
+
+class MeteredAdaptive(Adaptive):
+    """`Adaptive` scaling that reports its decisions as Prometheus metrics"""
+
+    async def scale_up(self, n):
+        DASK_SCALE_EVENTS.labels(direction="up").inc()
+        await super().scale_up(n)
+        DASK_WORKERS.set(len(self.cluster.worker_spec))
+
+    async def scale_down(self, workers):
+        if not workers:
+            return
+        DASK_SCALE_EVENTS.labels(direction="down").inc()
+        await super().scale_down(workers)
+        DASK_WORKERS.set(len(self.cluster.worker_spec))
+
+
+def create_local_cluster(**kwargs):
+    """
+    A `LocalCluster` for a gunicorn worker: of `DATACUBE_WPS_NUM_WORKERS` workers, or adaptive
+    between `adaptive_limits` with `DATACUBE_WPS_DASK_ADAPTIVE`, so that idle pods shrink
+    and bursts of requests scale out
+    """
+    kwargs = {"scheduler_port": 0, "threads_per_worker": 1, "memory_limit": worker_memory_limit(), **kwargs}
+
+    if not adaptive_scaling():
+        cluster = LocalCluster(n_workers=num_dask_workers(), **kwargs)
+        DASK_WORKERS.set(len(cluster.worker_spec))
+        return cluster
+
+    minimum, maximum = adaptive_limits()
+    idle_timeout = int(os.getenv("DATACUBE_WPS_DASK_IDLE_TIMEOUT", str(DEFAULT_IDLE_TIMEOUT)))
+    cluster = LocalCluster(n_workers=minimum, **kwargs)
+    # workers are retired after `wait_count` intervals of being surplus
+    cluster.adapt(Adaptive=MeteredAdaptive, minimum=minimum, maximum=maximum,
+                  target_duration=os.getenv("DATACUBE_WPS_DASK_TARGET_DURATION", DEFAULT_TARGET_DURATION),
+                  interval="1s", wait_count=max(idle_timeout, 1))
+    DASK_WORKERS.set(len(cluster.worker_spec))
+    return cluster
+
+
+def connect_dask():
+    """
+    `(cluster, client)` for a gunicorn worker: a client of the shared scheduler in `shared` mode,
+    falling back to a `LocalCluster` of its own if the shared scheduler cannot be reached
+    """
+    if dask_mode() == "shared":
+        address = scheduler_address()
+        timeout = int(os.getenv("DATACUBE_WPS_DASK_CONNECT_TIMEOUT", str(DEFAULT_CONNECT_TIMEOUT)))
+        try:
+            return None, Client(address, timeout=timeout)
+        except (OSError, TimeoutError) as e:
+            print("could not connect to the shared dask scheduler at", address, e)
+            print("falling back to a dask cluster per worker")
+
+    cluster = create_local_cluster()
+    return cluster, Client(cluster)
+
+
+def request_priority(about):
+    """
+    Dask priority of the tasks of a request: requests that arrived earlier go first,
+    and each step of the `priority` of the process counts as `PRIORITY_STEP` seconds of waiting.
+    """
+    return int(about.get("priority", 0)) * PRIORITY_STEP - int(now())
@@ -3,15 +3,19 @@ import os
 import flask
 import yaml
 from datacube.utils import import_function
-from datacube.virtual import construct
 from pywps import Service
 
+from .pool import datacube_pool
+from .s3 import S3_UPLOADER
 from .startup_utils import initialise_prometheus, setup_logger, setup_sentry
+from .virtual import construct_product
 
 
-def create_process(process, input, **settings):
+def create_process(process, input, prefilter=None, **settings):
     process_class = import_function(process)
-    return process_class(input=construct(**input), **settings)
+    if prefilter is not None:
+        settings['prefilter'] = {**prefilter, 'input': construct_product(prefilter['input'])}
+    return process_class(input=construct_product(input), **settings)
 
 
 def read_process_catalog(catalog_filename):
@@ -21,6 +25,30 @@ def read_process_catalog(catalog_filename):
     return [create_process(**settings) for settings in config['processes']]
 
 
+def create_service(catalog_filename='datacube-wps-config.yaml'):
+    return Service(read_process_catalog(catalog_filename), ['pywps.cfg'])
+
+
+def _connect_index():
+    # connects, and caches the product definitions the virtual products look up
+    with datacube_pool().datacube() as dc:
+        list(dc.index.products.get_all())
+
+
+def warm_up():
+    """
+    Prime a freshly started (or forked) worker before it serves requests,
+    so that its first request does not pay for connecting to the index or to S3
+    """
+    steps = [("index connection", _connect_index),
+             ("S3 clients", S3_UPLOADER.clients)]
+    for name, step in steps:
+        try:
+            step()
+        except Exception as e:  # pylint: disable=broad-except
+            print("warm up of", name, "failed:", e)
+
+
 def create_app():
     # pylint: disable=unused-variable
 
@@ -32,7 +60,8 @@ def create_app():
 
     metrics = initialise_prometheus(app)
 
-    service = []
+    # built once, before any request (in the gunicorn master with `preload_app`, shared by the workers)
+    service = create_service()
 
     @app.after_request
     def apply_cors(response):
@@ -45,9 +74,7 @@ def create_app():
         if flask.request.method == 'HEAD':
             return ""
 
-        if not service:
-            service.append(Service(read_process_catalog('datacube-wps-config.yaml'), ['pywps.cfg']))
-        return service[0]
+        return service
 
     @app.route('/ping')
     def ping():
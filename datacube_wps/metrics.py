@@ -0,0 +1,63 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Prometheus metrics of the WPS internals, in addition to the Flask request metrics
+# set up by `initialise_prometheus`. In multiprocess mode (PROMETHEUS_MULTIPROC_DIR)
+# these are aggregated across gunicorn workers by prometheus_client.
+
+DATACUBE_POOL_WAIT = Histogram(
+    "wps_datacube_pool_wait_seconds",
+    "Time spent waiting for a pooled Datacube",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0),
+)
+
+DATACUBE_POOL_DISCARDED = Counter(
+    "wps_datacube_pool_discarded_total",
+    "Pooled Datacube instances discarded after failing a health check or a query",
+)
+
+S3_CONFIGURE_TIME = Histogram(
+    "wps_s3_configure_seconds",
+    "Time spent configuring S3 access for GDAL/rasterio on the dask cluster",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+DASK_SCALE_EVENTS = Counter(
+    "wps_dask_scale_events_total",
+    "Adaptive scaling decisions of the dask clusters, by direction",
+    ["direction"],
+)
+
+DASK_WORKERS = Gauge(
+    "wps_dask_workers",
+    "Dask workers requested by the dask clusters of the gunicorn workers",
+    multiprocess_mode="livesum",
+)
+
+# stages of a request, see `datacube_wps.processes`
+STAGE_TIME = Histogram(
+    "wps_stage_seconds",
+    "Time spent in each stage of a request, by process",
+    ["process", "stage"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+
+REQUEST_BYTES = Histogram(
+    "wps_request_bytes",
+    "Bytes of data (of the bounding box of the geometry) loaded per request, by process",
+    ["process"],
+    buckets=tuple(4**n * 1024**2 for n in range(9)),
+)
+
+REQUEST_DATASETS = Histogram(
+    "wps_request_datasets",
+    "Datasets found by the index query of a request, by process",
+    ["process"],
+    buckets=(1, 10, 50, 100, 500, 1000, 5000, 10000, 50000),
+)
+
+REQUEST_TIME_SLICES = Histogram(
+    "wps_request_time_slices",
+    "Time slices loaded per request, by process",
+    ["process"],
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000),
+)
@@ -0,0 +1,125 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from time import time as now
+
+import datacube
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from .metrics import DATACUBE_POOL_DISCARDED, DATACUBE_POOL_WAIT
+
+
+def _pool_size():
+    return int(os.getenv("DATACUBE_WPS_DB_POOL_SIZE", "4"))
+
+
+def _pool_timeout():
+    return float(os.getenv("DATACUBE_WPS_DB_POOL_TIMEOUT", "60"))
+
+
+def _health_check_interval():
+    return float(os.getenv("DATACUBE_WPS_DB_HEALTH_CHECK", "60"))
+
+
+class DatacubePool:
+    """
+    Pool of `datacube.Datacube` instances (and so index connections) for one gunicorn worker.
+
+    At most `size` instances are handed out at once; requests beyond that wait up to `timeout`
+    seconds. An instance that has been idle for longer than `health_check_interval` seconds is
+    checked with a trivial query before being reused, and any instance that fails a database
+    call is discarded rather than returned to the pool. Uses `threading` primitives, which
+    gevent monkey patching turns into greenlet-safe ones.
+    """
+
+    def __init__(self, size=None, timeout=None, health_check_interval=None, factory=None):
+        self.size = size or _pool_size()
+        self.timeout = _pool_timeout() if timeout is None else timeout
+        if health_check_interval is None:
+            health_check_interval = _health_check_interval()
+        self.health_check_interval = health_check_interval
+        self.factory = factory or (lambda: datacube.Datacube(app="datacube-wps"))
+
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle = queue.LifoQueue()
+
+    @contextmanager
+    def datacube(self):
+        start = now()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise RuntimeError(f"no Datacube available in the pool after {self.timeout}s")
+        DATACUBE_POOL_WAIT.observe(now() - start)
+
+        try:
+            dc = self._checkout()
+            broken = False
+            try:
+                yield dc
+            except DBAPIError:
+                broken = True
+                raise
+            finally:
+                # any other error is the request's, not the connection's, so the instance is reused
+                if broken:
+                    self._discard(dc)
+                else:
+                    self._idle.put((dc, now()))
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                dc, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            dc.close()
+
+    def _checkout(self):
+        while True:
+            try:
+                dc, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self.factory()
+
+            if now() - last_used < self.health_check_interval or _healthy(dc):
+                return dc
+            self._discard(dc)
+
+    @staticmethod
+    def _discard(dc):
+        DATACUBE_POOL_DISCARDED.inc()
+        try:
+            dc.close()
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+
+def _healthy(dc):
+    try:
+        # pylint: disable=protected-access
+        with dc.index._db.give_me_a_connection() as connection:
+            connection.execute(text("SELECT 1"))
+        return True
+    except Exception:  # pylint: disable=broad-except
+        return False
+
+
+_DATACUBE_POOL = []
+
+
+def datacube_pool():
+    """The `DatacubePool` of this worker, created on first use"""
+    if not _DATACUBE_POOL:
+        _DATACUBE_POOL.append(DatacubePool())
+    return _DATACUBE_POOL[0]
+
+
+def _forget_pool():
+    # connections must not be shared with a forked child (e.g. with gunicorn's preload_app)
+    _DATACUBE_POOL.clear()
+
+
+os.register_at_fork(after_in_child=_forget_pool)
@@ -1,31 +1,37 @@
 import io
 import json
 import os
-from functools import wraps
-from timeit import default_timer
-from collections import Counter
-
-import altair
-# import altair_saver
-import boto3
-import botocore
-import datacube
+from contextlib import contextmanager
+from functools import partial
+from collections import Counter, deque
+from typing import TYPE_CHECKING
+
+import dask
 import numpy as np
 import pandas
-import pyarrow as pa
-import pyarrow.parquet as pq
-import pywps.configuration as config
-import rasterio.features
 import xarray
-from botocore.client import Config
-from dask.distributed import Client, worker_client
+from dask.distributed import default_client, worker_client
 from datacube.utils.geometry import CRS, Geometry
-from datacube.utils.rio import configure_s3_access
-from datacube.virtual.impl import Product, Juxtapose
+from datacube.virtual.impl import Product, Juxtapose, VirtualDatasetBox
 from dateutil.parser import parse
 from pywps import ComplexInput, ComplexOutput, Format, Process
 from pywps.app.exceptions import ProcessError
 
+from ..cache import cache_key, query_cache, result_cache
+from ..cluster import request_priority
+from ..metrics import REQUEST_BYTES, REQUEST_DATASETS, REQUEST_TIME_SLICES, STAGE_TIME
+from ..pool import datacube_pool
+from ..profiling import profile_allowed, profile_requested, profiling, request_profiling
+from ..render import CHART_RENDERER
+from ..s3 import S3_ACCESS, S3_UPLOADER
+from ..tracing import annotate, span, traced
+from .pointread import read_point
+from .polygonmask import geometry_mask, mask_to_polygon
+
+if TYPE_CHECKING:
+    # charts are only built (and altair only imported) when a process renders one
+    import altair
+
 
 FORMATS = {
     # Defines the format for the returned object
@@ -51,87 +57,74 @@ GB = 1.0e9
 MAX_BYTES_IN_GB = 20.0
 MAX_BYTES_PER_OBS_IN_GB = 2.0
 
+# pixels along each spatial dimension of a dask chunk of polygon drill data
+SPATIAL_CHUNK_SIZE = int(os.getenv("DATACUBE_WPS_SPATIAL_CHUNK", "2048"))
 
-def log_call(func):
-    @wraps(func)
-    def log_wrapper(*args, **kwargs):
-        name = func.__name__
-        for index, arg in enumerate(args):
-            try:
-                arg_name = func.__code__.co_varnames[index]
-            except (AttributeError, KeyError, IndexError):
-                arg_name = f"arg #{index}"
-            print(f"{name} {arg_name}: {arg}")
-        for key, value in kwargs.items():
-            print(f"{name} {key}: {value}")
+# time slices reduced at once by streaming polygon drills
+STREAM_SLICES = int(os.getenv("DATACUBE_WPS_STREAM_SLICES", "16"))
 
-        start = default_timer()
-        result = func(*args, **kwargs)
-        end = default_timer()
-        print("{} returned {}".format(name, result))
-        print("{} took {:.3f}s".format(name, end - start))
-        return result
+# pixels along each spatial dimension of a tile of a large polygon, for drills that can be tiled
+TILE_SIZE = int(os.getenv("DATACUBE_WPS_TILE_SIZE", "8192"))
 
-    return log_wrapper
+# tiles (or groups of time slices of them) of a request computed on the dask cluster at once
+TILES_IN_FLIGHT = int(os.getenv("DATACUBE_WPS_TILES_IN_FLIGHT", "2"))
 
+# outputs that are rendered from the chart of a process
+CHART_OUTPUTS = ("image", "url")
 
-@log_call
-def _uploadToS3(filename, data, mimetype):
-    # AWS_S3_CREDS = {
-    #     "aws_access_key_id": os.getenv("AWS_ACCESS_KEY_ID"),
-    #     "aws_secret_access_key": os.getenv("AWS_SECRET_ACCESS_KEY")
-    # }
-    # s3 = session.client("s3", **AWS_S3_CREDS)
-    session = boto3.Session(profile_name="default")
-    bucket = config.get_config_value("s3", "bucket")
-    s3 = session.client("s3")
-
-    # bucket = s3.Bucket('test-wps')
-
-    s3.upload_fileobj(
-        data,
-        bucket,
-        filename,
-        ExtraArgs={"ACL": "public-read", "ContentType": mimetype},
-    )
+# keys in the `about` section of a process that are settings for us, not for pywps
+NON_PYWPS_KEYS = ["geometry_type", "guard_rail", "point_read", "streaming", "priority"]
 
-    print('Made it to before the presigned url generation')
-    bucket = config.get_config_value("s3", "bucket")
-    # Create unsigned s3 client for determining public s3 url
-    s3 = session.client("s3", config=Config(signature_version=botocore.UNSIGNED))
-    return s3.generate_presigned_url(
-        ClientMethod="get_object",
-        ExpiresIn=0,
-        Params={"Bucket": bucket, "Key": filename},
-    )
+
+# calls of the drills are traced with summaries of their arguments and results, see `datacube_wps.tracing`
+log_call = traced
+
+
+@contextmanager
+def _stage(identifier, stage):
+    """Time a `stage` of a request to the process `identifier`, as a metric and as a span of its trace"""
+    with span(stage), STAGE_TIME.labels(process=identifier, stage=stage).time():
+        yield
+
+
+def _observe_input(identifier, datasets, time_slices, byte_count):
+    REQUEST_DATASETS.labels(process=identifier).observe(datasets)
+    REQUEST_TIME_SLICES.labels(process=identifier).observe(time_slices)
+    REQUEST_BYTES.labels(process=identifier).observe(byte_count)
+
+
+@log_call
+def _uploadToS3(filename, data, mimetype, identifier):
+    with _stage(identifier, "upload"):
+        return S3_UPLOADER.upload_public(filename, data, mimetype)
 
 
-def upload_chart_html_to_S3(chart: altair.Chart, process_id: str):
-    html_io = io.StringIO()
-    chart.save(html_io, format="html", engine="vl-convert")
-    html_bytes = io.BytesIO(html_io.getvalue().encode())
-    return _uploadToS3(process_id + "/chart.html", html_bytes, "text/html")
+def upload_chart_html_to_S3(chart: "altair.Chart", process_id: str, identifier: str):
+    with _stage(identifier, "render"):
+        html_bytes = io.BytesIO(CHART_RENDERER.render(chart, "html").encode())
+    return _uploadToS3(process_id + "/chart.html", html_bytes, "text/html", identifier=identifier)
 
 
-def upload_chart_svg_to_S3(chart: altair.Chart, process_id: str):
-    img_io = io.StringIO()
-    chart.save(img_io, format="svg", engine="vl-convert")
-    img_bytes = io.BytesIO(img_io.getvalue().encode())
-    return _uploadToS3(process_id + "/chart.svg", img_bytes, "image/svg+xml")
+def upload_chart_svg_to_S3(chart: "altair.Chart", process_id: str, identifier: str):
+    with _stage(identifier, "render"):
+        img_bytes = io.BytesIO(CHART_RENDERER.render(chart, "svg").encode())
+    return _uploadToS3(process_id + "/chart.svg", img_bytes, "image/svg+xml", identifier=identifier)
 
 
 def write_df_to_parquet(df: pandas.DataFrame, process_id: str, identifier: str):
+    """Upload `df` as parquet, keyed by the lowercased process `identifier` and recorded under it as is"""
+    # pylint: disable=import-outside-toplevel
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
     table = pa.Table.from_pandas(df)
     writer = pa.BufferOutputStream()
     pq.write_table(table, writer, compression="snappy")
     body = bytes(writer.getvalue())
 
-    bucket = config.get_config_value("s3", "bucket")
-    key = "/".join([identifier, process_id, process_id]) + ".snappy.parquet"
-    session = boto3.Session()
-    dev_s3_client = session.client("s3")
-    dev_s3_client.put_object(Body=body, Bucket=bucket, Key=key)
-    return f"s3://{bucket}/{key}"
+    key = "/".join([identifier.lower(), process_id, process_id]) + ".snappy.parquet"
+    with _stage(identifier, "upload"):
+        return S3_UPLOADER.put(key, body)
 
 
 # from https://stackoverflow.com/a/16353080
@@ -143,16 +136,6 @@ class DatetimeEncoder(json.JSONEncoder):
             return str(o)
 
 
-def geometry_mask(geom, geobox, all_touched=False, invert=False):
-    return rasterio.features.geometry_mask(
-        [geom.to_crs(geobox.crs)],
-        out_shape=geobox.shape,
-        transform=geobox.affine,
-        all_touched=all_touched,
-        invert=invert,
-    )
-
-
 def mostcommon_crs(datasets: list):
     """Adapted from https://github.com/GeoscienceAustralia/dea-notebooks/blob/develop/Tools/dea_tools/datahandling.py"""
     crs_list = [str(i.crs) for i in datasets]
@@ -185,16 +168,25 @@ def chart_dimensions(style):
     return (width, height)
 
 
-def _guard_rail(input, box):
+def _box_bytes(input, box):
+    """Bytes of the data of `box` when loaded"""
     measurement_dicts = input.output_measurements(box.product_definitions)
 
+    # a reprojected box is loaded natively, but has the geobox it is reprojected to
+    shape = box.box.shape + box.geobox.shape if box.load_natively else box.shape
+
     byte_count = 1
-    for x in box.shape:
+    for x in shape:
         byte_count *= x
-    byte_count *= sum(np.dtype(m.dtype).itemsize for m in measurement_dicts.values())
+    return byte_count * sum(np.dtype(m.dtype).itemsize for m in measurement_dicts.values())
+
 
-    print("byte count for query: ", byte_count)
-    if byte_count > MAX_BYTES_IN_GB * GB:
+def _guard_rail(input, box, streaming=False):
+    byte_count = _box_bytes(input, box)
+
+    annotate(byte_count=byte_count)
+    # streaming drills only hold a few time slices in memory at a time
+    if not streaming and byte_count > MAX_BYTES_IN_GB * GB:
         raise ProcessError(
             ("requested area requires {}GB data to load - " "maximum is {}GB").format(
                 int(byte_count / GB), MAX_BYTES_IN_GB
@@ -203,7 +195,7 @@ def _guard_rail(input, box):
 
     grouped = box.box
 
-    print("grouped shape", grouped.shape)
+    annotate(time_slices=grouped.shape[0])
     assert len(grouped.shape) == 1
 
     if grouped.shape[0] == 0:
@@ -219,6 +211,14 @@ def _guard_rail(input, box):
         )
 
 
+def _dask_chunks(box):
+    """One time slice per chunk, split spatially so that masking and reading can skip parts of the bounding box"""
+    chunks = {"time": 1}
+    if box.geobox is not None:
+        chunks.update({dim: SPATIAL_CHUNK_SIZE for dim in box.geobox.dimensions})
+    return chunks
+
+
 def _datetimeExtractor(data):
     return parse(json.loads(data)["properties"]["timestamp"]["date-time"])
 
@@ -276,19 +276,49 @@ def _get_parameters(request):
     return params
 
 
+def _get_chart_outputs(request):
+    # no outputs in the request means all of them
+    if not request.outputs:
+        return CHART_OUTPUTS
+
+    return tuple(ident for ident in CHART_OUTPUTS if ident in request.outputs)
+
+
 def _render_outputs(
     uuid,
     style,
     df: pandas.DataFrame,
     chart,
     json_version,
+    identifier,
     is_enabled=True,
     name="Timeseries",
     header=True,
+    chart_outputs=CHART_OUTPUTS,
 ):
+    # render and upload only the requested charts, while the CSV/JSON payload is built
+    uploads = {}
     if chart:
-        html_url = upload_chart_html_to_S3(chart, str(uuid))
-        img_url = upload_chart_svg_to_S3(chart, str(uuid))
+        if "url" in chart_outputs:
+            uploads["url"] = S3_UPLOADER.submit(upload_chart_html_to_S3, chart, str(uuid), identifier)
+        if "image" in chart_outputs:
+            uploads["image"] = S3_UPLOADER.submit(upload_chart_svg_to_S3, chart, str(uuid), identifier)
+
+    with _stage(identifier, "serialise"):
+        output_json = _serialise_outputs(style, df, json_version, is_enabled, name, header)
+
+    outputs = {
+        "timeseries": {"data": output_json},
+        # "output_format": {"data": "application/vnd.terriajs.catalog-member.json"},
+    }
+    for ident, upload in uploads.items():
+        outputs[ident] = {"data": upload.result()}
+
+    return outputs
+
+
+def _serialise_outputs(style, df, json_version, is_enabled, name, header):
+    """The Terria JSON of the CSV of `df`"""
 
     try:
         csv_df = df.drop(columns=["latitude", "longitude"])
@@ -344,33 +374,12 @@ def _render_outputs(
     
     else:
         raise ValueError("No Terria JSON version specified")
-    output_json = json.dumps(output_dict, cls=DatetimeEncoder)
-
-    if chart:
-        outputs = {
-            "image": {"data": img_url},
-            "url": {"data": html_url},
-            "timeseries": {"data": output_json},
-            # "output_format": {"data": "application/vnd.terriajs.catalog-member.json"},
-        }
-
-    else:
-        outputs = {
-            "timeseries": {"data": output_json},
-            # "output_format": {"data": "application/vnd.terriajs.catalog-member.json"},
-        }
-
-    return outputs
+    return json.dumps(output_dict, cls=DatetimeEncoder)
 
 
 def _populate_response(response, outputs):
-    print('before response is populated')
-    print(response.outputs)
-    print('------------')
+    annotate(outputs=outputs)
     for ident, output_value in outputs.items():
-        print('TESTING')
-        print(ident)
-        print(output_value)
         if ident in response.outputs:
             if "data" in output_value:
                 response.outputs[ident].data = output_value["data"]
@@ -382,6 +391,174 @@ def _populate_response(response, outputs):
                 response.outputs[ident].timeseries = output_value["timeseries"]
 
 
+def _point_dataset(data, times, lonlat, measurements):
+    coords = {
+        "longitude": np.array([lonlat[0]]),
+        "latitude": np.array([lonlat[1]]),
+        "time": times,
+    }
+
+    result = xarray.Dataset()
+    for measurement_name, measurement in measurements.items():
+        result[measurement_name] = xarray.DataArray(
+            data[measurement_name],
+            dims=("time", "longitude", "latitude"),
+            coords=coords,
+            attrs={
+                key: value
+                for key, value in measurement.items()
+                if key in ["flags_definition"]
+            },
+        )
+    return result
+
+
+def _query(product, dc, time, feature):
+    """
+    Datasets for a request, memoised per worker by the query cache. Without a `dc`, a `Datacube`
+    is checked out of the pool of the worker for the index query only, and not while loading data.
+    """
+    if dc is None:
+        with datacube_pool().datacube() as pooled:
+            return _query(product, pooled, time, feature)
+
+    cache = query_cache()
+    query = product.query if cache is None else partial(cache.query, product)
+
+    if time is None:
+        return query(dc, geopolygon=feature)
+    return query(dc, time=time, geopolygon=feature)
+
+
+def _query_result(process, time, feature, parameters):
+    """The `process_data` DataFrame for a request, from the result cache if possible"""
+    # a profiled request runs the whole pipeline
+    cache = None if profiling() else result_cache()
+    if cache is not None:
+        key = cache_key(process.about, time, feature, parameters)
+        df = cache.get(key)
+        if df is not None:
+            return df
+
+    S3_ACCESS.configure(client=process.dask_client)
+
+    # tasks of requests that arrived earlier go first on a shared cluster
+    with dask.annotate(priority=request_priority(process.about)):
+        # pool slots are held for index queries only, so that requests loading data do not starve others
+        data = process.input_data(None, time, feature, parameters=parameters)
+
+        # lazily loaded data is read (and masked) here too, as it is computed
+        with _stage(process.identifier, "process"):
+            df = _process_data(process, data, {"time": time, "feature": feature, **parameters})
+
+    if cache is not None:
+        cache.put(key, df)
+    return df
+
+
+def _time_groups(process, data):
+    """`data` in groups of `STREAM_SLICES` time slices for streaming drills, so that memory use
+    does not grow with the length of the time range"""
+    if not getattr(process, "streaming", False) or "time" not in data.dims or data.sizes["time"] <= STREAM_SLICES:
+        return [data]
+
+    return [data.isel(time=slice(start, start + STREAM_SLICES))
+            for start in range(0, data.sizes["time"], STREAM_SLICES)]
+
+
+def _process_data(process, data, parameters):
+    """`process_data` for the data of a request, which is a list of tiles for large polygons"""
+    if isinstance(data, list):
+        # sum the partial results of each tile per time slice
+        partials = _reduce_groups(process, [group for tile in data for group in _time_groups(process, tile)],
+                                  parameters)
+        merged = pandas.concat(partials).groupby("time", sort=True).sum().reset_index()
+        return process.finalise_data(merged, parameters)
+
+    groups = _time_groups(process, data)
+    if len(groups) == 1:
+        return process.process_data(data, parameters)
+    return pandas.concat([process.process_data(group, parameters) for group in groups], ignore_index=True)
+
+
+def _reduce_groups(process, groups, parameters):
+    """
+    `reduce_data` of each of `groups`, with up to `TILES_IN_FLIGHT` of them computed on the dask cluster
+    at once, so that the reads of one overlap the reduction of another while peak memory stays bounded
+    """
+    try:
+        client = default_client()
+    except ValueError:
+        client = None
+    if client is None or TILES_IN_FLIGHT <= 1:
+        return [process.reduce_data(group, parameters) for group in groups]
+
+    def reduced_frame(group, reduced, submitted):
+        if submitted:
+            with span("compute"):
+                reduced = reduced.result()
+        return process.reduce_frame(group, reduced, parameters)
+
+    partials = []
+    in_flight = deque()
+    for group in groups:
+        reduced = process.reduce_lazy(group, parameters)
+        if dask.is_dask_collection(reduced):
+            in_flight.append((group, client.compute(reduced), True))
+        else:
+            in_flight.append((group, reduced, False))
+        if len(in_flight) >= TILES_IN_FLIGHT:
+            partials.append(reduced_frame(*in_flight.popleft()))
+    while in_flight:
+        partials.append(reduced_frame(*in_flight.popleft()))
+    return partials
+
+
+def _tiles(box, feature):
+    """`box` split into tiles of at most `TILE_SIZE` pixels square, leaving out those outside the polygon"""
+    if box.geobox is None:
+        return [box]
+
+    height, width = box.geobox.shape
+    if height <= TILE_SIZE and width <= TILE_SIZE:
+        return [box]
+
+    geom = feature.to_crs(box.geobox.crs)
+    tiles = []
+    for y in range(0, height, TILE_SIZE):
+        for x in range(0, width, TILE_SIZE):
+            tile = box[(slice(None), slice(y, min(y + TILE_SIZE, height)), slice(x, min(x + TILE_SIZE, width)))]
+            if geom.intersects(tile.geobox.extent):
+                tiles.append(tile)
+    return tiles
+
+
+def _request_outputs(process, time, feature, parameters, profile=None):
+    """
+    The rendered outputs for a request, from the result cache if enabled for outputs.
+    The `query_handler` of the request is profiled if `profile` is requested and allowed.
+    """
+    cache = result_cache()
+    if cache is not None and cache.outputs:
+        key = cache_key(process.about, time, feature, {**parameters, "outputs": process.chart_outputs})
+        outputs = cache.get_outputs(key) if not profile_allowed(process.identifier, profile) else None
+        if outputs is not None:
+            return outputs
+
+    with request_profiling(process.identifier, process.uuid, profile):
+        result = process.query_handler(time, feature, parameters=parameters)
+
+    if process.style.get('csv'):
+        outputs = process.render_outputs(result["data"], None)
+
+    elif process.style['table']:
+        outputs = process.render_outputs(result["data"], result["chart"])
+
+    if cache is not None and cache.outputs:
+        cache.put_outputs(key, outputs)
+    return outputs
+
+
 def num_workers():
     return int(os.getenv("DATACUBE_WPS_NUM_WORKERS", "4"))
 
@@ -398,7 +575,7 @@ class PixelDrill(Process):
             **{
                 key: value
                 for key, value in about.items()
-                if key not in ["geometry_type", "guard_rail"]
+                if key not in NON_PYWPS_KEYS
             },
         )
 
@@ -406,6 +583,10 @@ class PixelDrill(Process):
         self.input = input
         self.style = style
         self.json_version = "v8"
+        self.chart_outputs = CHART_OUTPUTS
+
+        # sample the native pixel of each dataset directly, instead of grouping and fetching a geobox
+        self.point_read = about.get("point_read", False) and isinstance(input, Product)
 
         # self.dask_client = dask_client = Client(
         #     n_workers=num_dask_workers(), processes=True, threads_per_worker=1
@@ -437,19 +618,16 @@ class PixelDrill(Process):
             )
         ]
 
+    @log_call
     def request_handler(self, request, response):
         time = _get_time(request)
         feature = _get_feature(request)
         parameters = _get_parameters(request)
+        profile = profile_requested(request, parameters)
+        self.chart_outputs = _get_chart_outputs(request)
+
+        outputs = _request_outputs(self, time, feature, parameters, profile=profile)
 
-        result = self.query_handler(time, feature, parameters=parameters)
-        
-        if self.style['csv']:
-            outputs = self.render_outputs(result["data"], None)
-        
-        elif self.style['table']:
-            outputs = self.render_outputs(result["data"], result["chart"])
-        
         _populate_response(response, outputs)
         return response
 
@@ -458,26 +636,25 @@ class PixelDrill(Process):
         if parameters is None:
             parameters = {}
 
-        configure_s3_access(
-            # aws_unsigned=True,
-            region_name=os.getenv("AWS_DEFAULT_REGION", "auto"),
-            client=self.dask_client,
-        )
-
-        with datacube.Datacube() as dc:
-            data = self.input_data(dc, time, feature)
-
-        df = self.process_data(data, {"time": time, "feature": feature, **parameters})
-        chart = self.render_chart(df)
+        df = _query_result(self, time, feature, parameters)
+        with _stage(self.identifier, "chart"):
+            chart = self.render_chart(df)
 
         return {"data": df, "chart": chart}
 
     @log_call
-    def input_data(self, dc, time, feature):
-        if time is None:
-            bag = self.input.query(dc, geopolygon=feature)
-        else:
-            bag = self.input.query(dc, time=time, geopolygon=feature)
+    def input_data(self, dc, time, feature, parameters=None):
+        with _stage(self.identifier, "query"):
+            bag = _query(self.input, dc, time, feature)
+
+        lonlat = feature.coords[0]
+        measurements = self.input.output_measurements(bag.product_definitions)
+
+        if self.point_read:
+            with _stage(self.identifier, "fetch"):
+                data, times = read_point(self.input, bag, feature, measurements)
+            _observe_input(self.identifier, len(bag.bag), len(times), sum(a.nbytes for a in data.values()))
+            return _point_dataset(data, times, lonlat, measurements)
 
         # Get output_crs/resolution/align params if product grid_spec is not defined
         if bag.product_definitions[self.input._product].grid_spec is None:
@@ -486,49 +663,32 @@ class PixelDrill(Process):
             align = self.input.get('align')
             if output_crs is None:
                 output_crs = mostcommon_crs(list(bag.bag))
-            box = self.input.group(bag, output_crs=output_crs, resolution=resolution, align=align)
-        else:
-            box = self.input.group(bag)
-
-        lonlat = feature.coords[0]
-        measurements = self.input.output_measurements(bag.product_definitions)
-
-        if self.dask_enabled:
-            data = self.input.fetch(box, dask_chunks={"time": 1})
-            data = data.compute()
+            with _stage(self.identifier, "group"):
+                box = self.input.group(bag, output_crs=output_crs, resolution=resolution, align=align)
         else:
-            data = self.input.fetch(box)
+            with _stage(self.identifier, "group"):
+                box = self.input.group(bag)
 
-        coords = {
-            "longitude": np.array([lonlat[0]]),
-            "latitude": np.array([lonlat[1]]),
-            "time": data.time.data,
-        }
+        with _stage(self.identifier, "fetch"):
+            if self.dask_enabled:
+                data = self.input.fetch(box, dask_chunks={"time": 1})
+                data = data.compute()
+            else:
+                data = self.input.fetch(box)
+        _observe_input(self.identifier, len(list(bag.contained_datasets())), box.box.shape[0], data.nbytes)
 
-        result = xarray.Dataset()
-        for measurement_name, measurement in measurements.items():
-            result[measurement_name] = xarray.DataArray(
-                data[measurement_name],
-                dims=("time", "longitude", "latitude"),
-                coords=coords,
-                attrs={
-                    key: value
-                    for key, value in measurement.items()
-                    if key in ["flags_definition"]
-                },
-            )
-        return result
+        return _point_dataset(data, data.time.data, lonlat, measurements)
 
     def process_data(self, data: xarray.Dataset, parameters: dict) -> pandas.DataFrame:
         raise NotImplementedError
 
-    def render_chart(self, df: pandas.DataFrame) -> altair.Chart:
+    def render_chart(self, df: pandas.DataFrame) -> "altair.Chart":
         raise NotImplementedError
 
     def render_outputs(
         self,
         df: pandas.DataFrame,
-        chart: altair.Chart,
+        chart: "altair.Chart",
         is_enabled=True,
         name="Timeseries",
         header=True,
@@ -542,11 +702,21 @@ class PixelDrill(Process):
             is_enabled=is_enabled,
             name=name,
             header=header,
+            chart_outputs=self.chart_outputs,
+            identifier=self.about["identifier"],
         )
 
 
 class PolygonDrill(Process):
-    def __init__(self, about, input, style):
+    # set by drills whose `process_data` reduces each time slice on its own,
+    # so that it can be run on a few time slices at a time
+    time_slice_independent = False
+
+    # set by drills whose `process_data` is `finalise_data` of the per time slice sums of `reduce_data`,
+    # so that large polygons can be reduced one tile at a time
+    additive = False
+
+    def __init__(self, about, input, style, prefilter=None):
         if "geometry_type" in about:
             assert about["geometry_type"] == "polygon"
 
@@ -557,15 +727,17 @@ class PolygonDrill(Process):
             **{
                 key: value
                 for key, value in about.items()
-                if key not in ["geometry_type", "guard_rail"]
+                if key not in NON_PYWPS_KEYS
             },
         )
 
         self.about = about
         self.input = input
         self.style = style
+        self.prefilter = prefilter
         self.mask_all_touched = False
         self.json_version = "v8"
+        self.chart_outputs = CHART_OUTPUTS
 
         # self.dask_client = dask_client = Client(
         #     n_workers=num_dask_workers(), processes=True, threads_per_worker=1
@@ -576,6 +748,9 @@ class PolygonDrill(Process):
             # get the Dask Client associated with the current Gunicorn worker
             self.dask_client = worker_client()
 
+        # only lazily loaded data can be streamed
+        self.streaming = self.time_slice_independent and self.dask_enabled and about.get("streaming", True)
+
     def input_formats(self):
         return [
             ComplexInput(
@@ -597,19 +772,16 @@ class PolygonDrill(Process):
             )
         ]
 
+    @log_call
     def request_handler(self, request, response):
         time = _get_time(request)
         feature = _get_feature(request)
         parameters = _get_parameters(request)
+        profile = profile_requested(request, parameters)
+        self.chart_outputs = _get_chart_outputs(request)
 
-        result = self.query_handler(time, feature, parameters=parameters)
+        outputs = _request_outputs(self, time, feature, parameters, profile=profile)
 
-        if self.style['csv']:
-            outputs = self.render_outputs(result["data"], None)
-        
-        elif self.style['table']:
-            outputs = self.render_outputs(result["data"], result["chart"])
-        
         _populate_response(response, outputs)
         return response
 
@@ -618,54 +790,40 @@ class PolygonDrill(Process):
         if parameters is None:
             parameters = {}
 
-        configure_s3_access(
-            # aws_unsigned=True,
-            region_name=os.getenv("AWS_DEFAULT_REGION", "auto"),
-            client=self.dask_client,
-        )
-
-        with datacube.Datacube() as dc:
-            data = self.input_data(dc, time, feature)
-
-        df = self.process_data(data, {"time": time, "feature": feature, **parameters})
+        df = _query_result(self, time, feature, parameters)
         
         # If csv specified, return timeseries in csv form
-        if self.style['csv']:
+        if self.style.get('csv'):
             return {"data": df}
     
         # If table style specified in config, return chart (static timeseries)
         elif self.style['table'] is not None:
-            chart = self.render_chart(df)
+            with _stage(self.identifier, "chart"):
+                chart = self.render_chart(df)
             return {"data": df, "chart": chart}
         
         
 
-    def input_data(self, dc, time, feature):
-        if time is None:
-            bag = self.input.query(dc, geopolygon=feature)
-        else:
-            bag = self.input.query(dc, time=time, geopolygon=feature)
-        
+    def input_data(self, dc, time, feature, parameters=None):
+        with _stage(self.identifier, "query"):
+            bag = _query(self.input, dc, time, feature)
+
         output_crs = self.input.get('output_crs')
         resolution = self.input.get('resolution')
         align = self.input.get('align')
 
         if not (output_crs and resolution):
-            print('parameters for Geobox not found in inputs')
-            if type(self.input) in (Product,):
-                print('Checking grid_spec in product')
+            if isinstance(self.input, Product):
                 if bag.product_definitions[self.input._product].grid_spec:
-                    print('grid_spec exists - do nothing')
+                    annotate(geobox_from="grid_spec")
                 else:
                     output_crs = mostcommon_crs(list(bag.bag))
+                    annotate(geobox_from="datasets")
 
-            elif type(self.input) in (Juxtapose,):
-                print('Checking grid_spec of each product')
-                print(list(bag.product_definitions.values()))
-
+            elif isinstance(self.input, Juxtapose):
                 grid_specs = [product_definition.grid_spec for product_definition in list(bag.product_definitions.values()) if getattr(product_definition, 'grid_spec', None)]
                 if len(set(grid_specs)) == 1:
-                    print('grid_spec exists for all products and are all the same - do nothing')
+                    annotate(geobox_from="grid_spec")
 
                 elif len(set(grid_specs)) > 1:
                     raise ValueError('Multiple grid_spec detected across all products - override target output_crs, resolution in config')
@@ -675,38 +833,114 @@ class PolygonDrill(Process):
                         raise ValueError('add target resolution to config')
 
                     elif not output_crs:
-                        output_crs = mostcommon_crs(bag.contained_datasets())                    
+                        output_crs = mostcommon_crs(bag.contained_datasets())
+                        annotate(geobox_from="datasets")
 
-        box = self.input.group(bag, output_crs=output_crs, resolution=resolution, align=align)
+        with _stage(self.identifier, "group"):
+            box = self.input.group(bag, output_crs=output_crs, resolution=resolution, align=align)
 
-        if self.about.get("guard_rail", True):
-            _guard_rail(self.input, box)
+        if self.prefilter is not None and self.prefilter_enabled(parameters or {}):
+            with _stage(self.identifier, "prefilter"):
+                box = self.prefilter_box(dc, box, time, feature)
 
-        # TODO customize the number of processes
+        # large polygons are loaded and reduced one tile at a time, so the guard rail is per tile
+        tiles = _tiles(box, feature) if self.additive and self.dask_enabled else [box]
+
+        if self.about.get("guard_rail", True):
+            with _stage(self.identifier, "guard_rail"):
+                _guard_rail(self.input, max(tiles, key=lambda tile: np.prod(tile.shape)), streaming=self.streaming)
+
+        _observe_input(self.identifier, len(list(bag.contained_datasets())), box.box.shape[0],
+                       sum(_box_bytes(self.input, tile) for tile in tiles))
+
+        if len(tiles) == 1:
+            return self.load_data(tiles[0], feature)
+        return [self.load_data(tile, feature) for tile in tiles]
+
+    def prefilter_enabled(self, parameters):
+        """Whether dropping time slices with too few valid pixels leaves the result unchanged"""
+        return True
+
+    def prefilter_box(self, dc, box, time, feature):
+        """
+        `box` without the time slices in which the fraction of the polygon that may be valid is at most
+        the `threshold` of the `prefilter` settings. That is worked out from the `valid` band of the
+        `input` of the prefilter, which only loads the (small) bands needed for it.
+        """
+        if box.geobox is None:
+            return box
+
+        product = self.prefilter["input"]
+        threshold = self.prefilter.get("threshold", 0.0)
+
+        bag = _query(product, dc, time, feature)
+        grouped = product.group(bag, output_crs=box.geobox.crs, resolution=box.geobox.resolution)
+        if grouped.box.size == 0:
+            return box
+
+        # on the same pixels as the expensive bands
+        grouped = VirtualDatasetBox(grouped.box, box.geobox, grouped.load_natively, grouped.product_definitions,
+                                    geopolygon=grouped.geopolygon)
         if self.dask_enabled:
-            data = self.input.fetch(box, dask_chunks={"time": 1})
+            valid = product.fetch(grouped, dask_chunks=_dask_chunks(grouped)).valid
         else:
-            data = self.input.fetch(box)
+            valid = product.fetch(grouped).valid
+        valid = mask_to_polygon(valid.to_dataset(), feature, all_touched=self.mask_all_touched).valid
 
-        mask = geometry_mask(
-            feature, data.geobox, all_touched=self.mask_all_touched, invert=True
-        )
+        area = geometry_mask(feature, box.geobox, all_touched=self.mask_all_touched, invert=True).sum()
+        fraction = ((valid > 0).sum(box.geobox.dimensions) / area).compute()
 
-        # mask out data outside requested polygon
-        for band_name, band_array in data.data_vars.items():
-            if "nodata" in band_array.attrs:
-                data[band_name] = band_array.where(
-                    mask, other=band_array.attrs["nodata"]
-                )
+        failing = fraction.time.data[fraction.data <= threshold]
+        keep = ~np.isin(box.box.time.data, failing)
+        annotate(prefilter_kept=int(keep.sum()), prefilter_time_slices=keep.size)
+
+        if keep.all():
+            return box
+        if not keep.any():
+            # the drill itself deals with not having any valid observations
+            keep[0] = True
+        return VirtualDatasetBox(box.box[keep], box.geobox, box.load_natively, box.product_definitions,
+                                 geopolygon=box.geopolygon)
+
+    def load_data(self, box, feature):
+        # TODO customize the number of processes
+        with _stage(self.identifier, "fetch"):
+            if self.dask_enabled:
+                data = self.input.fetch(box, dask_chunks=_dask_chunks(box))
             else:
-                data[band_name] = band_array.where(mask)
+                data = self.input.fetch(box)
 
-        return data
+        # mask out data outside requested polygon
+        # the geobox of `box` is the bounding box of the polygon, chunks outside the polygon are not read
+        with _stage(self.identifier, "mask"):
+            return mask_to_polygon(data, feature, all_touched=self.mask_all_touched)
 
     def process_data(self, data: xarray.Dataset, parameters: dict) -> pandas.DataFrame:
+        if not self.additive:
+            raise NotImplementedError
+        return self.finalise_data(self.reduce_data(data, parameters), parameters)
+
+    def reduce_data(self, data: xarray.Dataset, parameters: dict) -> pandas.DataFrame:
+        """Per time slice partial results of an additive drill, that can be summed across tiles"""
+        reduced = self.reduce_lazy(data, parameters)
+        if self.dask_client:
+            with span('compute'):
+                reduced = reduced.compute()
+        return self.reduce_frame(data, reduced, parameters)
+
+    def reduce_lazy(self, data: xarray.Dataset, parameters: dict):
+        """The (lazy, and small) per time slice reduction of `data` that `reduce_data` computes"""
+        raise NotImplementedError
+
+    def reduce_frame(self, data: xarray.Dataset, reduced, parameters: dict) -> pandas.DataFrame:
+        """The `reduce_data` DataFrame of `data` from its computed `reduce_lazy` reduction"""
         raise NotImplementedError
 
-    def render_chart(self, df: pandas.DataFrame) -> altair.Chart:
+    def finalise_data(self, df: pandas.DataFrame, parameters: dict) -> pandas.DataFrame:
+        """The result of an additive drill from the sums of `reduce_data`"""
+        return df
+
+    def render_chart(self, df: pandas.DataFrame) -> "altair.Chart":
         raise NotImplementedError
 
     def render_outputs(
@@ -720,9 +954,7 @@ class PolygonDrill(Process):
         # patch in here for the time being
         # might be better
         if "wit" == self.about.get("identifier", "").lower():
-            url = write_df_to_parquet(
-                df, str(self.uuid), self.about.get("identifier").lower()
-            )
+            url = write_df_to_parquet(df, str(self.uuid), self.about["identifier"])
             return {'url': {'data': url}}
         return _render_outputs(
             self.uuid,
@@ -733,4 +965,6 @@ class PolygonDrill(Process):
             is_enabled=is_enabled,
             name=name,
             header=header,
+            chart_outputs=self.chart_outputs,
+            identifier=self.about["identifier"],
         )
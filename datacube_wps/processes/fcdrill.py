@@ -1,15 +1,13 @@
-from timeit import default_timer
-
-import altair
-import numpy as np
-import xarray
-from datacube.utils.masking import make_mask
 from pywps import ComplexOutput, LiteralOutput
 
 from . import FORMATS, PolygonDrill, chart_dimensions, log_call
+from .kernels import FC_COUNTS, fc_counts_frame, fc_dominance_counts, fc_percentages
 
 
 class FCDrill(PolygonDrill):
+    time_slice_independent = True
+    additive = True
+
     SHORT_NAMES = ['BS', 'PV', 'NPV', 'Unobservable']
     LONG_NAMES = ['Bare Soil',
                   'Photosynthetic Vegetation',
@@ -23,7 +21,7 @@ class FCDrill(PolygonDrill):
                               supported_formats=[FORMATS['output_json']])]
 
     @log_call
-    def process_data(self, data, parameters):
+    def reduce_lazy(self, data, parameters):
         wofs_mask_flags = [
             dict(dry=True),
             dict(terrain_shadow=False, high_slope=False, cloud_shadow=False, cloud=False)
@@ -32,65 +30,24 @@ class FCDrill(PolygonDrill):
         water = data.data_vars['water']
         data = data.drop_vars(['water'])
 
-        total = data.count(dim=['x', 'y'])
-        total_valid = (data != -1).sum(dim=['x', 'y'])
-
-        # TODO enable this check, investigate why it fails
+        # TODO enable a check for no valid data, investigate why it fails
         # if total_valid <= 0:
         #     raise ProcessError('query returned no data')
 
-        for m in wofs_mask_flags:
-            mask = make_mask(water, **m)
-            data = data.where(mask)
-
-        total_invalid = (np.isnan(data)).sum(dim=['x', 'y'])
-        not_pixels = total_valid - (total - total_invalid)
-
-        # following robbi's advice, cast the dataset to a dataarray
-        maxFC = data.to_array(dim='variable', name='maxFC')
-
-        # turn FC array into integer only as nanargmax doesn't seem to handle floats the way we want it to
-        FC_int = maxFC.astype('int16')
+        # valid, unobservable and dominant cover type pixel counts, in one pass over the data
+        return fc_dominance_counts(data, water, wofs_mask_flags)
 
-        # use numpy.nanargmax to get the index of the maximum value along the variable dimension
-        # BSPVNPV=np.nanargmax(FC_int, axis=0)
-        BSPVNPV = FC_int.argmax(dim='variable')
-
-        FC_mask = np.isfinite(maxFC).all(dim='variable')   # pylint: disable=no-member,unexpected-keyword-arg
-
-        # #re-mask with nans to remove no-data
-        BSPVNPV = BSPVNPV.where(FC_mask)
-
-        FC_dominant = xarray.Dataset({
-            'bs': (BSPVNPV == 0).where(FC_mask),
-            'pv': (BSPVNPV == 1).where(FC_mask),
-            'npv': (BSPVNPV == 2).where(FC_mask)
-        })
-
-        FC_count = FC_dominant.sum(dim=['x', 'y'])
+    def reduce_frame(self, data, reduced, parameters):
+        return fc_counts_frame(data.time.data, reduced)
 
+    def finalise_data(self, df, parameters):
         # Fractional cover pixel count method
         # Get number of FC pixels, divide by total number of pixels per polygon
-        new_ds = xarray.Dataset({
-            'bs': (FC_count.bs / total_valid)['bs'] * 100,
-            'pv': (FC_count.pv / total_valid)['pv'] * 100,
-            'npv': (FC_count.npv / total_valid)['npv'] * 100,
-            'Unobservable': (not_pixels / total_valid)['bs'] * 100
-        })
-
-        if self.dask_client:
-            print('dask compute')
-            dask_time = default_timer()
-            new_ds = new_ds.compute()
-            print('dask took', default_timer() - dask_time, 'seconds')
-            print(new_ds)
-
-        df = new_ds.to_dataframe()
-        df = df.drop('spatial_ref', axis=1)
-        df.reset_index(inplace=True)
-        return df
+        return fc_percentages(df.time.values, df[FC_COUNTS])
 
     def render_chart(self, df):
+        import altair  # pylint: disable=import-outside-toplevel
+
         width, height = chart_dimensions(self.style)
 
         melted = df.melt('time', var_name='Cover Type', value_name='Area')
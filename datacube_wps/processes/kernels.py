@@ -0,0 +1,123 @@
+import dask.array
+import numpy as np
+import pandas
+from datacube.utils.masking import create_mask_value, get_flags_def
+
+# columns of the per time slice counts returned by `fc_dominance_counts`
+FC_COUNTS = ['valid_bs', 'valid_pv', 'valid_npv', 'unobservable', 'bs', 'pv', 'npv']
+
+
+def combined_mask_value(flags_definition, flag_sets):
+    """
+    A single `(mask, value)` test equivalent to the logical AND of `make_mask` over `flag_sets`,
+    or `None` if the flag sets contradict each other.
+    """
+    mask, value = 0, 0
+    for flags in flag_sets:
+        m, v = create_mask_value(flags_definition, **flags)
+        if (value & m & mask) != (v & m & mask):
+            return None
+        mask, value = mask | m, value | v
+    return mask, value
+
+
+def _as_int16(band):
+    # the dominant band used to be picked after casting to int16, keep that behaviour for float data
+    if np.issubdtype(band.dtype, np.floating):
+        with np.errstate(invalid='ignore'):
+            return band.astype('int16')
+    return band
+
+
+def _fc_block_counts(bs, pv, npv, water=None, mask_value=None, nodata=-1):
+    """Counts in `FC_COUNTS` order for one (time, y, x) block, shaped (time, 1, 1, 7)"""
+    # pylint: disable=too-many-locals
+    counts = np.zeros((bs.shape[0], 1, 1, len(FC_COUNTS)), dtype='int64')
+    floating = np.issubdtype(bs.dtype, np.floating)
+
+    # one time slice at a time, so that temporaries are 2-D
+    for index in range(bs.shape[0]):
+        b, p, n = bs[index], pv[index], npv[index]
+
+        if water is None:
+            keep = np.ones(b.shape, dtype=bool)
+        elif mask_value is None:
+            keep = np.zeros(b.shape, dtype=bool)
+        else:
+            keep = (water[index] & mask_value[0]) == mask_value[1]
+
+        # unobservable = valid - (total - invalid), where total counts the non-NaN pixels
+        # and invalid counts the pixels that are NaN or masked out by the water flags
+        valid_b = np.count_nonzero(b != nodata)
+        if floating:
+            finite_b = np.isfinite(b)
+            usable = keep & finite_b & np.isfinite(p) & np.isfinite(n)
+            unobservable = valid_b - np.count_nonzero(finite_b & keep) + np.count_nonzero(~finite_b)
+        else:
+            usable = keep
+            unobservable = valid_b - np.count_nonzero(keep)
+
+        b, p, n = _as_int16(b), _as_int16(p), _as_int16(n)
+        bs_wins = (b >= p) & (b >= n)
+        pv_wins = ~bs_wins & (p >= n)
+        npv_wins = ~(bs_wins | pv_wins)
+
+        counts[index, 0, 0] = (valid_b,
+                               np.count_nonzero(pv[index] != nodata),
+                               np.count_nonzero(npv[index] != nodata),
+                               unobservable,
+                               np.count_nonzero(bs_wins & usable),
+                               np.count_nonzero(pv_wins & usable),
+                               np.count_nonzero(npv_wins & usable))
+    return counts
+
+
+def fc_dominance_counts(data, water=None, flag_sets=None):
+    """
+    Per time slice counts of valid, unobservable and bs/pv/npv-dominant pixels.
+
+    Computes everything the fractional cover drills need in one pass over each
+    (time, y, x) block of `data.bs`, `data.pv` and `data.npv`, optionally masking by the
+    `flag_sets` of the WOfS `water` band. Returns an (time, 7) array in `FC_COUNTS` order,
+    lazy if the data is.
+    """
+    bands = [data['bs'].data, data['pv'].data, data['npv'].data]
+    kwargs = {}
+    if water is not None:
+        bands.append(water.data)
+        kwargs['mask_value'] = combined_mask_value(get_flags_def(water), flag_sets)
+
+    if not isinstance(bands[0], dask.array.Array):
+        return _fc_block_counts(*bands, **kwargs).sum(axis=(1, 2))
+
+    chunks = bands[0].chunks
+    bands = [dask.array.asarray(band).rechunk(chunks) for band in bands]
+    counts = dask.array.map_blocks(_fc_block_counts, *bands, **kwargs,
+                                   dtype='int64',
+                                   new_axis=3,
+                                   chunks=(chunks[0],
+                                           (1,) * len(chunks[1]),
+                                           (1,) * len(chunks[2]),
+                                           (len(FC_COUNTS),)))
+    return counts.sum(axis=(1, 2))
+
+
+def fc_counts_frame(times, counts):
+    """`FC_COUNTS` per time slice as a DataFrame, which can be summed across tiles"""
+    df = pandas.DataFrame(np.asarray(counts, dtype='int64'), columns=FC_COUNTS)
+    df.insert(0, 'time', times)
+    return df
+
+
+def fc_percentages(times, counts):
+    """Fractional cover drill result (percentage of valid pixels per cover type) from `FC_COUNTS`"""
+    counts = dict(zip(FC_COUNTS, np.asarray(counts, dtype='float64').T))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return pandas.DataFrame({
+            'time': times,
+            'bs': counts['bs'] / counts['valid_bs'] * 100,
+            'pv': counts['pv'] / counts['valid_pv'] * 100,
+            'npv': counts['npv'] / counts['valid_npv'] * 100,
+            'Unobservable': counts['unobservable'] / counts['valid_bs'] * 100,
+        })
@@ -1,15 +1,13 @@
-import altair
 import xarray
 
 from . import PolygonDrill, chart_dimensions, log_call
 
 class MangroveDrill(PolygonDrill):
+    time_slice_independent = True
+    additive = True
 
     @log_call
-    def process_data(self, data, parameters):
-        if self.dask_client:
-            data = data.compute()
-
+    def reduce_lazy(self, data, parameters):
         # TODO raise ProcessError('query returned no data') when appropriate
         woodland = data.where(data == 1).count(['x', 'y'])
         woodland = woodland.rename(name_dict={'canopy_cover_class': 'Woodland'})
@@ -18,14 +16,18 @@ class MangroveDrill(PolygonDrill):
         closed_forest = data.where(data == 3).count(['x', 'y'])
         closed_forest = closed_forest.rename(name_dict={"canopy_cover_class": 'Closed Forest'})
 
-        final = xarray.merge([woodland, open_forest, closed_forest])
-        result = final.to_dataframe()
+        return xarray.merge([woodland, open_forest, closed_forest])
+
+    def reduce_frame(self, data, reduced, parameters):
+        result = reduced.to_dataframe()
         result = result.drop('spatial_ref', axis=1)
         result.reset_index(inplace=True)
         return result
 
     @log_call
     def render_chart(self, df):
+        import altair  # pylint: disable=import-outside-toplevel
+
         width, height = chart_dimensions(self.style)
 
         melted = df.melt('time', var_name='Cover Type', value_name='Area')
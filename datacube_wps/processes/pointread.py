@@ -0,0 +1,77 @@
+import math
+
+import dask
+import numpy as np
+from datacube import Datacube
+from datacube.api.query import query_group_by
+from datacube.drivers import new_datasource
+from datacube.storage import BandInfo
+from datacube.utils.math import invalid_mask
+
+
+def read_pixel(dataset, band, point, nodata, dtype):
+    """Read the native pixel of `dataset` that contains `point`, or `None` if it falls outside"""
+    source = new_datasource(BandInfo(dataset, band))
+    with source.open() as rdr:
+        x, y = point.to_crs(rdr.crs).coords[0][:2]
+        col, row = ~rdr.transform * (x, y)
+        row, col = int(math.floor(row)), int(math.floor(col))
+
+        height, width = rdr.shape
+        if not (0 <= row < height and 0 <= col < width):
+            return None
+
+        pixel = rdr.read(window=((row, row + 1), (col, col + 1)))
+        src_nodata = rdr.nodata
+
+    pixel = pixel.reshape((1, 1))
+    if src_nodata is not None and nodata is not None and src_nodata != nodata:
+        pixel = np.where(invalid_mask(pixel, src_nodata), nodata, pixel)
+    return pixel.astype(dtype)
+
+
+def fuse_pixels(pixels, nodata, dtype, fuse_func=None):
+    """Fuse the pixels of one group the same way `Datacube.load_data` fuses whole tiles"""
+    def copyto_fuser(dest, src):
+        np.copyto(dest, src, where=invalid_mask(dest, nodata))
+
+    fuse_func = fuse_func or copyto_fuser
+
+    destination = np.full((1, 1), nodata, dtype=dtype)
+    for pixel in pixels:
+        if pixel is not None:
+            fuse_func(destination, pixel)
+    return destination
+
+
+def read_point(product, bag, point, measurements):
+    """
+    Sample `point` from each dataset in `bag` (of a single `Product`) without building a geobox.
+
+    Returns a mapping from measurement name to a `(time, 1, 1)` array and the time coordinates,
+    grouped and fused using the `group_by` and `fuse_func` settings of `product`.
+    """
+    group_by = query_group_by(**{key: value for key, value in product.items() if key == 'group_by'})
+    grouped = Datacube.group_datasets(list(bag.bag), group_by)
+    product_definition = bag.product_definitions[product['product']]
+    fuse_func = product.get('fuse_func')
+
+    reads = {}
+    for name, measurement in measurements.items():
+        band = product_definition.canonical_measurement(name)
+        reads[name] = [[dask.delayed(read_pixel)(dataset, band, point, measurement.nodata, measurement.dtype)
+                        for dataset in datasets]
+                       for datasets in grouped.values]
+
+    pixels, = dask.compute(reads)
+
+    data = {}
+    for name, measurement in measurements.items():
+        fused = [fuse_pixels(group, measurement.nodata, measurement.dtype, fuse_func)
+                 for group in pixels[name]]
+        if fused:
+            data[name] = np.stack(fused)
+        else:
+            data[name] = np.empty((0, 1, 1), dtype=measurement.dtype)
+
+    return data, grouped.time.data
@@ -0,0 +1,146 @@
+from functools import partial
+
+import dask.array
+import numpy as np
+import rasterio.features
+import xarray
+from dask.base import tokenize
+from dask.highlevelgraph import HighLevelGraph
+
+
+def geometry_mask(geom, geobox, all_touched=False, invert=False):
+    return rasterio.features.geometry_mask(
+        [geom.to_crs(geobox.crs)],
+        out_shape=geobox.shape,
+        transform=geobox.affine,
+        all_touched=all_touched,
+        invert=invert,
+    )
+
+
+OUTSIDE, INSIDE, PARTIAL = 'outside', 'inside', 'partial'
+
+
+class ChunkMasks:
+    """
+    The polygon mask of a geobox, one spatial chunk at a time.
+
+    Chunks entirely outside or inside the polygon are known without rasterising anything;
+    the mask of a chunk the polygon boundary crosses is rasterised from the geometry on the
+    dask worker, so no full-size mask is ever embedded in the task graph.
+    """
+
+    def __init__(self, geom, geobox, chunks, all_touched=False):
+        self.geom = geom.to_crs(geobox.crs)
+        self.geobox = geobox
+        self.chunks = tuple(tuple(c) for c in chunks)
+        self.all_touched = all_touched
+        self.offsets = [np.cumsum((0,) + c) for c in self.chunks]
+
+    def chunk_geobox(self, iy, ix):
+        (ys, xs) = self.offsets
+        return self.geobox[ys[iy]:ys[iy + 1], xs[ix]:xs[ix + 1]]
+
+    def coverage(self, iy, ix):
+        extent = self.chunk_geobox(iy, ix).extent
+        if not self.geom.intersects(extent):
+            return OUTSIDE
+        if not self.all_touched and self.geom.intersection(extent).area == 0:
+            # only shares an edge, so no pixel centre is inside
+            return OUTSIDE
+        if self.geom.contains(extent):
+            return INSIDE
+        return PARTIAL
+
+    def outside(self):
+        """The (iy, ix) indices of the chunks entirely outside the polygon"""
+        return {(iy, ix) for iy in range(len(self.chunks[0])) for ix in range(len(self.chunks[1]))
+                if self.coverage(iy, ix) == OUTSIDE}
+
+    def chunk_mask(self, iy, ix):
+        """Boolean mask of a chunk"""
+        coverage = self.coverage(iy, ix)
+        geobox = self.chunk_geobox(iy, ix)
+        if coverage == PARTIAL:
+            return geometry_mask(self.geom, geobox, all_touched=self.all_touched, invert=True)
+        return np.full(geobox.shape, coverage == INSIDE, dtype=bool)
+
+    def _block(self, block, block_info=None):
+        return self.chunk_mask(*block_info[None]["chunk-location"])
+
+    def full_mask(self):
+        """Lazy boolean mask of the whole geobox, chunked like the data, one task per chunk"""
+        template = dask.array.empty(self.geobox.shape, chunks=self.chunks, dtype=bool)
+        return template.map_blocks(self._block, dtype=bool)
+
+
+def _apply_mask(block, mask, nodata):
+    if mask.all():
+        return block
+    if not mask.any():
+        return np.full(block.shape, nodata, dtype=block.dtype)
+    return np.where(mask, block, np.array(nodata, dtype=block.dtype))
+
+
+def _fill(shape, nodata, dtype, mask):
+    return np.full(shape, nodata, dtype=dtype)
+
+
+def _mask_band(array, mask, outside, nodata):
+    """
+    Set the pixels of dask `array` (..., y, x) outside the lazy `mask` (y, x) to `nodata`.
+
+    The blocks of the spatial chunks in `outside` are replaced by constant nodata blocks,
+    so that their reads drop out of the graph.
+    """
+    # the mask is broadcast over the leading dimensions, so each spatial chunk is rasterised once
+    masked = dask.array.map_blocks(_apply_mask, array, mask, nodata=nodata, dtype=array.dtype)
+    if not outside:
+        return masked
+
+    name = "mask-outside-" + tokenize(masked, sorted(outside))
+    layer = {}
+    for index in np.ndindex(*masked.numblocks):
+        if index[-2:] in outside:
+            shape = tuple(chunks[i] for chunks, i in zip(masked.chunks, index))
+            # on the (cheap) mask of the chunk, as thousands of tasks without dependencies slow down dask.order
+            layer[(name,) + index] = (partial(_fill, shape, nodata, masked.dtype), (mask.name,) + index[-2:])
+        else:
+            layer[(name,) + index] = (masked.name,) + index
+    graph = HighLevelGraph.from_collections(name, layer, dependencies=[masked, mask])
+    return dask.array.Array(graph, name, masked.chunks, dtype=masked.dtype)
+
+
+def mask_to_polygon(data, geom, all_touched=False):
+    """
+    Mask out the pixels of each band of `data` that are outside `geom`.
+
+    Bands with a `nodata` attribute are set to it, others to NaN. Lazy data stays lazy,
+    and is masked per spatial chunk with `ChunkMasks`.
+    """
+    geobox = data.geobox
+    spatial_dims = tuple(geobox.dimensions)
+    lazy = [band for band in data.data_vars.values()
+            if isinstance(band.data, dask.array.Array) and band.dims[-2:] == spatial_dims]
+
+    if not lazy:
+        mask = geometry_mask(geom, geobox, all_touched=all_touched, invert=True)
+        mask = xarray.DataArray(mask, dims=spatial_dims)
+    else:
+        masks = ChunkMasks(geom, geobox, lazy[0].data.chunks[-2:], all_touched=all_touched)
+        mask = xarray.DataArray(masks.full_mask(), dims=spatial_dims)
+        outside = masks.outside()
+
+    for band_name, band_array in data.data_vars.items():
+        if "nodata" in band_array.attrs:
+            nodata = band_array.attrs["nodata"]
+            if lazy and band_array.dims[-2:] == spatial_dims and \
+                    isinstance(band_array.data, dask.array.Array) and \
+                    band_array.data.chunks[-2:] == lazy[0].data.chunks[-2:]:
+                data[band_name] = band_array.copy(data=_mask_band(band_array.data, mask.data, outside, nodata))
+            else:
+                data[band_name] = band_array.where(mask, other=nodata)
+        else:
+            data[band_name] = band_array.where(mask)
+
+    return data
@@ -1,5 +1,6 @@
 from datetime import datetime, timezone
 
+import dask.array
 import numpy as np
 import xarray as xr
 from datacube.model import Measurement
@@ -7,18 +8,26 @@ from datacube.virtual.impl import Transformation
 from datacube.virtual.transformations import ApplyMask
 from pywps import LiteralOutput
 
-from . import PolygonDrill, geometry_mask, log_call
+from . import PolygonDrill, annotate, geometry_mask, log_call
 
 ls_timezone = timezone.utc
 
 
+# the catalog declares these periods as `time_windows` of the products,
+# which keeps the datasets outside them from being returned by the index at all
+
+
+def _center_time(dataset):
+    center_time = dataset.center_time
+    if (center_time.tzinfo is None) or (center_time.tzinfo.utcoffset(center_time) is None):
+        return center_time.replace(tzinfo=ls_timezone)
+    return center_time
+
+
 def ls8_on(dataset):
     LS8_START_DATE = datetime(2013, 1, 1, tzinfo=ls_timezone)
 
-    if (dataset.center_time.tzinfo is None) or (dataset.center_time.tzinfo.utcoffset(dataset.center_time) is None):
-        dataset.center_time = dataset.center_time.replace(tzinfo=ls_timezone)
-
-    return dataset.center_time >= LS8_START_DATE
+    return _center_time(dataset) >= LS8_START_DATE
 
 
 def ls7_on(dataset):
@@ -26,11 +35,9 @@ def ls7_on(dataset):
     LS7_STOP_AGAIN = datetime(2013, 5, 31, tzinfo=ls_timezone)
     LS7_START_AGAIN = datetime(2010, 1, 1, tzinfo=ls_timezone)
 
-    if (dataset.center_time.tzinfo is None) or (dataset.center_time.tzinfo.utcoffset(dataset.center_time) is None):
-        dataset.center_time = dataset.center_time.replace(tzinfo=ls_timezone)
-
-    return dataset.center_time <= LS7_STOP_DATE or (dataset.center_time >= LS7_START_AGAIN
-                                                    and dataset.center_time <= LS7_STOP_AGAIN)
+    center_time = _center_time(dataset)
+    return center_time <= LS7_STOP_DATE or (center_time >= LS7_START_AGAIN
+                                            and center_time <= LS7_STOP_AGAIN)
 
 
 def ls5_on_1ym(dataset):
@@ -38,28 +45,27 @@ def ls5_on_1ym(dataset):
     LS5_STOP_DATE = datetime(1999, 12, 31, tzinfo=ls_timezone)
     LS5_STOP_AGAIN = datetime(2011, 12, 31, tzinfo=ls_timezone)
 
-    if (dataset.center_time.tzinfo is None) or (dataset.center_time.tzinfo.utcoffset(dataset.center_time) is None):
-        dataset.center_time = dataset.center_time.replace(tzinfo=ls_timezone)
-
-    return dataset.center_time <= LS5_STOP_DATE or (dataset.center_time >= LS5_START_AGAIN
-                                                    and dataset.center_time <= LS5_STOP_AGAIN)
+    center_time = _center_time(dataset)
+    return center_time <= LS5_STOP_DATE or (center_time >= LS5_START_AGAIN
+                                            and center_time <= LS5_STOP_AGAIN)
 
 
 class WIT(PolygonDrill):
-    def __init__(self, about, input, style):
-        super().__init__(about, input, style)
+    def __init__(self, about, input, style, prefilter=None):
+        super().__init__(about, input, style, prefilter=prefilter)
         self.mask_all_touched = True
-        print("mask all touch", self.mask_all_touched)
 
     def output_formats(self):
         return [LiteralOutput("url", "WIT timeseries data")]
 
+    def prefilter_enabled(self, parameters):
+        # time slices are only dropped for too few valid pixels before aggregating them
+        return parameters.get('aggregate', 0) <= 0
+
     @log_call
     def process_data(self, data, parameters):
         feature = parameters.get('feature')
         adays = parameters.get('aggregate', 0)
-        print("feature in wit", feature)
-        print("geobox of data", data.geobox)
         geomask = geometry_mask(feature, data.geobox, invert=True, all_touched=self.mask_all_touched)
 
         if adays > 0:
@@ -67,7 +73,7 @@ class WIT(PolygonDrill):
         else:
             aggregated = data
         total_area = geomask.astype('int').sum()
-        print("polygon area", total_area)
+        annotate(polygon_area=int(total_area), mask_all_touched=self.mask_all_touched)
         re_wit = cal_area(aggregated)
         re_wit = re_wit[(re_wit['valid']/total_area) > 0.9].dropna()
         re_wit = re_wit.drop(columns=['valid']).div(re_wit['valid'], axis=0)
@@ -78,6 +84,59 @@ class WIT(PolygonDrill):
         pass
 
 
+# WOfS bits that have to be clear for a usable observation:
+# nodata (0), noncontiguous (1), cloud shadow (5), cloud (6) and water observed (7)
+WOFS_CLEAR_BITS = 0b11100011
+WOFS_WET = 1 << 7
+
+# fmask values that are not usable: nodata, cloud and cloud shadow
+FMASK_CLEAR = np.ones(256, dtype=bool)
+FMASK_CLEAR[[0, 2, 3]] = False
+
+
+def blockwise(func, *arrays, dtype, **kwargs):
+    """`func` over each block of `arrays` if they are lazy, or over them as they are"""
+    if isinstance(arrays[0], dask.array.Array):
+        return dask.array.map_blocks(func, *arrays, dtype=dtype, **kwargs)
+    return func(*arrays, **kwargs)
+
+
+def _water_value(water):
+    # water observed, and not nodata, noncontiguous, cloud or cloud shadow
+    return ((water & WOFS_CLEAR_BITS) == WOFS_WET).astype('int16')
+
+
+def _pixel_mask(water, fmask, contiguity):
+    if fmask.dtype == np.uint8:
+        mask = FMASK_CLEAR[fmask]
+    else:
+        mask = ~np.isin(fmask, (0, 2, 3))
+    mask &= contiguity == 1
+    mask &= (water & WOFS_CLEAR_BITS) == 0
+    return mask
+
+
+def _tasselled_cap(*bands, coeffs, nodata):
+    # float32 weighted sum of the bands, or nodata where any of them is not valid
+    result = np.zeros(bands[0].shape, dtype='float32')
+    scaled = np.empty(bands[0].shape, dtype='float32')
+    invalid = np.zeros(bands[0].shape, dtype=bool)
+    for band, coeff, band_nodata in zip(bands, coeffs, nodata):
+        invalid |= ~(band > band_nodata)
+        np.multiply(band, np.float32(coeff), out=scaled, casting='same_kind')
+        result += scaled
+    result[invalid] = -9999
+    return result
+
+
+def wit_masks(data):
+    """The WIT `pmask` and `water` value of the WOfS `water`, `fmask` and `nbart_contiguity` bands"""
+    water = data.water.copy(data=blockwise(_water_value, data.water.data, dtype='int16'))
+    pmask = data.water.copy(data=blockwise(_pixel_mask, data.water.data, data.fmask.data,
+                                           data.nbart_contiguity.data, dtype='bool'))
+    return water, pmask
+
+
 class TWnMask(Transformation):
     def __init__(self, category='wetness', coeffs=None):
         self.category = category
@@ -95,30 +154,19 @@ class TWnMask(Transformation):
         self.var_name = f'TC{category[0].upper()}'
 
     def compute(self, data):
-        tci_var = 0
-        for key in self.coeffs[self.category].keys():
-            nodata = getattr(data[key], 'nodata', -1)
-            data[key] = data[key].where(data[key] > nodata)
-            tci_var += data[key] * self.coeffs[self.category][key]
-        tci_var.data[np.isnan(tci_var.data)] = -9999
-        tci_var = tci_var.astype(np.float32)
+        coeffs = self.coeffs[self.category]
+        bands = [data[key] for key in coeffs]
+        tci_var = bands[0].copy(data=blockwise(_tasselled_cap, *[band.data for band in bands], dtype='float32',
+                                               coeffs=list(coeffs.values()),
+                                               nodata=[getattr(band, 'nodata', -1) for band in bands]))
         tci_var.attrs = dict(nodata=-9999, units=1, crs=data.attrs['crs'])
         tci_var = tci_var.to_dataset(name=self.var_name)
 
-        def make_mask():
-            water_value = (((data.water & (1 << 7)) != 0)
-                           & (((data.water & (1 << 6)) | (data.water & (1 << 5)) | (data.water & (1 << 1))
-                               | (data.water & 1)) == 0)).astype('int16')
-            water_value.attrs = dict(nodata=0, units=1, crs=data.attrs['crs'])
-            water_value = water_value.to_dataset(name='water')
-
-            pmask = (((data.fmask != 2) & (data.fmask != 3) & (data.fmask != 0) & (data.nbart_contiguity == 1))
-                     & (((data.water & (1 << 7)) | (data.water & (1 << 6)) | (data.water & (1 << 5))
-                         | (data.water & (1 << 1)) | (data.water & 1)) == 0))
-            pmask.attrs = dict(nodata=False, units=1, crs=data.attrs['crs'])
-            pmask = pmask.to_dataset(name='pmask')
-            return pmask.merge(water_value)
-        pmask = tci_var.merge(make_mask())
+        water_value, pmask = wit_masks(data)
+        water_value.attrs = dict(nodata=0, units=1, crs=data.attrs['crs'])
+        pmask.attrs = dict(nodata=False, units=1, crs=data.attrs['crs'])
+
+        pmask = tci_var.merge(pmask.to_dataset(name='pmask').merge(water_value.to_dataset(name='water')))
         pmask.attrs = data.attrs
         return pmask
 
@@ -128,89 +176,144 @@ class TWnMask(Transformation):
                 'pmask': Measurement(name='pmask', dtype='bool', nodata=False, units='1')}
 
 
+class WITMask(Transformation):
+    """Pixels that may be valid WIT observations (clear or wet), without loading the spectral bands"""
+
+    def compute(self, data):
+        water_value, pmask = wit_masks(data)
+        valid = (pmask | (water_value > 0)).astype('uint8')
+        valid.attrs = dict(nodata=0, units=1, crs=data.attrs['crs'])
+        valid = valid.to_dataset(name='valid')
+        valid.attrs = data.attrs
+        return valid
+
+    def measurements(self, input_measurements):
+        return {'valid': Measurement(name='valid', dtype='uint8', nodata=0, units='1')}
+
+
 def mask_data(loaded):
-    def make_mask():
-        # water mask
-        # flags = {'cloud': False,
-        #    'cloud_shadow': False,
-        #    'noncontiguous': False,
-        #    'water_observed': False,
-        #    'nodata': False
-        #    }
-        # water value
-        # flags = {'cloud': False,
-        #    'cloud_shadow': False,
-        #    'noncontiguous': False,
-        #    'water_observed': True,
-        #    'nodata': False
-        #    }
-        water_value = (((loaded.water & (1 << 7)) != 0)
-                       & (((loaded.water & (1 << 6)) | (loaded.water & (1 << 5)) | (loaded.water & (1 << 1))
-                           | (loaded.water & 1)) == 0)).astype('int16').to_dataset(name='water')
-        pmask = (((loaded.fmask != 2) & (loaded.fmask != 3) & (loaded.fmask != 0) & (loaded.nbart_contiguity == 1))
-                 & (((loaded.water & (1 << 7)) | (loaded.water & (1 << 6)) | (loaded.water & (1 << 5))
-                     | (loaded.water & (1 << 1)) | (loaded.water & 1)) == 0)).to_dataset(name='pmask')
-        return pmask.merge(water_value)
-
-    pmask = make_mask()
+    water_value, pmask = wit_masks(loaded)
+    pmask = pmask.to_dataset(name='pmask').merge(water_value.to_dataset(name='water'))
     loaded = loaded.drop(['fmask', 'nbart_contiguity', 'water']).merge(pmask)
     loaded = ApplyMask('pmask', apply_to=['bs', 'pv', 'npv', 'TCW']).compute(loaded)
     return loaded
 
 
-def average_over_day(masked):
-    tmp = xr.Dataset()
+def window_sizes(times, days):
+    """
+    Numbers of consecutive time slices aggregated together: each window starts at
+    the first time slice that is `days` days or more after the start of the previous one.
+    """
+    starts = [0]
+    for index in range(1, len(times)):
+        if np.abs(times[index] - times[starts[-1]]).astype('timedelta64[D]') >= np.timedelta64(days, 'D'):
+            starts.append(index)
+    return np.diff(starts + [len(times)])
+
+
+def reduce_windows(func, arrays, sizes, dtype, **kwargs):
+    """
+    `func` over each window of `sizes` time slices of `arrays` (time first), which returns one time slice.
+    Lazy arrays are rechunked so that each chunk is a window, and reduced chunk by chunk.
+    """
+    sizes = tuple(int(size) for size in sizes)
+    if isinstance(arrays[0], dask.array.Array):
+        arrays = [dask.array.asarray(array).rechunk({0: sizes}) for array in arrays]
+        arrays = [array.rechunk(arrays[0].chunks) for array in arrays]
+        return dask.array.map_blocks(func, *arrays, **kwargs, dtype=dtype,
+                                     chunks=((1,) * len(sizes),) + arrays[0].chunks[1:])
+
+    offsets = np.cumsum(sizes)[:-1]
+    windows = zip(*[np.split(np.asarray(array), offsets) for array in arrays])
+    return np.concatenate([func(*window, **kwargs) for window in windows]).astype(dtype)
+
+
+def _window_starts(masked, sizes):
+    """`masked` at the first time slice of each window, to be filled in with the aggregated data"""
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype('int64')
+    return masked[dict(time=starts)].copy()
+
+
+def _average_window(block, nodata):
+    # mean of the window, or nodata if any of its time slices is not valid
+    valid = ~(np.abs(block - nodata) < 1e-5)
+    total = np.where(valid, block, np.nan).sum(axis=0, keepdims=True) / block.shape[0]
+    return np.where(np.isnan(total), nodata, total).astype('float32')
+
+
+def _sum_window(block):
+    return block.astype('int16').sum(axis=0, keepdims=True).astype('int16')
+
+
+def average_over_day(masked, sizes=None):
+    if sizes is None:
+        sizes = [masked.time.size]
+
+    tmp = _window_starts(masked, sizes)
     for var in masked.data_vars:
         if var != 'water':
-            valid_var = ~(np.abs(masked[var] - masked[var].attrs['nodata']) < 1e-5)
-            # to suppress the warnings from dask if using `mean`
-            # haven't got another way
-            tmp[var] = ((masked[var].where(valid_var).sum('time', skipna=False, keep_attrs=True) / masked.time.shape[0])
-                        .fillna(masked[var].attrs['nodata']).astype('float32'))
+            data = reduce_windows(_average_window, [masked[var].data], sizes, 'float32',
+                                  nodata=masked[var].attrs['nodata'])
         else:
-            tmp[var] = masked[var].astype('int16').sum('time', keep_attrs=True).astype('int16')
+            data = reduce_windows(_sum_window, [masked[var].data], sizes, 'int16')
+        tmp[var] = tmp[var].copy(data=data)
         tmp[var].attrs = masked[var].attrs
 
-    tmp = tmp.expand_dims(time=masked.time[0:1], axis=0)
     tmp.attrs = masked.attrs
     return tmp
 
 
-def aggregate_data(masked):
-    tmp = masked[dict(time=[0])].copy(deep=True)
-    for time in masked.time.data[1:]:
-        for var in masked.data_vars:
-            if var != 'water':
-                valid_var = ~(np.abs(tmp[var] - masked[var].attrs['nodata']) < 1e-5) | tmp.water > 0
-            else:
-                valid_var = ~(np.abs(tmp.TCW - masked.TCW.attrs['nodata']) < 1e-5) | tmp.water > 0
-            tmp[var] = tmp[var].where(valid_var, 0) + masked[var].sel(time=time).where(~valid_var, 0)
-            tmp[var].attrs = masked[var].attrs
+def _composite_end(tcw, water, tcw_nodata):
+    """
+    For each pixel of a window, the time slice after which its composite no longer changes,
+    and that of its `water` value. The composite of a pixel stops changing once it is wet,
+    and its `water` value is taken until its TCW is valid.
+    """
+    steps = np.arange(tcw.shape[0]).reshape((-1,) + (1,) * (tcw.ndim - 1))
+
+    valid_tcw = ~(np.abs(tcw - tcw_nodata) < 1e-5)
+    last_dry = np.where(valid_tcw.any(axis=0), np.maximum(valid_tcw.argmax(axis=0) - 1, 0), tcw.shape[0] - 1)
+
+    wet = (water > 0) & (steps <= last_dry)
+    frozen = wet.any(axis=0)
+    wet_at = wet.argmax(axis=0)
+    return np.where(frozen, wet_at, tcw.shape[0] - 1), np.where(frozen, wet_at, last_dry)
+
+
+def _composite_window(block, tcw, water, nodata=None, tcw_nodata=None):
+    # first valid observation of each pixel in the window, or the `water` value that goes with it
+    end, water_end = _composite_end(tcw, water, tcw_nodata)
+    if nodata is None:
+        return np.take_along_axis(block, water_end[np.newaxis], axis=0)
+
+    steps = np.arange(block.shape[0]).reshape((-1,) + (1,) * (block.ndim - 1))
+    valid = ~(np.abs(block - nodata) < 1e-5) & (steps <= end)
+    index = np.where(valid.any(axis=0), valid.argmax(axis=0), end)
+    return np.take_along_axis(block, index[np.newaxis], axis=0)
+
+
+def aggregate_data(masked, sizes=None):
+    """The composite of the first valid (or wet) observation of each pixel in each window of `sizes` time slices"""
+    if sizes is None:
+        sizes = [masked.time.size]
+
+    tmp = _window_starts(masked, sizes)
+    tcw_nodata = masked.TCW.attrs['nodata']
+    for var in masked.data_vars:
+        nodata = masked[var].attrs['nodata'] if var != 'water' else None
+        data = reduce_windows(_composite_window, [masked[var].data, masked.TCW.data, masked.water.data],
+                              sizes, masked[var].dtype, nodata=nodata, tcw_nodata=tcw_nodata)
+        tmp[var] = tmp[var].copy(data=data)
+        tmp[var].attrs = masked[var].attrs
     return tmp
 
 
 def aggregate_over_time(masked, days):
-    i_start = 0
-    i_end = i_start + 1
-    aggregated = None
-    print("aggregate over days", days)
-    while i_end < masked.time.size:
-        time = masked.time.data[i_start]
-        while np.abs(time - masked.time.data[i_end]).astype('timedelta64[D]') < np.timedelta64(days, 'D'):
-            i_end += 1
-            if i_end >= masked.time.size:
-                break
-        if days > 1:
-            tmp = aggregate_data(masked[dict(time=np.arange(i_start, i_end))])
-        else:
-            tmp = average_over_day(masked[dict(time=np.arange(i_start, i_end))])
-        if aggregated is None:
-            aggregated = tmp
-        else:
-            aggregated = xr.concat([aggregated, tmp], dim='time')
-        i_start = i_end
-        i_end = i_start + 1
-    print("finish aggregating", datetime.now())
+    sizes = window_sizes(masked.time.data, days)
+    if days > 1:
+        aggregated = aggregate_data(masked, sizes)
+    else:
+        aggregated = average_over_day(masked, sizes)
     return aggregated
 
 
@@ -1,12 +1,56 @@
-import altair
-import datacube
+import json
+
 import numpy as np
+from datacube.utils.masking import mask_to_dict
 from pywps import ComplexInput, ComplexOutput, LiteralOutput
 
 from . import FORMATS, PixelDrill, chart_dimensions, log_call
 
 
+RULES = [
+    {
+        'op': any,
+        'flags': ['terrain_or_low_angle', 'cloud_shadow', 'cloud', 'high_slope', 'noncontiguous'],
+        'value': 'not observable'
+    },
+    {
+        'op': all,
+        'flags': ['dry', 'sea'],
+        'value': 'not observable'
+    },
+    {
+        'op': any,
+        'flags': ['dry'],
+        'value': 'dry'
+    },
+    {
+        'op': any,
+        'flags': ['wet', 'sea'],
+        'value': 'wet'
+    }
+]
+
+
+def get_flags(flags_definition, rules, val):
+    flag_dict = mask_to_dict(flags_definition, val)
+    flags = list(filter(flag_dict.get, flag_dict))
+    # apply rules in sequence
+    ret_val = 'not observable'
+    for rule in rules:
+        if rule['op']([r in flags for r in rule['flags']]):
+            ret_val = rule['value']
+            break
+    return ret_val
+
+
+def compile_rules(flags_definition, rules):
+    """Lookup table from every uint8 value of the bitfield to the outcome of `rules`"""
+    return np.array([get_flags(flags_definition, rules, val) for val in range(256)])
+
+
 class WOfSDrill(PixelDrill):
+    _observation_tables = {}
+
     def input_formats(self):
         return [ComplexInput('geometry', 'Location (Lon, Lat)', supported_formats=[FORMATS['point']])]
 
@@ -19,54 +63,31 @@ class WOfSDrill(PixelDrill):
     def process_data(self, data, parameters):
         # TODO raise ProcessError('query returned no data') when appropriate
 
-        rules = [
-            {
-                'op': any,
-                'flags': ['terrain_or_low_angle', 'cloud_shadow', 'cloud', 'high_slope', 'noncontiguous'],
-                'value': 'not observable'
-            },
-            {
-                'op': all,
-                'flags': ['dry', 'sea'],
-                'value': 'not observable'
-            },
-            {
-                'op': any,
-                'flags': ['dry'],
-                'value': 'dry'
-            },
-            {
-                'op': any,
-                'flags': ['wet', 'sea'],
-                'value': 'wet'
-            }
-        ]
-
         # TODO: investigate why PixelDrill is changing datatype
         water = data.data_vars['water']
         data['observation'] = water.astype('int16')
         data = data.drop_vars(['water'])
 
-        def get_flags(val):
-            flag_dict = datacube.utils.masking.mask_to_dict(water.attrs['flags_definition'], val)
-            flags = list(filter(flag_dict.get, flag_dict))
-            # apply rules in sequence
-            ret_val = 'not observable'
-            for rule in rules:
-                if rule['op']([r in flags for r in rule['flags']]):
-                    ret_val = rule['value']
-                    break
-            return ret_val
-        gf = np.vectorize(get_flags)
-
-        data['observation'].values = gf(data['observation'].values)
+        table = self.observation_table(water.attrs['flags_definition'])
+        data['observation'].values = np.take(table, data['observation'].values)
 
         df = data.to_dataframe()
         df.reset_index(inplace=True)
         return df
 
+    @classmethod
+    def observation_table(cls, flags_definition):
+        # the rules are evaluated once per possible value of the uint8 bitfield
+        # and shared by all (per request) copies of the process
+        key = json.dumps(flags_definition, sort_keys=True)
+        if key not in cls._observation_tables:
+            cls._observation_tables[key] = compile_rules(flags_definition, RULES)
+        return cls._observation_tables[key]
+
     @log_call
     def render_chart(self, df):
+        import altair  # pylint: disable=import-outside-toplevel
+
         width, height = chart_dimensions(self.style)
 
         pt_lat = df['latitude'].iat[0]
@@ -0,0 +1,162 @@
+import contextvars
+import cProfile
+import importlib.util
+import io
+import json
+import os
+import pstats
+import tempfile
+import threading
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+
+import pywps.configuration as config
+
+from .s3 import S3_UPLOADER
+from .tracing import annotate
+
+# request header asking for a profile, with the token of the `[profiling]` section if one is set
+PROFILE_HEADER = "X-Datacube-WPS-Profile"
+
+# functions listed in the text summary of the CPU profile
+TOP_FUNCTIONS = 50
+
+_ACTIVE = contextvars.ContextVar("datacube_wps_profiling", default=False)
+_PROFILER_LOCK = threading.Lock()
+
+
+def profiling():
+    """Whether the current request is being profiled, in which case it skips the result cache"""
+    return _ACTIVE.get()
+
+
+def profile_requested(request, parameters):
+    """
+    The value of the `profile` parameter, or of the `PROFILE_HEADER` of the HTTP request
+    (which is not available to asynchronous requests), or `None`
+    """
+    if "profile" in parameters:
+        return parameters.pop("profile")
+    http_request = getattr(request, "http_request", None)
+    if http_request is None:
+        return None
+    return http_request.headers.get(PROFILE_HEADER)
+
+
+def profile_allowed(identifier, requested):
+    """Whether the `[profiling]` section of pywps.cfg allows profiling a request to the process `identifier`"""
+    if requested in (None, False, "", "false"):
+        return False
+    if config.get_config_value("profiling", "enabled", False) is not True:
+        return False
+
+    processes = [name.strip() for name in str(config.get_config_value("profiling", "processes")).split(",")]
+    if any(processes) and identifier not in processes:
+        return False
+
+    token = config.get_config_value("profiling", "token")
+    return not token or str(requested) == token
+
+
+def _performance_report(filename):
+    """The dask performance report of the cluster of this worker, if it has one and bokeh is installed"""
+    # pylint: disable=import-outside-toplevel
+    from dask.distributed import default_client, performance_report
+
+    if importlib.util.find_spec("bokeh") is None:
+        return None
+    try:
+        default_client()
+    except ValueError:
+        return None
+    return performance_report(filename=filename)
+
+
+class RequestProfiler:
+    """
+    Profiles a request: a CPU profile with `cProfile`, the peak of the memory allocated with `tracemalloc`,
+    and the dask performance report (with the task stream) of its computations. The artefacts are
+    uploaded next to the outputs of the request, under `profiles/<process>/<uuid>/` in the S3 bucket.
+
+    The CPU profile is of the thread of the request, so with gevent it also includes other greenlets
+    that ran while the request was waiting, and the memory peak is that of the whole worker.
+    """
+
+    def __init__(self, identifier, uuid):
+        self.identifier = identifier
+        self.uuid = uuid
+        self.artefacts = {}
+
+    @contextmanager
+    def profile(self):
+        token = _ACTIVE.set(True)
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        cpu = cProfile.Profile()
+
+        with tempfile.TemporaryDirectory(prefix="datacube-wps-profile-") as tmp:
+            try:
+                with ExitStack() as stack:
+                    report = _performance_report(os.path.join(tmp, "dask-report.html"))
+                    if report is not None:
+                        stack.enter_context(report)
+                    cpu.enable()
+                    try:
+                        yield self
+                    finally:
+                        cpu.disable()
+            finally:
+                _, peak = tracemalloc.get_traced_memory()
+                if started_tracemalloc:
+                    tracemalloc.stop()
+                _ACTIVE.reset(token)
+                self._store(cpu, peak, tmp)
+
+    def _store(self, cpu, peak, tmp):
+        cpu.dump_stats(os.path.join(tmp, "cpu.prof"))
+
+        summary = io.StringIO()
+        pstats.Stats(cpu, stream=summary).sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+        files = {
+            "cpu.prof": None,
+            "cpu.txt": summary.getvalue().encode(),
+            "memory.json": json.dumps({"tracemalloc_peak_bytes": peak}).encode(),
+        }
+        if os.path.exists(os.path.join(tmp, "dask-report.html")):
+            files["dask-report.html"] = None
+
+        for name, body in files.items():
+            if body is None:
+                with open(os.path.join(tmp, name), "rb") as f:
+                    body = f.read()
+            key = "/".join(["profiles", self.identifier, self.uuid, name])
+            try:
+                self.artefacts[name] = S3_UPLOADER.put(key, body)
+            except Exception as e:  # pylint: disable=broad-except
+                # a profile must not fail the request it profiled
+                print("could not store profile", key, e)
+
+        annotate(profile=self.artefacts, tracemalloc_peak_bytes=peak)
+        print("profile of", self.identifier, self.uuid, "stored at", self.artefacts)
+
+
+@contextmanager
+def request_profiling(identifier, uuid, requested):
+    """Profile the enclosed part of a request if `requested` and allowed by config, otherwise do nothing"""
+    if not profile_allowed(identifier, requested):
+        yield None
+        return
+
+    # there is one profiler per thread, and the greenlets of a worker share its thread
+    if not _PROFILER_LOCK.acquire(blocking=False):
+        print("not profiling", identifier, uuid, "while another request is profiled")
+        yield None
+        return
+
+    try:
+        with RequestProfiler(identifier, str(uuid)).profile() as profiler:
+            yield profiler
+    finally:
+        _PROFILER_LOCK.release()
@@ -0,0 +1,67 @@
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import altair
+
+
+def _render_processes():
+    # each of the 2 * vCPUs + 1 gunicorn workers has its own pool, so one process each already
+    # gives the pod more render processes than vCPUs
+    return int(os.getenv("DATACUBE_WPS_RENDER_PROCESSES", "1"))
+
+
+def save_chart(spec: dict, fmt: str) -> str:
+    """Serialise a Vega-Lite `spec` to `fmt` ("html" or "svg") with vl-convert"""
+    import altair  # pylint: disable=import-outside-toplevel
+
+    chart = altair.Chart.from_dict(spec, validate=False)
+    buffer = io.StringIO()
+    chart.save(buffer, format=fmt, engine="vl-convert")
+    return buffer.getvalue()
+
+
+class ChartRenderer:
+    """
+    Pool of processes for chart serialisation.
+
+    Rendering SVG is CPU bound, and done inline it would block the gevent loop and so every
+    other request on the gunicorn worker. Processes are spawned on first use, rather than
+    forked, so that they do not inherit the gevent hub of the worker.
+    """
+
+    def __init__(self, processes=None):
+        self.processes = processes or _render_processes()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def render(self, chart: "altair.Chart", fmt: str) -> str:
+        spec = chart.to_dict()
+        try:
+            return self._pool().submit(save_chart, spec, fmt).result()
+        except BrokenProcessPool:
+            # a render process died (e.g. OOM killed); start afresh next time and render here
+            self.reset()
+            return save_chart(spec, fmt)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.processes,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def reset(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+
+CHART_RENDERER = ChartRenderer()
+
+# the render processes belong to the parent
+os.register_at_fork(after_in_child=CHART_RENDERER.reset)
@@ -0,0 +1,140 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer
+
+import pywps.configuration as config
+
+from .metrics import S3_CONFIGURE_TIME
+
+# refresh temporary credentials this many seconds before they expire
+CREDENTIALS_REFRESH_MARGIN = 600
+
+
+def configure_s3_access(**kwargs):
+    # botocore is only imported once S3 is first used
+    from datacube.utils.aws import configure_s3_access as configure  # pylint: disable=import-outside-toplevel
+    return configure(**kwargs)
+
+
+class S3Access:
+    """
+    Configure S3 access for GDAL/rasterio once per dask cluster (or per process without one).
+
+    `configure_s3_access` resolves credentials and registers a worker callback on the cluster;
+    that callback is also run on workers that join later, so it only needs repeating for a new
+    client or when temporary (e.g. STS) credentials are about to expire.
+    """
+
+    def __init__(self, refresh_margin=CREDENTIALS_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self._configured = {}
+        self._lock = threading.Lock()
+
+    def configure(self, client=None):
+        key = id(client)
+        with self._lock:
+            entry = self._configured.get(key)
+            if entry is not None and entry[0] is client and not self._expiring(entry[1]):
+                return entry[1]
+
+            start = default_timer()
+            creds = configure_s3_access(
+                # aws_unsigned=True,
+                region_name=os.getenv("AWS_DEFAULT_REGION", "auto"),
+                client=client,
+            )
+            S3_CONFIGURE_TIME.observe(default_timer() - start)
+
+            self._configured[key] = (client, creds)
+            return creds
+
+    def reset(self):
+        with self._lock:
+            self._configured.clear()
+
+    def _expiring(self, creds):
+        if creds is None or not hasattr(creds, "refresh_needed"):
+            # unsigned access or static credentials
+            return False
+        return creds.refresh_needed(refresh_in=self.refresh_margin)
+
+
+def _upload_threads():
+    return int(os.getenv("DATACUBE_WPS_UPLOAD_THREADS", "4"))
+
+
+class S3Uploader:
+    """
+    Process wide S3 clients for writing outputs, and a thread pool to upload them concurrently.
+
+    boto3 clients are thread safe and keep a pool of HTTP connections, so one signed client
+    (for uploads) and one unsigned client (for generating public URLs) are shared by all requests.
+    """
+
+    def __init__(self, threads=None):
+        self.threads = threads or _upload_threads()
+        self._clients = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def clients(self):
+        with self._lock:
+            if self._clients is None:
+                # pylint: disable=import-outside-toplevel
+                import boto3
+                import botocore
+                from botocore.client import Config
+
+                session = boto3.Session()
+                signed = session.client("s3", config=Config(max_pool_connections=max(10, self.threads * 2)))
+                unsigned = session.client("s3", config=Config(signature_version=botocore.UNSIGNED))
+                self._clients = (signed, unsigned)
+            return self._clients
+
+    def submit(self, func, *args, **kwargs):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="s3-upload")
+        # in the context of the caller, so that the upload is part of its trace
+        return self._executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+    def upload_public(self, key, data, mimetype):
+        """Upload file-like `data` as a public object and return its URL"""
+        bucket = config.get_config_value("s3", "bucket")
+        signed, unsigned = self.clients()
+
+        signed.upload_fileobj(
+            data,
+            bucket,
+            key,
+            ExtraArgs={"ACL": "public-read", "ContentType": mimetype},
+        )
+
+        return unsigned.generate_presigned_url(
+            ClientMethod="get_object",
+            ExpiresIn=0,
+            Params={"Bucket": bucket, "Key": key},
+        )
+
+    def put(self, key, body):
+        """Upload `body` bytes and return the s3:// URL of the object"""
+        bucket = config.get_config_value("s3", "bucket")
+        signed, _ = self.clients()
+        signed.put_object(Body=body, Bucket=bucket, Key=key)
+        return f"s3://{bucket}/{key}"
+
+    def reset(self):
+        # neither connections nor threads survive a fork
+        self._clients = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+
+S3_ACCESS = S3Access()
+S3_UPLOADER = S3Uploader()
+
+# a forked child has its own dask client, GDAL environment and connections
+os.register_at_fork(after_in_child=S3_ACCESS.reset)
+os.register_at_fork(after_in_child=S3_UPLOADER.reset)
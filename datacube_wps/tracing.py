@@ -0,0 +1,186 @@
+import contextvars
+import json
+import os
+import random
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from timeit import default_timer
+
+import numpy as np
+import pandas
+import xarray
+
+# longest repr kept of a value that cannot be summarised otherwise
+MAX_REPR = 80
+
+_UNSAMPLED = object()
+_CURRENT = contextvars.ContextVar("datacube_wps_span", default=None)
+
+
+def _sample_rate():
+    return float(os.getenv("DATACUBE_WPS_TRACE_SAMPLE_RATE", "1.0"))
+
+
+def summarise(value):
+    """
+    A small, JSON serialisable description of `value`: shapes, dtypes and sizes of arrays and
+    tables rather than their contents, which may be hundreds of MB (and lazy, so never computed here)
+    """
+    # pylint: disable=too-many-return-statements
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return value if len(value) <= MAX_REPR else value[:MAX_REPR] + "..."
+    if isinstance(value, xarray.Dataset):
+        return {"type": "Dataset", "sizes": dict(value.sizes),
+                "dtypes": {str(name): str(band.dtype) for name, band in value.data_vars.items()},
+                "nbytes": value.nbytes}
+    if isinstance(value, xarray.DataArray):
+        return {"type": "DataArray", "sizes": dict(value.sizes), "dtype": str(value.dtype), "nbytes": value.nbytes}
+    if isinstance(value, pandas.DataFrame):
+        return {"type": "DataFrame", "shape": list(value.shape), "columns": [str(c) for c in value.columns[:20]],
+                "nbytes": int(value.memory_usage(deep=False).sum())}
+    if isinstance(value, np.ndarray):
+        return {"type": "ndarray", "shape": list(value.shape), "dtype": str(value.dtype), "nbytes": value.nbytes}
+    if isinstance(value, dict):
+        return {"type": "dict", "keys": [str(key) for key in list(value)[:20]]}
+    if isinstance(value, (list, tuple)):
+        return {"type": type(value).__name__, "length": len(value)}
+    return {"type": type(value).__name__}
+
+
+class Span:
+    """The timing and summarised attributes of one (traced) call, and those it made in turn"""
+
+    def __init__(self, name, attributes=None):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.children = []
+        self.start = default_timer()
+        self.duration = None
+
+    def finish(self):
+        self.duration = default_timer() - self.start
+
+    def to_dict(self):
+        return {"name": self.name,
+                "duration": None if self.duration is None else round(self.duration, 6),
+                "attributes": self.attributes,
+                "children": [child.to_dict() for child in self.children]}
+
+
+class PrintExporter:
+    """Prints each trace as a line of JSON"""
+
+    def export(self, span):
+        print(json.dumps({"trace": span.to_dict()}, default=str))
+
+
+class InMemoryExporter:
+    """Keeps the traces, e.g. for tests"""
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+
+class Tracer:
+    """
+    Records spans of traced calls within a request. Whether a trace is recorded is decided
+    once, at its outermost span, with probability `sample_rate`; the spans of a trace that
+    is not recorded cost a context variable lookup.
+    """
+
+    def __init__(self, sample_rate=None, exporters=None):
+        self.sample_rate = _sample_rate() if sample_rate is None else sample_rate
+        self.exporters = [PrintExporter()] if exporters is None else exporters
+
+    @contextmanager
+    def span(self, name, attributes=None, root=False):
+        """
+        A span within the current trace, or the start of a (possibly sampled out) trace if
+        `root` and there is none. Outside of a trace, and within one that is not sampled, does nothing.
+        """
+        parent = _CURRENT.get()
+        if parent is _UNSAMPLED or (parent is None and not root):
+            yield None
+            return
+
+        if parent is None and random.random() >= self.sample_rate:
+            token = _CURRENT.set(_UNSAMPLED)
+            try:
+                yield None
+            finally:
+                _CURRENT.reset(token)
+            return
+
+        current = Span(name, {key: summarise(value) for key, value in (attributes or {}).items()})
+        token = _CURRENT.set(current)
+        try:
+            yield current
+        except Exception as e:
+            current.attributes["error"] = summarise(repr(e))
+            raise
+        finally:
+            current.finish()
+            _CURRENT.reset(token)
+            if parent is None:
+                self._export(current)
+            else:
+                parent.children.append(current)
+
+    def _export(self, span):
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:  # pylint: disable=broad-except
+                print("could not export trace", span.name, e)
+
+
+TRACER = Tracer()
+
+
+def span(name, **attributes):
+    """A span of the current trace of `TRACER`"""
+    return TRACER.span(name, attributes)
+
+
+def annotate(**attributes):
+    """Add (summaries of) `attributes` to the current span, if it is recorded"""
+    current = _CURRENT.get()
+    if current is not None and current is not _UNSAMPLED:
+        current.attributes.update({key: summarise(value) for key, value in attributes.items()})
+
+
+def traced(func):
+    """
+    Record calls to `func` as spans, with summaries of its arguments and of its result.
+    A call outside of any trace starts one.
+    """
+    code = func.__code__
+
+    @wraps(func)
+    def trace_wrapper(*args, **kwargs):
+        if _CURRENT.get() is _UNSAMPLED:
+            return func(*args, **kwargs)
+
+        names = code.co_varnames[:code.co_argcount]
+        arguments = {(names[index] if index < len(names) else f"arg{index}"): arg
+                     for index, arg in enumerate(args) if not (index == 0 and names[:1] == ("self",))}
+
+        with TRACER.span(func.__qualname__, {**arguments, **kwargs}, root=True) as current:
+            result = func(*args, **kwargs)
+            if current is not None:
+                current.attributes["result"] = summarise(result)
+            return result
+
+    return trace_wrapper
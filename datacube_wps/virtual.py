@@ -0,0 +1,127 @@
+from itertools import chain
+
+import pandas
+from datacube.api.query import Query
+from datacube.utils.dates import tz_aware
+from datacube.virtual import construct
+from datacube.virtual.impl import (Aggregate, Collate, Juxtapose, Product, Reproject, Transform, VirtualDatasetBag,
+                                   VirtualProduct, from_validated_recipe)
+from datacube.virtual.utils import merge_search_terms, reject_keys
+
+
+def _to_datetime(value):
+    if value is None:
+        return None
+    return tz_aware(pandas.Timestamp(value).to_pydatetime())
+
+
+def intersect_time_windows(windows, time):
+    """
+    The parts of the `(start, end)` windows within the `(start, end)` time range of a request,
+    where `None` leaves a window open ended and a `time` of `None` is all of time.
+    """
+    start, end = (None, None) if time is None else (_to_datetime(time[0]), _to_datetime(time[-1]))
+
+    result = []
+    for window_start, window_end in windows:
+        window_start, window_end = _to_datetime(window_start), _to_datetime(window_end)
+        lower = max((t for t in (window_start, start) if t is not None), default=None)
+        upper = min((t for t in (window_end, end) if t is not None), default=None)
+        if lower is None or upper is None or lower <= upper:
+            result.append((lower, upper))
+    return result
+
+
+class TimeWindowedProduct(Product):
+    """
+    A product with data only within the `time_windows` of its recipe, such as the operational
+    periods of a sensor. The windows are intersected with the time range of each query,
+    so that the index only returns datasets from within them.
+    """
+
+    _NON_QUERY_KEYS = Product._NON_QUERY_KEYS | {'time_windows'}
+
+    def query(self, dc, **search_terms):
+        windows = intersect_time_windows(self['time_windows'], search_terms.get('time'))
+        bags = [super(TimeWindowedProduct, self).query(dc, **{**search_terms, 'time': window})
+                for window in windows]
+
+        if not bags:
+            return self._empty_bag(dc, search_terms)
+
+        # windows are allowed to overlap
+        datasets = {dataset.id: dataset for dataset in chain.from_iterable(bag.bag for bag in bags)}
+        return VirtualDatasetBag(list(datasets.values()), bags[0].geopolygon, bags[0].product_definitions)
+
+    def _empty_bag(self, dc, search_terms):
+        product = dc.index.products.get_by_name(self._product)
+        merged_terms = merge_search_terms(reject_keys(self, self._NON_QUERY_KEYS),
+                                          reject_keys(search_terms, self._NON_QUERY_KEYS))
+        query = Query(dc.index, **reject_keys(merged_terms, self._ADDITIONAL_SEARCH_KEYS | {'time'}))
+        return VirtualDatasetBag([], query.geopolygon, {product.name: product})
+
+
+def _as_product(recipe):
+    return recipe if isinstance(recipe, VirtualProduct) else from_validated_recipe(recipe)
+
+
+class _KeepsChildren:
+    """
+    A virtual product that uses the (e.g. time windowed) virtual products in its settings as they are,
+    where datacube would reconstruct plain ones from their recipes
+    """
+
+    @property
+    def _children(self):
+        return [_as_product(child) for child in self['collate' if 'collate' in self else 'juxtapose']]
+
+    @property
+    def _input(self):
+        return _as_product(self['input'])
+
+
+class _Collate(_KeepsChildren, Collate):
+    pass
+
+
+class _Juxtapose(_KeepsChildren, Juxtapose):
+    pass
+
+
+class _Transform(_KeepsChildren, Transform):
+    pass
+
+
+class _Aggregate(_KeepsChildren, Aggregate):
+    pass
+
+
+class _Reproject(_KeepsChildren, Reproject):
+    pass
+
+
+_KEEPING_CHILDREN = {Collate: _Collate, Juxtapose: _Juxtapose, Transform: _Transform,
+                     Aggregate: _Aggregate, Reproject: _Reproject}
+
+
+def with_time_windows(product):
+    """`product` with its leaf products that have `time_windows` replaced by `TimeWindowedProduct`s"""
+    settings = product._settings  # pylint: disable=protected-access
+
+    if isinstance(product, Product):
+        if 'time_windows' in settings:
+            return TimeWindowedProduct(settings)
+        return product
+
+    rewritten = dict(settings)
+    for key in ('collate', 'juxtapose'):
+        if key in settings:
+            rewritten[key] = [with_time_windows(child) for child in settings[key]]
+    if 'input' in settings:
+        rewritten['input'] = with_time_windows(settings['input'])
+    return _KEEPING_CHILDREN.get(type(product), type(product))(rewritten)
+
+
+def construct_product(recipe):
+    """The virtual product of a recipe of the process catalog"""
+    return with_time_windows(construct(**recipe))
@@ -1,31 +1,43 @@
-import os
 import gevent.monkey
 gevent.monkey.patch_all()
 
+import os
+
 from prometheus_flask_exporter.multiprocess import \
     GunicornInternalPrometheusMetrics
 
+from datacube_wps.cluster import connect_dask, start_shared_cluster
+from datacube_wps.impl import warm_up
+from datacube_wps.pool import datacube_pool
 from datacube_wps.startup_utils import get_pod_vcpus
-from dask.distributed import LocalCluster, Client
 
 # Settings, https://docs.gunicorn.org/en/stable/settings.html
 # Check what the server sees: gunicorn --print-config datacube_wps:app
 timeout = 600   # 10 mins
 worker_class = 'gevent'
 workers = get_pod_vcpus() * 2 + 1
-reload = True
+# build the app (and its process catalog) once in the master, for the workers to inherit;
+# code changes are then only picked up on restart, so reloading goes with it
+preload_app = os.getenv("DATACUBE_WPS_PRELOAD_APP", "true").lower() in ("true", "yes", "1")
+reload = not preload_app
 
-def _num_dask_workers():
-    """Number of dask workers"""
-    return int(os.getenv("DATACUBE_WPS_NUM_WORKERS", "4"))
+def when_ready(server):
+    # in shared mode without a sidecar scheduler, the master starts one for all workers
+    server.dask_cluster = start_shared_cluster()
 
-def _create_dask_cluster():
-    cluster = LocalCluster(n_workers=_num_dask_workers(), scheduler_port=0, threads_per_worker=1)
-    return cluster
+def on_exit(server):
+    if getattr(server, 'dask_cluster', None) is not None:
+        server.dask_cluster.close()
 
 def post_fork(server, worker):
-    worker.dask_cluster = _create_dask_cluster()
-    worker.dask_client = Client(worker.dask_cluster)    
+    worker.dask_cluster, worker.dask_client = connect_dask()
+
+def post_worker_init(worker):
+    if os.getenv("DATACUBE_WPS_WARM_UP", "true").lower() in ("true", "yes", "1"):
+        warm_up()
+
+def worker_exit(server, worker):
+    datacube_pool().close()
 
 def child_exit(server, worker):
     GunicornInternalPrometheusMetrics.mark_process_dead_on_child_exit(worker.pid)
@@ -43,7 +43,7 @@ config = {
     'install_requires': INSTALL_REQUIRES,
     'setup_requires': ['setuptools_scm'],
     'use_scm_version': {"local_scheme": lambda version: ""},
-    'packages': find_packages(),
+    'packages': find_packages(exclude=['benchmarks', 'benchmarks.*']),
     'name': 'datacube-wps'
 }
 
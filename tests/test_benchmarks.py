@@ -0,0 +1,39 @@
+import json
+
+from benchmarks import run
+
+
+def report(p50s):
+    return {"commit": None, "cases": [{"process": "WIT", "geometry": geometry, "time_range": "1 year",
+                                       "latency_seconds": {"p50": p50},
+                                       "throughput": {"requests_per_second": 1 / p50}, "peak_rss_mb": 100.0}
+                                      for geometry, p50 in p50s.items()]}
+
+
+def test_every_process_runs_on_the_local_datacube(tmp_path):
+    args = run.parse_args(["--data-dir", str(tmp_path), "--scene-size", "128", "--polygon-size", "small",
+                           "--time-range", "3 months", "--repeats", "1", "--warmup", "0", "--dask-threads", "2"])
+    result = run.run(args)
+
+    assert [case["process"] for case in result["cases"]] == run.PROCESSES
+    for case in result["cases"]:
+        latency = case["latency_seconds"]
+        assert 0 < latency["min"] <= latency["p50"] <= latency["p99"] <= latency["max"]
+        assert case["throughput"]["requests_per_second"] > 0
+        assert case["peak_rss_mb"] > 0
+        assert case["rows"] > 0
+
+    polygon_drills = [case for case in result["cases"] if case["geometry"] != "point"]
+    assert all(case["input_mb_per_request"] > 0 for case in polygon_drills)
+    json.dumps(result)
+
+
+def test_compare_reports_regressions():
+    before = report({"small": 1.0, "large": 10.0})
+
+    changes, regressed = run.compare(before, report({"small": 1.05, "large": 9.0}))
+    assert not regressed
+    assert [round(change["p50"], 2) for change in changes] == [0.05, -0.1]
+
+    _, regressed = run.compare(before, report({"small": 1.2, "large": 10.0}))
+    assert regressed
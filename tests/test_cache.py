@@ -0,0 +1,114 @@
+import os
+
+import pandas
+from datacube.utils.geometry import CRS, Geometry
+
+from datacube_wps.cache import QueryCache, ResultCache, cache_key
+
+ABOUT = {"identifier": "FractionalCoverDrill", "version": "0.3"}
+
+POLY = Geometry(
+    {
+        "type": "Polygon",
+        "coordinates": [
+            [
+                [153.1, -27.4],
+                [153.3, -27.4],
+                [153.3, -27.2],
+                [153.1, -27.2],
+                [153.1, -27.4],
+            ]
+        ],
+    },
+    crs=CRS("EPSG:4326"),
+)
+
+
+def make_df(rows=10):
+    return pandas.DataFrame({"time": pandas.date_range("2019-01-01", periods=rows),
+                             "bs": range(rows)})
+
+
+def test_cache_key():
+    key = cache_key(ABOUT, ("2019-01-05", "2019-03-10"), POLY, {"aggregate": 1})
+    assert key == cache_key(ABOUT, ("2019-01-05", "2019-03-10"), POLY.to_crs("EPSG:3577"), {"aggregate": 1})
+    assert key != cache_key(ABOUT, ("2019-01-05", "2019-03-11"), POLY, {"aggregate": 1})
+    assert key != cache_key(ABOUT, ("2019-01-05", "2019-03-10"), POLY, {"aggregate": 2})
+    assert key != cache_key({**ABOUT, "version": "0.4"}, ("2019-01-05", "2019-03-10"), POLY, {"aggregate": 1})
+
+
+def test_memory_tier():
+    cache = ResultCache()
+    assert cache.get("a") is None
+
+    cache.put("a", make_df())
+    df = cache.get("a")
+    df.set_index("time", inplace=True)
+
+    assert "time" in cache.get("a").columns
+    assert cache.stats()["memory_hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_memory_budget():
+    nbytes = int(make_df().memory_usage(deep=True, index=True).sum())
+    cache = ResultCache(memory_bytes=2 * nbytes)
+
+    for key in "abc":
+        cache.put(key, make_df())
+
+    assert cache.get("a") is None
+    assert cache.get("c") is not None
+    assert cache.stats()["memory_bytes"] <= 2 * nbytes
+
+
+def test_disk_tier(tmpdir):
+    path = str(tmpdir.join("cache"))
+    ResultCache(path=path).put("a", make_df())
+
+    cache = ResultCache(path=path)
+    assert cache.get("a").equals(make_df())
+    assert cache.stats()["disk_hits"] == 1
+
+    cache.put_outputs("a", {"timeseries": {"data": "{}"}})
+    assert ResultCache(path=path).get_outputs("a") == {"timeseries": {"data": "{}"}}
+
+
+def test_disk_ttl(tmpdir):
+    path = str(tmpdir.join("cache"))
+    ResultCache(path=path).put("a", make_df())
+
+    assert ResultCache(path=path, ttl=-1).get("a") is None
+    assert not os.listdir(path)
+
+
+class CountingProduct:
+    def __init__(self):
+        self.queries = 0
+
+    def __repr__(self):
+        return "product: ga_ls_fc_3"
+
+    def query(self, dc, **search_terms):
+        self.queries += 1
+        return object()
+
+
+def test_query_cache():
+    product = CountingProduct()
+    cache = QueryCache()
+
+    bag = cache.query(product, None, time=("2019", "2020"), geopolygon=POLY)
+    assert cache.query(product, None, time=("2019", "2020"), geopolygon=POLY) is bag
+    assert cache.query(product, None, time=("2019", "2021"), geopolygon=POLY) is not bag
+    assert product.queries == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_query_cache_ttl():
+    product = CountingProduct()
+    cache = QueryCache(ttl=-1)
+
+    cache.query(product, None, geopolygon=POLY)
+    cache.query(product, None, geopolygon=POLY)
+    assert product.queries == 2
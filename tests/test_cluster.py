@@ -0,0 +1,87 @@
+import pytest
+from dask.distributed import Client, LocalCluster
+
+from datacube_wps import cluster
+
+
+def test_dask_mode(monkeypatch):
+    assert cluster.dask_mode() == "worker"
+
+    monkeypatch.setenv("DATACUBE_WPS_DASK_MODE", "shared")
+    assert cluster.dask_mode() == "shared"
+
+    monkeypatch.setenv("DATACUBE_WPS_DASK_MODE", "everywhere")
+    with pytest.raises(ValueError):
+        cluster.dask_mode()
+
+
+def test_scheduler_address(monkeypatch):
+    monkeypatch.setenv("DATACUBE_WPS_DASK_SCHEDULER_PORT", "8790")
+    assert cluster.scheduler_address() == "tcp://127.0.0.1:8790"
+
+    monkeypatch.setenv("DATACUBE_WPS_DASK_SCHEDULER", "tcp://dask-scheduler:8786")
+    assert cluster.scheduler_address() == "tcp://dask-scheduler:8786"
+    assert cluster.start_shared_cluster() is None
+
+
+def test_request_priority():
+    assert cluster.request_priority({"priority": 1}) > cluster.request_priority({})
+    assert cluster.request_priority({}) >= cluster.request_priority({})
+
+
+def test_connect_falls_back_to_local_cluster(monkeypatch):
+    monkeypatch.setenv("DATACUBE_WPS_DASK_MODE", "shared")
+    monkeypatch.setenv("DATACUBE_WPS_DASK_SCHEDULER", "tcp://127.0.0.1:1")
+    monkeypatch.setenv("DATACUBE_WPS_DASK_CONNECT_TIMEOUT", "1")
+    monkeypatch.setattr(cluster, "create_local_cluster",
+                        lambda: LocalCluster(n_workers=1, processes=False, dashboard_address=None))
+
+    local, client = cluster.connect_dask()
+    try:
+        assert local is not None
+        assert client.scheduler.address == local.scheduler_address
+    finally:
+        client.close()
+        local.close()
+
+
+def test_adaptive_limits(monkeypatch):
+    monkeypatch.setenv("DATACUBE_WPS_NUM_WORKERS", "3")
+    assert cluster.adaptive_limits() == (1, 3)
+
+    monkeypatch.setenv("DATACUBE_WPS_DASK_MIN_WORKERS", "0")
+    monkeypatch.setenv("DATACUBE_WPS_DASK_MAX_WORKERS", "8")
+    assert cluster.adaptive_limits() == (0, 8)
+
+    monkeypatch.setenv("DATACUBE_WPS_DASK_MIN_WORKERS", "9")
+    with pytest.raises(ValueError):
+        cluster.adaptive_limits()
+
+
+def test_worker_memory_limit(monkeypatch):
+    monkeypatch.setattr(cluster, "get_pod_memory", lambda: "16G")
+    monkeypatch.setattr(cluster, "get_pod_vcpus", lambda: 4)
+    assert cluster.worker_memory_limit() == 4 * 10**9
+
+    monkeypatch.setenv("DATACUBE_WPS_DASK_WORKER_MEMORY", "2GiB")
+    assert cluster.worker_memory_limit() == 2 * 2**30
+
+
+def test_adaptive_cluster_scales_up(monkeypatch):
+    monkeypatch.setenv("DATACUBE_WPS_DASK_ADAPTIVE", "true")
+    monkeypatch.setenv("DATACUBE_WPS_DASK_MIN_WORKERS", "0")
+    monkeypatch.setenv("DATACUBE_WPS_DASK_MAX_WORKERS", "2")
+    events = cluster.DASK_SCALE_EVENTS.labels(direction="up")
+    before = events._value.get()  # pylint: disable=protected-access
+
+    local = cluster.create_local_cluster(processes=False, dashboard_address=None)
+    client = Client(local)
+    try:
+        assert len(local.worker_spec) == 0
+        # needs a worker to run at all
+        assert client.submit(sum, [1, 2]).result(timeout=30) == 3
+        assert 1 <= len(local.worker_spec) <= 2
+        assert events._value.get() > before  # pylint: disable=protected-access
+    finally:
+        client.close()
+        local.close()
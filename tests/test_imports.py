@@ -0,0 +1,44 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# seconds a gunicorn worker may spend importing `datacube_wps` before it can serve `/ping`
+IMPORT_BUDGET = float(os.getenv("DATACUBE_WPS_IMPORT_BUDGET", "10"))
+
+
+def _run(*args):
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, check=True,
+                          cwd=os.path.dirname(os.path.dirname(__file__)))
+
+
+def _imported(statement, modules):
+    """Whether each of `modules` has been imported after running `statement`"""
+    result = _run("-c", f"import json, sys\n{statement}\n"
+                        f"print(json.dumps([module in sys.modules for module in {modules}]))")
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def _import_times(statement):
+    """Cumulative import time in seconds of each module imported by `statement`, from `python -X importtime`"""
+    result = _run("-X", "importtime", "-c", statement)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        times[module.strip()] = int(cumulative) / 1e6
+    return times
+
+
+@pytest.mark.parametrize("module", ["datacube_wps", "datacube_wps.cluster"])
+def test_import_does_not_create_app(module):
+    assert _imported(f"import {module}", ["datacube_wps.processes", "altair"]) == [False, False]
+    assert _import_times(f"import {module}")[module] < IMPORT_BUDGET
+
+
+def test_create_app_defers_charts_and_parquet():
+    modules = ["datacube_wps.processes.witprocess", "altair", "pyarrow.parquet"]
+    assert _imported("from datacube_wps import app", modules) == [True, False, False]
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas
+import xarray
+
+from datacube_wps.processes.kernels import (FC_COUNTS, combined_mask_value, fc_dominance_counts,
+                                            fc_percentages)
+
+WATER_FLAGS = {
+    "nodata": {"bits": 0, "values": {"0": False, "1": True}},
+    "cloud": {"bits": 6, "values": {"0": False, "1": True}},
+    "dry": {"bits": [7, 6, 0], "values": {"0": True}},
+}
+
+
+def make_fc():
+    bs = [[[50, 10], [-1, 20]], [[5, 5], [5, 5]]]
+    pv = [[[10, 60], [-1, 20]], [[1, 9], [1, 1]]]
+    npv = [[[0, 10], [-1, 70]], [[9, 1], [1, 1]]]
+    water = [[[0, 0], [1, 0]], [[0, 64], [0, 128]]]
+    dims = ("time", "y", "x")
+    return xarray.Dataset({
+        "bs": (dims, np.array(bs, dtype="int16")),
+        "pv": (dims, np.array(pv, dtype="int16")),
+        "npv": (dims, np.array(npv, dtype="int16")),
+        "water": (dims, np.array(water, dtype="uint8"), {"flags_definition": WATER_FLAGS}),
+    }, coords={"time": pandas.date_range("2020-01-01", periods=2)})
+
+
+def test_combined_mask_value():
+    assert combined_mask_value(WATER_FLAGS, [dict(dry=True), dict(cloud=False)]) == (0b11000001, 0)
+    assert combined_mask_value(WATER_FLAGS, [dict(dry=True), dict(cloud=True)]) is None
+
+
+def test_fc_dominance_counts():
+    data = make_fc()
+    counts = fc_dominance_counts(data.drop_vars("water"), data.water, [dict(dry=True), dict(cloud=False)])
+    counts = dict(zip(FC_COUNTS, counts.T))
+
+    assert list(counts["valid_bs"]) == [3, 4]
+    assert list(counts["unobservable"]) == [0, 2]
+    assert list(counts["bs"]) == [1, 1]
+    assert list(counts["pv"]) == [1, 0]
+    assert list(counts["npv"]) == [1, 1]
+
+
+def test_fc_dominance_counts_dask():
+    data = make_fc().chunk({"time": 1, "x": 1})
+    counts = fc_dominance_counts(data.drop_vars("water"), data.water, [dict(dry=True)])
+    expected = fc_dominance_counts(data.drop_vars("water").compute(), data.water.compute(), [dict(dry=True)])
+    assert (counts.compute() == expected).all()
+
+
+def test_fc_percentages():
+    df = fc_percentages(pandas.date_range("2020-01-01", periods=1), [[4, 4, 2, 1, 2, 1, 1]])
+    assert list(df.columns) == ["time", "bs", "pv", "npv", "Unobservable"]
+    assert list(df.iloc[0, 1:]) == [50.0, 25.0, 50.0, 25.0]
@@ -0,0 +1,117 @@
+import uuid
+from types import SimpleNamespace
+
+import numpy as np
+from datacube.index.abstract import default_metadata_type_docs
+from datacube.model import Measurement, metadata_from_doc
+from datacube.testutils import mk_sample_dataset
+from datacube.testutils.io import write_gtiff
+from datacube.utils.geometry import CRS, point
+
+from datacube_wps.processes import wofls_fuser
+from datacube_wps.processes.pointread import fuse_pixels, read_pixel, read_point
+
+CRS_3577 = CRS("EPSG:3577")
+# upper left corner of the test rasters, in Queensland, so that a UTC day is also the solar day
+ORIGIN = (2040000.0, -3130000.0)
+
+EO = metadata_from_doc(next(doc for doc in default_metadata_type_docs() if doc["name"] == "eo"))
+
+
+def write_dataset(tmp_path, values, timestamp, nodata=-999):
+    """A single band ("band") dataset of `values`, 4 x 4 pixels of 30 m, written as a GeoTIFF"""
+    path = tmp_path / (timestamp.replace(":", "") + ".tif")
+    meta = write_gtiff(path, np.asarray(values, dtype="int16"), crs=CRS_3577, resolution=(30, -30),
+                       offset=ORIGIN, nodata=nodata)
+    dataset = mk_sample_dataset([{"name": "band", "path": path.name, "layer": 1, "nodata": nodata, "dtype": "int16"}],
+                                uri=(tmp_path / "metadata.yaml").as_uri(), timestamp=timestamp,
+                                id=str(uuid.uuid4()), geobox=meta.gbox, product_opts={"metadata_type": EO})
+    # the time and corners of an eo dataset, which solar day grouping goes by
+    bounds = dataset.extent.to_crs("EPSG:4326").boundingbox
+    dataset.metadata_doc["extent"] = {"center_dt": timestamp, "from_dt": timestamp, "to_dt": timestamp, "coord": {
+        "ul": {"lon": bounds.left, "lat": bounds.top}, "ur": {"lon": bounds.right, "lat": bounds.top},
+        "ll": {"lon": bounds.left, "lat": bounds.bottom}, "lr": {"lon": bounds.right, "lat": bounds.bottom},
+    }}
+    return dataset
+
+
+def pixel_point(row, col):
+    """The centre of pixel (`row`, `col`) of the test rasters, in EPSG:4326 like a request"""
+    return point(ORIGIN[0] + 30 * col + 15, ORIGIN[1] - 30 * row - 15, CRS_3577).to_crs("EPSG:4326")
+
+
+def raster(value=0):
+    """Test raster values, with pixel (1, 1) set to `value`"""
+    result = np.zeros((4, 4), dtype="int16")
+    result[1, 1] = value
+    return result
+
+
+def test_fuse_pixels_default():
+    pixels = [None, np.array([[-1]], dtype='int16'), np.array([[7]], dtype='int16'), np.array([[9]], dtype='int16')]
+    fused = fuse_pixels(pixels, -1, 'int16')
+    assert fused.shape == (1, 1)
+    assert fused[0, 0] == 7
+
+
+def test_fuse_pixels_wofls():
+    # bit 0 set means nodata, so the second (valid) observation wins
+    pixels = [np.array([[1]], dtype='uint8'), np.array([[128]], dtype='uint8')]
+    fused = fuse_pixels(pixels, 1, 'uint8', fuse_func=wofls_fuser)
+    assert fused[0, 0] == 128
+
+
+def test_fuse_pixels_empty_group():
+    fused = fuse_pixels([None], 1, 'uint8', fuse_func=wofls_fuser)
+    assert fused[0, 0] == 1
+
+
+def test_read_pixel(tmp_path):
+    dataset = write_dataset(tmp_path, np.arange(16).reshape(4, 4), "2020-01-01T01:00:00")
+    pixel = read_pixel(dataset, "band", pixel_point(2, 1), -999, "int16")
+    assert pixel.shape == (1, 1)
+    assert pixel[0, 0] == 9
+
+
+def test_read_pixel_outside_bounds(tmp_path):
+    dataset = write_dataset(tmp_path, np.arange(16).reshape(4, 4), "2020-01-01T01:00:00")
+    assert read_pixel(dataset, "band", pixel_point(-1, 1), -999, "int16") is None
+    assert read_pixel(dataset, "band", pixel_point(1, 4), -999, "int16") is None
+
+
+def test_read_pixel_remaps_nodata(tmp_path):
+    dataset = write_dataset(tmp_path, raster(-999), "2020-01-01T01:00:00")
+    pixel = read_pixel(dataset, "band", pixel_point(1, 1), -1, "int16")
+    assert pixel[0, 0] == -1
+
+    # valid pixels are left alone
+    assert read_pixel(dataset, "band", pixel_point(0, 0), -1, "int16")[0, 0] == 0
+
+
+def test_read_point_groups_solar_days(tmp_path):
+    datasets = [
+        write_dataset(tmp_path, raster(-999), "2020-01-01T01:00:00"),
+        write_dataset(tmp_path, raster(5), "2020-01-01T01:00:30"),
+        write_dataset(tmp_path, raster(7), "2020-01-17T01:00:00"),
+    ]
+    product = {"product": "sample", "group_by": "solar_day"}
+    bag = SimpleNamespace(bag=datasets, product_definitions={"sample": datasets[0].type})
+    measurements = {"band": Measurement(name="band", dtype="int16", nodata=-1, units="1")}
+
+    data, times = read_point(product, bag, pixel_point(1, 1), measurements)
+
+    # the nodata of the first dataset of the day is filled from the second
+    assert len(times) == 2
+    assert data["band"].shape == (2, 1, 1)
+    assert data["band"][:, 0, 0].tolist() == [5, 7]
+
+
+def test_read_point_outside_every_dataset(tmp_path):
+    datasets = [write_dataset(tmp_path, raster(), "2020-01-01T01:00:00")]
+    product = {"product": "sample"}
+    bag = SimpleNamespace(bag=datasets, product_definitions={"sample": datasets[0].type})
+    measurements = {"band": Measurement(name="band", dtype="int16", nodata=-1, units="1")}
+
+    data, times = read_point(product, bag, pixel_point(10, 10), measurements)
+    assert len(times) == 1
+    assert data["band"][:, 0, 0].tolist() == [-1]
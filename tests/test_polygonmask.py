@@ -0,0 +1,94 @@
+import dask.array
+import numpy as np
+import pandas
+import xarray
+from datacube.utils.geometry import CRS, GeoBox, Geometry
+from affine import Affine
+
+from datacube_wps.processes.polygonmask import ChunkMasks, geometry_mask, mask_to_polygon
+
+GEOBOX = GeoBox(8, 8, Affine(10.0, 0, 0, 0, -10.0, 80.0), CRS("EPSG:3577"))
+
+# covers the top left 4x4 pixels except for a triangle in the top left chunk
+POLYGON = Geometry({"type": "Polygon",
+                    "coordinates": [[(5, 80), (40, 80), (40, 40), (0, 40), (0, 75), (5, 80)]]},
+                   crs=CRS("EPSG:3577"))
+
+
+def make_data(chunks, loaded=None):
+    values = np.arange(2 * 8 * 8, dtype="int16").reshape(2, 8, 8) + 1
+
+    def load(block, block_info=None):
+        if loaded is not None:
+            loaded.append(tuple(block_info[0]["chunk-location"]))
+        return block
+
+    band = dask.array.from_array(values, chunks=chunks).map_blocks(load, dtype=values.dtype)
+    data = xarray.Dataset({
+        "band": (("time", "y", "x"), band, {"nodata": -999}),
+        "other": (("time", "y", "x"), dask.array.from_array(values.astype("float32"), chunks=chunks)),
+    }, coords={"time": pandas.date_range("2020-01-01", periods=2), **GEOBOX.xr_coords(with_crs=True)})
+    return data, values
+
+
+def test_chunk_coverage():
+    masks = ChunkMasks(POLYGON, GEOBOX, ((2, 2, 4), (2, 2, 4)))
+    assert masks.coverage(0, 0) == "partial"
+    assert masks.coverage(1, 1) == "inside"
+    assert masks.coverage(2, 2) == "outside"
+    assert masks.coverage(0, 2) == "outside"
+
+
+def test_mask_to_polygon_matches_full_mask():
+    data, values = make_data((1, 2, 2))
+    expected = geometry_mask(POLYGON, GEOBOX, invert=True)
+
+    masked = mask_to_polygon(data, POLYGON)
+    assert isinstance(masked.band.data, dask.array.Array)
+
+    band = masked.band.values
+    assert band.dtype == np.int16
+    np.testing.assert_array_equal(band, np.where(expected, values, -999))
+
+    other = masked.other.values
+    np.testing.assert_array_equal(np.isnan(other), np.broadcast_to(~expected, other.shape))
+
+
+def test_mask_to_polygon_skips_outside_chunks():
+    loaded = []
+    data, values = make_data((1, 4, 4), loaded)
+    masked = mask_to_polygon(data, POLYGON)
+
+    band = masked.band.values
+    assert band[:, 4:, :].max() == -999
+    assert band[:, :, 4:].max() == -999
+    np.testing.assert_array_equal(band[:, :4, :4], values[:, :4, :4])
+
+    # only the top left chunk of each time slice is read
+    assert sorted(loaded) == [(0, 0, 0), (1, 0, 0)]
+
+
+def test_mask_to_polygon_graph_size_independent_of_blocks():
+    def layers(chunks):
+        data, _ = make_data(chunks)
+        masked = mask_to_polygon(data, POLYGON)
+        return len(masked.band.data.dask.layers)
+
+    assert layers((1, 1, 1)) == layers((2, 4, 4))
+
+
+def test_full_mask():
+    mask = ChunkMasks(POLYGON, GEOBOX, ((2, 2, 4), (2, 2, 4))).full_mask()
+    single = ChunkMasks(POLYGON, GEOBOX, ((8,), (8,))).full_mask()
+    # one task per spatial chunk, shared by every time slice of the data
+    assert mask.numblocks == (3, 3)
+    assert len(mask.dask.layers) == len(single.dask.layers)
+    np.testing.assert_array_equal(mask.compute(), geometry_mask(POLYGON, GEOBOX, invert=True))
+
+
+def test_mask_to_polygon_numpy():
+    data, values = make_data((1, 2, 2))
+    data = data.compute()
+    masked = mask_to_polygon(data, POLYGON)
+    expected = geometry_mask(POLYGON, GEOBOX, invert=True)
+    np.testing.assert_array_equal(masked.band.values, np.where(expected, values, -999))
@@ -0,0 +1,58 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from datacube_wps.pool import DatacubePool
+
+
+class FakeDatacube:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_reuse():
+    pool = DatacubePool(size=2, factory=FakeDatacube)
+
+    with pool.datacube() as first:
+        pass
+    with pool.datacube() as second:
+        assert second is first
+
+    with pool.datacube() as first:
+        with pool.datacube() as second:
+            assert second is not first
+
+
+def test_discard_on_database_error():
+    pool = DatacubePool(size=1, factory=FakeDatacube)
+
+    with pytest.raises(OperationalError):
+        with pool.datacube() as broken:
+            raise OperationalError("SELECT 1", {}, Exception("connection reset"))
+
+    assert broken.closed
+    with pool.datacube() as dc:
+        assert dc is not broken
+
+
+def test_release_on_other_error():
+    pool = DatacubePool(size=1, timeout=0.01, factory=FakeDatacube)
+
+    with pytest.raises(ValueError):
+        with pool.datacube() as first:
+            raise ValueError("bad request")
+
+    assert not first.closed
+    with pool.datacube() as dc:
+        assert dc is first
+
+
+def test_timeout():
+    pool = DatacubePool(size=1, timeout=0.01, factory=FakeDatacube)
+
+    with pool.datacube():
+        with pytest.raises(RuntimeError):
+            with pool.datacube():
+                pass
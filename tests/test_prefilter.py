@@ -0,0 +1,81 @@
+import numpy as np
+import pandas
+import xarray
+from affine import Affine
+from datacube.utils.geometry import CRS, GeoBox, Geometry
+from datacube.virtual.impl import VirtualDatasetBox
+
+from datacube_wps.processes import PolygonDrill
+
+from tests.test_pool import FakeDatacube
+
+GEOBOX = GeoBox(4, 4, Affine(30.0, 0, 0, 0, -30.0, 120.0), CRS("EPSG:3577"))
+TIMES = pandas.date_range("2000-01-01", periods=3)
+
+# the left half of the geobox
+POLYGON = Geometry({"type": "Polygon", "coordinates": [[(0, 0), (60, 0), (60, 120), (0, 120), (0, 0)]]},
+                   crs=CRS("EPSG:3577"))
+
+
+def make_box(times):
+    grouped = xarray.DataArray(np.empty(len(times), dtype=object), dims=["time"], coords={"time": times})
+    return VirtualDatasetBox(grouped, GEOBOX, False, {})
+
+
+class ValidProduct:
+    """Stand-in for the prefilter virtual product"""
+
+    def __init__(self, valid):
+        self.data = xarray.Dataset({"valid": (("time", "y", "x"), valid, {"nodata": 0})},
+                                   coords={"time": TIMES, **GEOBOX.xr_coords(with_crs=True)})
+
+    def query(self, dc, **search_terms):
+        return None
+
+    def group(self, bag, **group_settings):
+        return make_box(TIMES)
+
+    def fetch(self, grouped, **load_settings):
+        return self.data.sel(time=grouped.box.time.data)
+
+
+class ReprojectedValidProduct(ValidProduct):
+    """Stand-in for a reprojected prefilter virtual product, which loads natively"""
+
+    def group(self, bag, **group_settings):
+        return VirtualDatasetBox(make_box(TIMES).box, GEOBOX, True, {}, geopolygon=POLYGON)
+
+
+def make_drill(valid, product_class=ValidProduct):
+    about = {"identifier": "prefilter", "title": "Prefilter"}
+    drill = PolygonDrill(about, None, {}, prefilter={"input": product_class(valid), "threshold": 0.5})
+    drill.dask_enabled = False
+    return drill
+
+
+def test_prefilter_drops_mostly_invalid_time_slices():
+    valid = np.zeros((3, 4, 4), dtype="uint8")
+    valid[0, :, :2] = 1
+    valid[1, :, 2:] = 1   # outside the polygon
+    valid[2, :3, :2] = 1
+
+    box = make_drill(valid).prefilter_box(FakeDatacube(), make_box(TIMES), None, POLYGON)
+    assert list(box.box.time.data) == [TIMES[0], TIMES[2]]
+
+
+def test_prefilter_keeps_time_slices_it_knows_nothing_about():
+    valid = np.zeros((3, 4, 4), dtype="uint8")
+    times = TIMES.append(pandas.DatetimeIndex(["2001-01-01"]))
+
+    box = make_drill(valid).prefilter_box(FakeDatacube(), make_box(times), None, POLYGON)
+    assert list(box.box.time.data) == [times[3]]
+
+
+def test_prefilter_of_reprojected_products():
+    valid = np.zeros((3, 4, 4), dtype="uint8")
+    valid[1, :, :2] = 1
+
+    box = VirtualDatasetBox(make_box(TIMES).box, GEOBOX, True, {}, geopolygon=POLYGON)
+    box = make_drill(valid, ReprojectedValidProduct).prefilter_box(FakeDatacube(), box, None, POLYGON)
+    assert list(box.box.time.data) == [TIMES[1]]
+    assert box.load_natively
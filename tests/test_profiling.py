@@ -0,0 +1,86 @@
+import importlib.util
+import json
+from types import SimpleNamespace
+
+import dask.array
+import pytest
+from dask.distributed import Client, LocalCluster
+
+from datacube_wps import profiling
+
+
+@pytest.fixture
+def profiling_config(monkeypatch):
+    settings = {"enabled": True, "processes": "", "token": ""}
+    monkeypatch.setattr(profiling.config, "get_config_value",
+                        lambda section, option, default_value="": settings.get(option, default_value)
+                        if section == "profiling" else default_value)
+    return settings
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    stored = {}
+
+    def put(key, body):
+        stored[key] = body
+        return f"s3://bucket/{key}"
+
+    monkeypatch.setattr(profiling.S3_UPLOADER, "put", put)
+    return stored
+
+
+def test_profile_requested():
+    assert profiling.profile_requested(SimpleNamespace(), {}) is None
+
+    parameters = {"profile": True, "aggregate": 0}
+    assert profiling.profile_requested(SimpleNamespace(), parameters) is True
+    assert parameters == {"aggregate": 0}
+
+    request = SimpleNamespace(http_request=SimpleNamespace(headers={profiling.PROFILE_HEADER: "secret"}))
+    assert profiling.profile_requested(request, {}) == "secret"
+
+
+def test_profile_allowed(profiling_config):
+    assert profiling.profile_allowed("WIT", "1")
+    assert not profiling.profile_allowed("WIT", None)
+
+    profiling_config["processes"] = "FCDrill, WIT"
+    assert profiling.profile_allowed("WIT", "1")
+    assert not profiling.profile_allowed("WOfSDrill", "1")
+
+    profiling_config["token"] = "secret"
+    assert profiling.profile_allowed("WIT", "secret")
+    assert not profiling.profile_allowed("WIT", "1")
+
+    profiling_config["enabled"] = False
+    assert not profiling.profile_allowed("WIT", "secret")
+
+
+def test_not_profiled_unless_allowed(profiling_config, uploads):
+    profiling_config["enabled"] = False
+    with profiling.request_profiling("WIT", "uuid", "1") as profiler:
+        assert not profiling.profiling()
+    assert profiler is None
+    assert uploads == {}
+
+
+def test_request_profile_artefacts(profiling_config, uploads):
+    cluster = LocalCluster(n_workers=1, processes=False, dashboard_address=None)
+    client = Client(cluster)
+    try:
+        with profiling.request_profiling("WIT", "uuid", "1") as profiler:
+            assert profiling.profiling()
+            assert dask.array.ones((100, 100), chunks=10).sum().compute() == 10000
+    finally:
+        client.close()
+        cluster.close()
+
+    assert not profiling.profiling()
+    expected = ["cpu.prof", "cpu.txt", "memory.json"]
+    if importlib.util.find_spec("bokeh") is not None:
+        expected.insert(2, "dask-report.html")
+    assert sorted(profiler.artefacts) == expected
+    assert profiler.artefacts["cpu.txt"] == "s3://bucket/profiles/WIT/uuid/cpu.txt"
+    assert json.loads(uploads["profiles/WIT/uuid/memory.json"])["tracemalloc_peak_bytes"] > 0
+    assert b"function calls" in uploads["profiles/WIT/uuid/cpu.txt"]
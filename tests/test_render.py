@@ -0,0 +1,39 @@
+import altair as alt
+import pandas
+
+from datacube_wps.processes import _get_chart_outputs
+from datacube_wps.render import ChartRenderer, save_chart
+
+TEST_CHART = (
+    alt.Chart(pandas.DataFrame({"time": pandas.date_range("2019-01-01", periods=3), "bs": [1, 2, 3]}))
+    .mark_area()
+    .encode(x="time:T", y="bs:Q")
+)
+
+
+class requests_mock_outputs:
+    def __init__(self, outputs):
+        self.outputs = {ident: {} for ident in outputs}
+
+
+def test_save_chart():
+    assert save_chart(TEST_CHART.to_dict(), "svg").startswith("<svg")
+
+
+def test_render_in_pool():
+    renderer = ChartRenderer(processes=1)
+    assert renderer.render(TEST_CHART, "svg") == save_chart(TEST_CHART.to_dict(), "svg")
+
+
+def test_render_processes(monkeypatch):
+    monkeypatch.delenv("DATACUBE_WPS_RENDER_PROCESSES", raising=False)
+    assert ChartRenderer().processes == 1
+
+    monkeypatch.setenv("DATACUBE_WPS_RENDER_PROCESSES", "3")
+    assert ChartRenderer().processes == 3
+
+
+def test_requested_chart_outputs():
+    assert _get_chart_outputs(requests_mock_outputs([])) == ("image", "url")
+    assert _get_chart_outputs(requests_mock_outputs(["timeseries"])) == ()
+    assert _get_chart_outputs(requests_mock_outputs(["timeseries", "url"])) == ("url",)
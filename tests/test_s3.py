@@ -5,8 +5,10 @@ from moto import mock_s3
 from vega_datasets import data
 import pytest
 
+import datacube_wps.s3
 from datacube_wps.processes import (upload_chart_html_to_S3,
                                     upload_chart_svg_to_S3)
+from datacube_wps.s3 import S3Access, S3Uploader
 
 TEST_CHART = chart = (
         alt.Chart(data.cars.url)
@@ -16,6 +18,7 @@ TEST_CHART = chart = (
 
 TEST_CFG = "pywps.cfg"
 
+
 @pytest.mark.skip(reason="Skip S3 tests for now")
 @mock_s3
 def test_s3_svg_chart_upload():
@@ -25,7 +28,8 @@ def test_s3_svg_chart_upload():
     location = {'LocationConstraint': region}
     client = boto3.client("s3", region_name=region)
     client.create_bucket(Bucket=bucket, CreateBucketConfiguration=location)
-    upload_chart_svg_to_S3(TEST_CHART, "abcd")
+    upload_chart_svg_to_S3(TEST_CHART, "abcd", "test")
+
 
 @pytest.mark.skip(reason="Skip S3 tests for now")
 @mock_s3
@@ -36,4 +40,65 @@ def test_s3_html_chart_upload():
     location = {'LocationConstraint': region}
     client = boto3.client("s3", region_name=region)
     client.create_bucket(Bucket=bucket, CreateBucketConfiguration=location)
-    upload_chart_html_to_S3(TEST_CHART, "abcd")
+    upload_chart_html_to_S3(TEST_CHART, "abcd", "test")
+
+
+class ExpiringCredentials:
+    def __init__(self, expiring):
+        self.expiring = expiring
+
+    def refresh_needed(self, refresh_in=None):
+        return self.expiring
+
+
+def test_s3_access_configured_once(monkeypatch):
+    calls = []
+
+    def fake_configure(client=None, **kwargs):
+        calls.append(client)
+        return None
+
+    monkeypatch.setattr(datacube_wps.s3, "configure_s3_access", fake_configure)
+    access = S3Access()
+    client = object()
+
+    access.configure(client)
+    access.configure(client)
+    assert calls == [client]
+
+    access.configure(None)
+    assert calls == [client, None]
+
+
+def test_s3_access_refresh(monkeypatch):
+    calls = []
+
+    def fake_configure(client=None, **kwargs):
+        calls.append(client)
+        return ExpiringCredentials(expiring=len(calls) == 1)
+
+    monkeypatch.setattr(datacube_wps.s3, "configure_s3_access", fake_configure)
+    access = S3Access()
+
+    access.configure()
+    access.configure()
+    access.configure()
+    assert len(calls) == 2
+
+
+@mock_s3
+def test_s3_uploader_put(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "ap-southeast-2")
+    config.load_configuration(TEST_CFG)
+    bucket = config.get_config_value("s3", "bucket")
+    region = config.get_config_value("s3", "region")
+    client = boto3.client("s3", region_name=region)
+    client.create_bucket(Bucket=bucket, CreateBucketConfiguration={'LocationConstraint': region})
+
+    uploader = S3Uploader(threads=2)
+    futures = [uploader.submit(uploader.put, f"wit/{n}.parquet", b"data") for n in range(4)]
+    assert [future.result() for future in futures] == [f"s3://{bucket}/wit/{n}.parquet" for n in range(4)]
+    assert uploader.clients() is uploader.clients()
+    assert client.get_object(Bucket=bucket, Key="wit/3.parquet")["Body"].read() == b"data"
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas
+import pytest
+import xarray
+from datacube.model import Measurement
+from datacube.virtual.impl import VirtualDatasetBox
+from prometheus_client import REGISTRY
+
+from datacube_wps.pool import DatacubePool
+from datacube_wps.processes import PolygonDrill, _box_bytes, _query_result, _render_outputs
+
+from tests.test_pool import FakeDatacube
+from tests.test_prefilter import GEOBOX, POLYGON, TIMES, make_box
+
+
+class Bag:
+    def contained_datasets(self):
+        return iter(range(5))
+
+
+class Input(dict):
+    """Stand-in for the virtual product of a drill"""
+
+    def query(self, dc, **search_terms):
+        return Bag()
+
+    def group(self, bag, **group_settings):
+        return make_box(TIMES)
+
+    def output_measurements(self, product_definitions):
+        return {"band": Measurement(name="band", dtype="int16", nodata=-1, units="1")}
+
+    def fetch(self, grouped, **load_settings):
+        band = np.ones((len(TIMES),) + GEOBOX.shape, dtype="int16")
+        return xarray.Dataset({"band": (("time", "y", "x"), band, {"nodata": -1})},
+                              coords={"time": TIMES, **GEOBOX.xr_coords(with_crs=True)})
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """A pool of a single Datacube for the worker, which cannot be waited for"""
+    pool = DatacubePool(size=1, timeout=0.01, factory=FakeDatacube)
+    monkeypatch.setattr("datacube_wps.pool._DATACUBE_POOL", [pool])
+    return pool
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_input_data_stages(pool):
+    about = {"identifier": "stages", "title": "Stages"}
+    drill = PolygonDrill(about, Input(), {})
+    drill.dask_enabled = False
+
+    stages = ["query", "group", "guard_rail", "fetch", "mask"]
+    before = [sample("wps_stage_seconds_count", process="stages", stage=stage) for stage in stages]
+    datasets = sample("wps_request_datasets_sum", process="stages")
+    byte_count = sample("wps_request_bytes_sum", process="stages")
+
+    drill.input_data(None, None, POLYGON)
+
+    after = [sample("wps_stage_seconds_count", process="stages", stage=stage) for stage in stages]
+    assert [a - b for a, b in zip(after, before)] == [1] * len(stages)
+    assert sample("wps_request_datasets_sum", process="stages") - datasets == 5
+    assert sample("wps_request_bytes_sum", process="stages") - byte_count == len(TIMES) * 4 * 4 * 2
+
+
+def test_box_bytes_of_reprojected_boxes():
+    # loaded natively, and reprojected to the geobox
+    box = VirtualDatasetBox(make_box(TIMES).box, GEOBOX, True, {}, geopolygon=POLYGON)
+    assert _box_bytes(Input(), box) == len(TIMES) * 4 * 4 * 2
+
+
+def test_render_outputs_serialise_stage():
+    before = sample("wps_stage_seconds_count", process="stages", stage="serialise")
+
+    df = pandas.DataFrame({"time": TIMES, "band": [1, 2, 3]})
+    outputs = _render_outputs("uuid", {}, df, None, "v7", identifier="stages")
+
+    assert "timeseries" in outputs
+    assert sample("wps_stage_seconds_count", process="stages", stage="serialise") - before == 1
+
+
+def test_wit_parquet_upload_stage(monkeypatch):
+    keys = []
+    monkeypatch.setattr("datacube_wps.processes.S3_UPLOADER.put", lambda key, body: keys.append(key) or key)
+    before = sample("wps_stage_seconds_count", process="WIT", stage="upload")
+
+    drill = PolygonDrill({"identifier": "WIT", "title": "WIT"}, Input(), {})
+    df = pandas.DataFrame({"time": TIMES, "band": [1, 2, 3]})
+    outputs = drill.render_outputs(df)
+
+    # the S3 key is lowercased, the metric keeps the process identifier
+    assert keys == [f"wit/{drill.uuid}/{drill.uuid}.snappy.parquet"]
+    assert outputs == {"url": {"data": keys[0]}}
+    assert sample("wps_stage_seconds_count", process="WIT", stage="upload") - before == 1
+
+
+class Fetching(Input):
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+
+    def fetch(self, grouped, **load_settings):
+        # raises if the request still holds the only Datacube of the pool
+        with self.pool.datacube():
+            pass
+        return super().fetch(grouped, **load_settings)
+
+
+def test_fetch_does_not_hold_a_pool_slot(pool, monkeypatch):
+    monkeypatch.setattr("datacube_wps.processes.result_cache", lambda: None)
+    monkeypatch.setattr("datacube_wps.processes.query_cache", lambda: None)
+    monkeypatch.setattr("datacube_wps.processes.S3_ACCESS.configure", lambda client=None: None)
+
+    class Drill(PolygonDrill):
+        def process_data(self, data, parameters):
+            return pandas.DataFrame({"time": data.time.data})
+
+    drill = Drill({"identifier": "pooled", "title": "Pooled"}, Fetching(pool), {})
+    drill.dask_enabled = False
+
+    df = _query_result(drill, None, POLYGON, {})
+    assert len(df) == len(TIMES)
@@ -0,0 +1,40 @@
+import dask.array
+import numpy as np
+import pandas
+import xarray
+
+from datacube_wps.processes import STREAM_SLICES, _process_data
+
+
+class CountingDrill:
+    def __init__(self, streaming):
+        self.streaming = streaming
+        self.calls = []
+
+    def process_data(self, data, parameters):
+        self.calls.append(data.sizes["time"])
+        return data.band.sum(["x", "y"]).to_dataframe().reset_index()[["time", "band"]]
+
+
+def make_data(times):
+    values = np.ones((times, 4, 4), dtype="int64")
+    return xarray.Dataset({"band": (("time", "y", "x"), dask.array.from_array(values, chunks=(1, 4, 4)))},
+                          coords={"time": pandas.date_range("2000-01-01", periods=times)})
+
+
+def test_streaming_reduces_groups_of_time_slices():
+    times = 2 * STREAM_SLICES + 1
+    drill = CountingDrill(streaming=True)
+    df = _process_data(drill, make_data(times), {})
+
+    assert drill.calls == [STREAM_SLICES, STREAM_SLICES, 1]
+    assert list(df.band) == [16] * times
+    assert df.time.is_monotonic_increasing
+
+
+def test_not_streaming_reduces_everything_at_once():
+    drill = CountingDrill(streaming=False)
+    df = _process_data(drill, make_data(STREAM_SLICES + 1), {})
+
+    assert drill.calls == [STREAM_SLICES + 1]
+    assert len(df) == STREAM_SLICES + 1
@@ -0,0 +1,105 @@
+import dask.array
+import numpy as np
+import pandas
+import xarray
+from affine import Affine
+from datacube.utils.geometry import CRS, GeoBox, Geometry
+from datacube.virtual.impl import VirtualDatasetBox
+
+from datacube_wps.processes import TILE_SIZE, TILES_IN_FLIGHT, _process_data, _tiles
+from datacube_wps.processes.kernels import FC_COUNTS, fc_counts_frame, fc_percentages
+
+CRS_ = CRS("EPSG:3577")
+
+
+def make_box(times, size):
+    geobox = GeoBox(size, size, Affine(30.0, 0, 0, 0, -30.0, 30.0 * size), CRS_)
+    grouped = xarray.DataArray(np.empty(times, dtype=object), dims=["time"],
+                               coords={"time": pandas.date_range("2000-01-01", periods=times)})
+    return VirtualDatasetBox(grouped, geobox, False, {})
+
+
+def square(x0, y0, x1, y1):
+    return Geometry({"type": "Polygon",
+                     "coordinates": [[(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)]]}, crs=CRS_)
+
+
+def test_small_polygons_are_not_tiled():
+    box = make_box(3, TILE_SIZE)
+    assert _tiles(box, square(0, 0, 30, 30)) == [box]
+
+
+def test_tiles_outside_the_polygon_are_left_out():
+    size = 2 * TILE_SIZE + 1
+    box = make_box(3, size)
+
+    tiles = _tiles(box, square(0, 30.0 * size - 10, 30.0 * size, 30.0 * size))
+    assert [tile.shape for tile in tiles] == [(3, TILE_SIZE, TILE_SIZE), (3, TILE_SIZE, TILE_SIZE), (3, TILE_SIZE, 1)]
+
+    tiles = _tiles(box, square(10, 10, 20, 20))
+    assert [tile.shape for tile in tiles] == [(3, 1, TILE_SIZE)]
+
+
+class CountingDrill:
+    streaming = False
+
+    def reduce_data(self, data, parameters):
+        return self.reduce_frame(data, self.reduce_lazy(data, parameters).compute(), parameters)
+
+    def reduce_lazy(self, data, parameters):
+        return dask.array.stack([dask.array.from_array(data[name].sum(["x", "y"]).values) for name in FC_COUNTS],
+                                axis=-1)
+
+    def reduce_frame(self, data, reduced, parameters):
+        return fc_counts_frame(data.time.data, reduced)
+
+    def finalise_data(self, df, parameters):
+        return fc_percentages(df.time.values, df[FC_COUNTS])
+
+
+TIMES = pandas.date_range("2000-01-01", periods=2)
+
+
+def tile(valid, bs):
+    return xarray.Dataset({name: (("time", "y", "x"), np.full((2, 1, 1), value))
+                           for name, value in zip(FC_COUNTS, [valid, valid, valid, 0, bs, 0, 0])},
+                          coords={"time": TIMES})
+
+
+def test_tiles_are_merged_per_time_slice():
+    df = _process_data(CountingDrill(), [tile(1, 1), tile(3, 0)], {})
+    assert list(df.time) == list(TIMES)
+    assert list(df.bs) == [25.0, 25.0]
+
+
+class Submitted:
+    def __init__(self, client, collection):
+        self.client = client
+        self.collection = collection
+
+    def result(self):
+        self.client.in_flight -= 1
+        return self.collection.compute()
+
+
+class Client:
+    """Stand-in for the dask client of a worker, which counts the computations in flight"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+    def compute(self, collection):
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        return Submitted(self, collection)
+
+
+def test_tiles_are_computed_a_few_at_a_time(monkeypatch):
+    client = Client()
+    monkeypatch.setattr("datacube_wps.processes.default_client", lambda: client)
+
+    df = _process_data(CountingDrill(), [tile(1, 1), tile(3, 0), tile(2, 2), tile(2, 0)], {})
+    assert list(df.bs) == [37.5, 37.5]
+    assert client.in_flight == 0
+    assert client.most_in_flight == TILES_IN_FLIGHT
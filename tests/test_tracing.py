@@ -0,0 +1,85 @@
+import dask.array
+import numpy as np
+import pandas
+import xarray
+
+from datacube_wps import tracing
+from datacube_wps.s3 import S3Uploader
+
+
+def make_tracer(monkeypatch, sample_rate=1.0):
+    exporter = tracing.InMemoryExporter()
+    monkeypatch.setattr(tracing, "TRACER", tracing.Tracer(sample_rate=sample_rate, exporters=[exporter]))
+    return exporter
+
+
+@tracing.traced
+def load(size):
+    with tracing.span("compute", size=size):
+        tracing.annotate(note="computing")
+    return xarray.Dataset({"band": (("y", "x"), dask.array.zeros((size, size), dtype="float32"))})
+
+
+@tracing.traced
+def drill(size):
+    return pandas.DataFrame({"time": [1, 2], "value": [3.0, 4.0]}), load(size)
+
+
+def test_summarise_does_not_compute():
+    data = xarray.Dataset({"band": (("y", "x"), dask.array.zeros((100000, 100000), dtype="int16"))})
+    assert tracing.summarise(data) == {"type": "Dataset", "sizes": {"y": 100000, "x": 100000},
+                                       "dtypes": {"band": "int16"}, "nbytes": 2 * 10**10}
+    assert tracing.summarise(np.zeros((2, 3)))["shape"] == [2, 3]
+    assert tracing.summarise("x" * 1000).endswith("...")
+    assert tracing.summarise(object()) == {"type": "object"}
+
+
+def test_traced_calls_are_nested(monkeypatch):
+    exporter = make_tracer(monkeypatch)
+
+    drill(4)
+
+    root, = exporter.spans
+    assert root.name == "drill"
+    assert root.attributes["size"] == 4
+    assert root.attributes["result"] == {"type": "tuple", "length": 2}
+
+    child, = root.children
+    assert child.name == "load"
+    assert child.attributes["result"]["nbytes"] == 4 * 4 * 4
+
+    compute, = child.children
+    assert compute.to_dict()["attributes"] == {"size": 4, "note": "computing"}
+    assert 0 <= compute.duration <= child.duration <= root.duration
+
+
+def test_unsampled_traces_are_not_recorded(monkeypatch):
+    exporter = make_tracer(monkeypatch, sample_rate=0.0)
+
+    _, data = drill(4)
+
+    assert data.sizes["x"] == 4
+    assert exporter.spans == []
+
+
+def test_spans_outside_a_trace_do_nothing(monkeypatch):
+    exporter = make_tracer(monkeypatch)
+
+    with tracing.span("orphan") as span:
+        tracing.annotate(ignored=True)
+    assert span is None
+    assert exporter.spans == []
+
+
+def test_uploads_are_part_of_the_trace(monkeypatch):
+    exporter = make_tracer(monkeypatch)
+    uploader = S3Uploader(threads=1)
+
+    @tracing.traced
+    def request():
+        return uploader.submit(load, 2).result()
+
+    request()
+
+    root, = exporter.spans
+    assert [child.name for child in root.children] == ["load"]
@@ -0,0 +1,64 @@
+import os
+from datetime import datetime, timezone
+
+import yaml
+from datacube.virtual.impl import Product
+
+from datacube_wps.impl import create_process
+from datacube_wps.virtual import TimeWindowedProduct, construct_product, intersect_time_windows
+
+UTC = timezone.utc
+
+
+def test_intersect_time_windows():
+    windows = [[None, "2003-05-31"], ["2010-01-01", "2013-05-31"]]
+
+    assert intersect_time_windows(windows, (datetime(2011, 1, 1), datetime(2020, 1, 1))) == [
+        (datetime(2011, 1, 1, tzinfo=UTC), datetime(2013, 5, 31, tzinfo=UTC))]
+    assert intersect_time_windows(windows, (datetime(2004, 1, 1), datetime(2009, 1, 1))) == []
+    assert intersect_time_windows(windows, None) == [
+        (None, datetime(2003, 5, 31, tzinfo=UTC)),
+        (datetime(2010, 1, 1, tzinfo=UTC), datetime(2013, 5, 31, tzinfo=UTC))]
+    assert intersect_time_windows([["2013-01-01", None]], (datetime(2000, 1, 1), datetime(2014, 1, 1))) == [
+        (datetime(2013, 1, 1, tzinfo=UTC), datetime(2014, 1, 1, tzinfo=UTC))]
+
+
+def leaves(product):
+    """The products a virtual product queries, as it constructs them"""
+    # pylint: disable=protected-access
+    if "product" in product:
+        return [product]
+    if "input" in product:
+        return leaves(product._input)
+    return [leaf for child in product._children for leaf in leaves(child)]
+
+
+def test_construct_product():
+    product = construct_product({
+        "juxtapose": [
+            {"collate": [{"product": "ls8", "time_windows": [["2013-01-01", None]]},
+                         {"product": "ls7"}]},
+            {"product": "wofs"},
+        ]
+    })
+
+    (collate, wofs) = product["juxtapose"]
+    (ls8, ls7) = collate["collate"]
+    assert isinstance(ls8, TimeWindowedProduct)
+    assert not isinstance(ls7, TimeWindowedProduct)
+    assert not isinstance(wofs, TimeWindowedProduct)
+
+    assert [type(leaf) for leaf in leaves(product)] == [TimeWindowedProduct, Product, Product]
+
+
+def test_catalog_constructs():
+    with open(os.path.join(os.path.dirname(__file__), "..", "datacube-wps-config.yaml"), encoding="utf-8") as fl:
+        catalog = yaml.safe_load(fl)
+
+    wit = next(settings for settings in catalog["processes"] if settings["about"]["identifier"] == "WIT")
+    process = create_process(**wit)
+    assert process.prefilter["threshold"] == 0.9
+
+    for product in (process.input, process.prefilter["input"]):
+        windowed = [leaf["product"] for leaf in leaves(product) if isinstance(leaf, TimeWindowedProduct)]
+        assert windowed == ["ga_ls8c_ard_3", "ga_ls7e_ard_3", "ga_ls5t_ard_3"]
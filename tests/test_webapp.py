@@ -2,6 +2,7 @@ import boto3
 import pytest
 from moto import mock_s3
 
+from datacube_wps import impl
 from datacube_wps.impl import create_app
 
 
@@ -15,6 +16,27 @@ def test_head(client):
     assert r.status_code == 200
 
 
+def test_catalog_built_once(monkeypatch):
+    calls = []
+    monkeypatch.setattr(impl, "create_service", lambda: calls.append(1) or "service")
+
+    client = create_app().test_client()
+    assert calls == [1]
+
+    for _ in range(2):
+        assert client.get('/').data == b"service"
+    assert calls == [1]
+
+
+def test_warm_up_failure_is_not_fatal(monkeypatch):
+    def unavailable():
+        raise RuntimeError("no index")
+
+    monkeypatch.setattr(impl, "datacube_pool", unavailable)
+    monkeypatch.setattr(impl.S3_UPLOADER, "clients", unavailable)
+    impl.warm_up()
+
+
 @pytest.mark.skip(reason="decoupling the webservice from the infra is hard")
 @mock_s3
 def test_wofs_webapp(client):
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas
+import xarray as xr
+
+from datacube_wps.processes.witprocess import TWnMask, WITMask, aggregate_over_time, window_sizes
+
+TIMES = pandas.to_datetime(["2000-01-01T10:00", "2000-01-01T10:05", "2000-01-03T00:00", "2000-01-05T23:00",
+                            "2000-01-06T00:00", "2000-01-20T00:00"]).values
+
+
+def make_masked(lazy=False):
+    dims = ("time", "y", "x")
+    tcw = np.array([-9999, 1, 2, 3, -9999, 5], dtype="float32").reshape(6, 1, 1)
+    water = np.array([0, 0, 1, 0, 0, 0], dtype="int16").reshape(6, 1, 1)
+    masked = xr.Dataset({"TCW": (dims, tcw, {"nodata": -9999}), "water": (dims, water, {"nodata": 0})},
+                        coords={"time": TIMES, "y": [0], "x": [0]})
+    return masked.chunk({"time": 1}) if lazy else masked
+
+
+def test_window_sizes():
+    assert list(window_sizes(TIMES, 1)) == [2, 1, 2, 1]
+    assert list(window_sizes(TIMES, 5)) == [5, 1]
+    assert list(window_sizes(TIMES[:1], 5)) == [1]
+
+
+def test_average_over_day():
+    for lazy in [False, True]:
+        aggregated = aggregate_over_time(make_masked(lazy), 1).compute()
+
+        assert list(aggregated.time.values) == list(TIMES[[0, 2, 3, 5]])
+        assert list(aggregated.TCW.values.ravel()) == [-9999, 2, -9999, 5]
+        assert list(aggregated.water.values.ravel()) == [0, 1, 0, 0]
+        assert aggregated.TCW.dtype == np.float32
+        assert aggregated.water.dtype == np.int16
+
+
+def test_aggregate_data():
+    for lazy in [False, True]:
+        aggregated = aggregate_over_time(make_masked(lazy), 5).compute()
+
+        assert list(aggregated.time.values) == list(TIMES[[0, 5]])
+        # the first valid TCW, and no later observations once the pixel is wet
+        assert list(aggregated.TCW.values.ravel()) == [1, 5]
+        assert list(aggregated.water.values.ravel()) == [0, 0]
+        assert aggregated.water.dtype == np.int16
+
+    masked = make_masked()
+    masked["TCW"][:2] = -9999
+    masked["water"][1] = 1
+    aggregated = aggregate_over_time(masked, 5)
+    assert list(aggregated.TCW.values.ravel()) == [-9999, 5]
+    assert list(aggregated.water.values.ravel()) == [1, 0]
+
+
+def test_twnmask():
+    dims = ("time", "y", "x")
+    bands = {key: (dims, np.full((1, 1, 4), 100, dtype="int16"), {"nodata": -999})
+             for key in ["blue", "green", "red", "nir", "swir1", "swir2"]}
+    bands["red"][1][0, 0, 3] = -999
+    bands["fmask"] = (dims, np.array([[[1, 2, 1, 1]]], dtype="uint8"))
+    bands["nbart_contiguity"] = (dims, np.array([[[1, 1, 1, 1]]], dtype="uint8"))
+    # clear, clear, wet, cloudy
+    bands["water"] = (dims, np.array([[[0, 0, 128, 64]]], dtype="uint8"))
+    data = xr.Dataset(bands, attrs={"crs": "EPSG:3577"})
+
+    for lazy in [False, True]:
+        result = TWnMask().compute(data.chunk({"x": 2}) if lazy else data).compute()
+
+        assert result.TCW.dtype == np.float32
+        np.testing.assert_allclose(result.TCW.values.ravel()[:3], -58.83, rtol=1e-5)
+        assert result.TCW.values.ravel()[3] == -9999
+        assert list(result.pmask.values.ravel()) == [True, False, False, False]
+        assert list(result.water.values.ravel()) == [0, 0, 1, 0]
+
+
+def test_witmask():
+    dims = ("time", "y", "x")
+    data = xr.Dataset({
+        "fmask": (dims, np.array([[[1, 2, 1, 1]]], dtype="uint8")),
+        "nbart_contiguity": (dims, np.array([[[1, 1, 1, 0]]], dtype="uint8")),
+        "water": (dims, np.array([[[0, 0, 128, 0]]], dtype="uint8")),
+    }, attrs={"crs": "EPSG:3577"})
+
+    valid = WITMask().compute(data).valid
+    assert list(valid.values.ravel()) == [1, 0, 1, 0]
@@ -0,0 +1,31 @@
+import numpy as np
+
+from datacube_wps.processes.wofsdrill import RULES, WOfSDrill, compile_rules, get_flags
+
+WATER_FLAGS = {
+    "nodata": {"bits": 0, "values": {"0": False, "1": True}},
+    "noncontiguous": {"bits": 1, "values": {"0": False, "1": True}},
+    "sea": {"bits": 2, "values": {"0": False, "1": True}},
+    "terrain_or_low_angle": {"bits": 3, "values": {"0": False, "1": True}},
+    "high_slope": {"bits": 4, "values": {"0": False, "1": True}},
+    "cloud_shadow": {"bits": 5, "values": {"0": False, "1": True}},
+    "cloud": {"bits": 6, "values": {"0": False, "1": True}},
+    "wet": {"bits": 7, "values": {"0": False, "1": True}},
+    "dry": {"bits": [7, 6, 5, 4, 3, 1, 0], "values": {"0": True}},
+}
+
+
+def test_compile_rules():
+    table = compile_rules(WATER_FLAGS, RULES)
+    assert table.shape == (256,)
+    assert all(table[val] == get_flags(WATER_FLAGS, RULES, val) for val in range(256))
+    assert table[0] == "dry"
+    assert table[128] == "wet"
+    assert table[128 | 64] == "not observable"
+    assert table[4] == "not observable"
+
+
+def test_observation_table_is_shared():
+    table = WOfSDrill.observation_table(WATER_FLAGS)
+    assert WOfSDrill.observation_table(dict(WATER_FLAGS)) is table
+    assert list(np.take(table, np.array([0, 128, 132, 1]))) == ["dry", "wet", "wet", "not observable"]